@@ -13,11 +13,15 @@
 
 import frappe
 from frappe import _
-from frappe.utils import flt, getdate, nowdate, add_months,now_datetime
+from frappe.utils import cint, flt, getdate, nowdate, add_months,now_datetime
 from datetime import datetime, date
 import calendar
 import json
 
+from redis.exceptions import LockError
+
+from cash_flow_app.utils import fifo_allocation
+
 # ── Cache TTL: 25 hours (ensures stale cache never persists past next cron) ──
 CACHE_TTL = 25 * 60 * 60  # 90000 seconds
 
@@ -30,29 +34,15 @@ def get_intelligence_data(force_refresh=0):
     """
     Returns all data for View 1: Intelligence Dashboard.
 
-    Cache Strategy:
-      - force_refresh=0 (default): Read from cache. If cache miss → compute live.
-      - force_refresh=1 (manual button): Always compute live, then update cache.
-
-    The 'force_refresh' param is passed from the JS "Refresh" button.
-    Normal page loads always hit cache.
+    Cache Strategy (segmented):
+      - KPI segment and per-customer debt segment are cached independently
+        and kept current by document hooks (rebuild / per-customer refresh),
+        so normal page loads are cache hits all day.
+      - Tier tables, tier debts and ROI are derived from the segments on read.
+      - force_refresh=1 (manual button): recompute both segments live.
     """
     try:
-        force = int(force_refresh or 0)
-        if not force:
-            cached = frappe.cache().get_value('fct_intelligence_data')
-            if cached:
-                data = json.loads(cached) if isinstance(cached, str) else cached
-                # Inject cache metadata so frontend knows it's cached
-                data['_from_cache'] = True
-                data['_cached_at'] = frappe.cache().get_value('fct_cache_timestamp') or ''
-                return data
-
-        # Cache miss or forced refresh → compute live
-        result = _build_and_cache_intelligence()
-        result['_from_cache'] = False
-        result['_cached_at'] = str(now_datetime())
-        return result
+        return _assemble_intelligence(force=int(force_refresh or 0))
     except Exception as e:
         frappe.log_error(f"Financial Control Tower - Intelligence Error: {str(e)}")
         return {"success": False, "error": str(e)}
@@ -63,139 +53,266 @@ def get_periodic_data(from_date=None, to_date=None, force_refresh=0):
     """
     Returns data for View 2: Periodic Analysis.
 
-    Cache Strategy:
-      - Caches the DEFAULT date range (last 12 months) at key 'fct_periodic_data'.
-      - Custom date ranges are ALWAYS computed live (not cached).
-      - force_refresh=1 bypasses cache even for default range.
+    Cache Strategy (segmented):
+      - Every month of the range is its own cached bucket (document series
+        and collection efficiency separately), so any date range is served
+        from cache and a document only invalidates the months it touches.
+      - force_refresh=1 recomputes all buckets of the range.
     """
     try:
         force = int(force_refresh or 0)
 
-        default_from = str(getdate(add_months(nowdate(), -12)))
-        default_to = str(getdate(nowdate()))
+        from_date = getdate(from_date or add_months(nowdate(), -12))
+        to_date = getdate(to_date or nowdate())
 
-        if not from_date:
-            from_date = default_from
-        if not to_date:
-            to_date = default_to
+        return _build_periodic_result(from_date, to_date, force=force)
 
-        is_default_range = (str(getdate(from_date)) == default_from and
-                            str(getdate(to_date)) == default_to)
+    except Exception as e:
+        frappe.log_error(f"Financial Control Tower - Periodic Error: {str(e)}")
+        return {"success": False, "error": str(e)}
 
-        # ── Try cache only for default date range ────────────────────────
-        if not force and is_default_range:
-            cached = frappe.cache().get_value('fct_periodic_data')
-            if cached:
-                data = json.loads(cached) if isinstance(cached, str) else cached
-                data['_from_cache'] = True
-                data['_cached_at'] = frappe.cache().get_value('fct_cache_timestamp') or ''
-                return data
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# CACHE SEGMENTS
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+#
+#   fct:seg:kpis                       {"built_at", "data": base KPIs}
+#   fct:seg:customers                  {"built_at", "data": {customer: debt row}}
+#   fct:seg:month:YYYY-MM:start:end    {"built_at", "data": IA / expense sums}
+#   fct:seg:coll:YYYY-MM               {"built_at", "data": {expected, actual}}
+#   fct:seg:gen                        counter, bumped by every hook job
+#
+# Segments are read-modify-written under SEGMENT_LOCK by the hook jobs.
+# Hook jobs run after commit and bump the generation first; a segment built
+# by a reader is only cached if the generation did not move while it was
+# computed, otherwise it may predate a commit the job already applied.
 
-        # ── Compute live ─────────────────────────────────────────────────
-        from_date = getdate(from_date)
-        to_date = getdate(to_date)
+SEG_KPIS = 'fct:seg:kpis'
+SEG_CUSTOMERS = 'fct:seg:customers'
+SEG_MONTH_PREFIX = 'fct:seg:month:'
+SEG_COLLECTION_PREFIX = 'fct:seg:coll:'
+SEGMENT_LOCK = 'fct:seg:lock'
+SEGMENT_GENERATION = 'fct:seg:gen'
 
-        result = _build_periodic_result(from_date, to_date)
 
-        # Only cache if it's the default range
-        if is_default_range:
-            frappe.cache().set_value('fct_periodic_data', json.dumps(result), expires_in_sec=CACHE_TTL)
+def _seg_get(key):
+    cached = frappe.cache().get_value(key)
+    if not cached:
+        return None
+    return json.loads(cached) if isinstance(cached, str) else cached
 
-        result['_from_cache'] = False
-        result['_cached_at'] = str(now_datetime())
-        return result
 
-    except Exception as e:
-        frappe.log_error(f"Financial Control Tower - Periodic Error: {str(e)}")
-        return {"success": False, "error": str(e)}
+def _seg_set(key, value):
+    frappe.cache().set_value(key, json.dumps(value, default=str), expires_in_sec=CACHE_TTL)
 
-# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-# INTERNAL: KPI Computation
-# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-# NEW: Internal builders that compute + cache
-# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
-def _build_and_cache_intelligence():
-    kpis = _compute_kpis()
-    roi_data = _compute_roi(kpis)
-    tier_tables = _compute_customer_tiers()
+def _new_segment(data):
+    return {"built_at": str(now_datetime()), "data": data}
 
-    # Tier debts — alohida SQL, tier listiga bog'liq emas
-    tier_debt = _compute_tier_debts()
+
+def _segment_lock():
+    return frappe.cache().lock(SEGMENT_LOCK, timeout=30, blocking_timeout=10)
+
+
+def _seg_generation():
+    value = frappe.cache().get(frappe.cache().make_key(SEGMENT_GENERATION))
+    return cint(value.decode() if isinstance(value, bytes) else value)
+
+
+def _bump_generation():
+    """Called by hook jobs (under SEGMENT_LOCK) before they touch segments"""
+    frappe.cache().incr(frappe.cache().make_key(SEGMENT_GENERATION))
+
+
+def _seg_set_built(segments, generation):
+    """
+    Cache segments computed on read, unless a hook job ran meanwhile
+
+    Args:
+        segments: {key: segment}
+        generation: _seg_generation() taken before the segments were computed
+    """
+    try:
+        with _segment_lock():
+            if _seg_generation() != generation:
+                return
+            for key, segment in segments.items():
+                _seg_set(key, segment)
+    except LockError:
+        # Lock olinmadi — keyingi o'qishda qayta hisoblanadi
+        pass
+
+
+def _month_key(d):
+    return f"{d.year}-{d.month:02d}"
+
+
+def _iter_months(from_date, to_date):
+    """Yield (year, month, start, end) for each month of the range, clipped to it"""
+    year, month = from_date.year, from_date.month
+    while (year, month) <= (to_date.year, to_date.month):
+        first = date(year, month, 1)
+        last = date(year, month, calendar.monthrange(year, month)[1])
+        yield year, month, max(first, from_date), min(last, to_date)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _get_kpi_segment(force=False):
+    segment = None if force else _seg_get(SEG_KPIS)
+    if segment:
+        return segment, True
+    generation = _seg_generation()
+    segment = _new_segment(_compute_kpis())
+    _seg_set_built({SEG_KPIS: segment}, generation)
+    return segment, False
+
+
+def _get_customer_segment(force=False):
+    segment = None if force else _seg_get(SEG_CUSTOMERS)
+    if segment:
+        return segment, True
+    generation = _seg_generation()
+    segment = _new_segment(_compute_customer_rows())
+    _seg_set_built({SEG_CUSTOMERS: segment}, generation)
+    return segment, False
+
+
+def _assemble_intelligence(force=False):
+    kpi_segment, kpi_hit = _get_kpi_segment(force)
+    customer_segment, customer_hit = _get_customer_segment(force)
+
+    kpis = dict(kpi_segment["data"])
+    rows = customer_segment["data"]
+
+    # Tier debts — har bir mijoz qatoridan, tier listiga bog'liq emas
+    tier_debt = _compute_tier_debts(rows)
     kpis["debt_a"] = tier_debt.get("A", 0)
     kpis["debt_b"] = tier_debt.get("B", 0)
     kpis["debt_c"] = tier_debt.get("C", 0)
     # total_debt o'zgarmaydi — _compute_kpis() da hisoblangan
 
-    result = {
+    return {
         "success": True,
         "kpis": kpis,
-        "roi": roi_data,
-        "tiers": tier_tables
+        "roi": _compute_roi(kpis),
+        "tiers": _compute_customer_tiers(rows),
+        "_from_cache": kpi_hit and customer_hit,
+        "_cached_at": min(kpi_segment["built_at"], customer_segment["built_at"])
     }
 
-    frappe.cache().set_value('fct_intelligence_data', json.dumps(result), expires_in_sec=CACHE_TTL)
-    frappe.cache().set_value('fct_cache_timestamp', str(now_datetime()), expires_in_sec=CACHE_TTL)
 
-    return result
+def _get_month_segments(from_date, to_date, force=False):
+    """
+    IA / expense bucket per month of the range (clipped at the range ends)
+
+    Missing buckets are computed together with one grouped query pair over
+    the span they cover, then cached individually.
+
+    Returns:
+        tuple: ([(year, month, data)], all_hit, oldest_built_at)
+    """
+    months = list(_iter_months(from_date, to_date))
+    segments = {}
+    missing = []
+    generation = _seg_generation()
+
+    for year, month, start, end in months:
+        key = f"{SEG_MONTH_PREFIX}{year}-{month:02d}:{start}:{end}"
+        segment = None if force else _seg_get(key)
+        if segment:
+            segments[(year, month)] = segment
+        else:
+            missing.append((year, month, start, end, key))
+
+    if missing:
+        computed = _compute_month_buckets(missing[0][2], missing[-1][3])
+        built = {}
+        for year, month, _start, _end, key in missing:
+            built[key] = segments[(year, month)] = _new_segment(
+                computed.get((year, month)) or _empty_month_bucket()
+            )
+        _seg_set_built(built, generation)
+
+    built_at = min((s["built_at"] for s in segments.values()), default=str(now_datetime()))
+    return (
+        [(year, month, segments[(year, month)]["data"]) for year, month, _s, _e in months],
+        not missing,
+        built_at
+    )
+
+
+def _get_collection_segments(from_date, to_date, force=False):
+    """
+    Collection efficiency bucket per due_date month of the range (whole months)
+
+    Returns:
+        tuple: ([(year, month, data)], all_hit, oldest_built_at)
+    """
+    months = [(year, month) for year, month, _s, _e in _iter_months(from_date, to_date)]
+    segments = {}
+    missing = []
+    generation = _seg_generation()
+
+    for year, month in months:
+        segment = None if force else _seg_get(f"{SEG_COLLECTION_PREFIX}{year}-{month:02d}")
+        if segment:
+            segments[(year, month)] = segment
+        else:
+            missing.append((year, month))
+
+    if missing:
+        computed = _compute_collection_months(missing)
+        built = {}
+        for year, month in missing:
+            built[f"{SEG_COLLECTION_PREFIX}{year}-{month:02d}"] = segments[(year, month)] = _new_segment(
+                computed.get((year, month)) or {"expected": 0.0, "actual": 0.0}
+            )
+        _seg_set_built(built, generation)
 
+    built_at = min((s["built_at"] for s in segments.values()), default=str(now_datetime()))
+    return [(year, month, segments[(year, month)]["data"]) for year, month in months], not missing, built_at
 
-def _build_periodic_result(from_date, to_date):
-    monthly_investment    = _get_monthly_investment(from_date, to_date)
-    collection_efficiency = _get_collection_efficiency(from_date, to_date)
-    net_profit            = _get_monthly_net_profit(from_date, to_date)
-    contract_count        = _get_monthly_contract_count(from_date, to_date)
-    monthly_sales         = _get_monthly_sales(from_date, to_date)
-    monthly_margin        = _get_monthly_margin(from_date, to_date)
+
+def _build_periodic_result(from_date, to_date, force=False):
+    month_buckets, months_hit, months_built_at = _get_month_segments(from_date, to_date, force)
+    collection_buckets, collection_hit, collection_built_at = _get_collection_segments(
+        from_date, to_date, force
+    )
 
     return {
         "success": True,
-        "monthly_investment":    monthly_investment,
-        "collection_efficiency": collection_efficiency,
-        "net_profit":            net_profit,
-        "contract_count":        contract_count,
-        "monthly_sales":         monthly_sales,
-        "monthly_margin":        monthly_margin,
+        "monthly_investment":    _get_monthly_investment(month_buckets),
+        "collection_efficiency": _get_collection_efficiency(collection_buckets),
+        "net_profit":            _get_monthly_net_profit(month_buckets),
+        "contract_count":        _get_monthly_contract_count(month_buckets),
+        "monthly_sales":         _get_monthly_sales(month_buckets),
+        "monthly_margin":        _get_monthly_margin(month_buckets),
         "date_range": {
             "from": str(from_date),
             "to":   str(to_date)
-        }
+        },
+        "_from_cache": months_hit and collection_hit,
+        "_cached_at": min(months_built_at, collection_built_at)
     }
 
-
-def _build_and_cache_periodic():
-    """
-    Computes default periodic data (last 12 months) and caches it.
-    Called by the 23:59 cron job.
-    """
-    from_date = getdate(add_months(nowdate(), -12))
-    to_date = getdate(nowdate())
-
-    result = _build_periodic_result(from_date, to_date)
-    frappe.cache().set_value('fct_periodic_data', json.dumps(result), expires_in_sec=CACHE_TTL)
-
-    return result
-
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # NEW: Scheduled Job Entry Point (23:59 Cron)
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 def rebuild_fct_cache():
     """
-    Pre-calculates ALL dashboard data and stores in Redis cache.
+    Re-computes ALL cache segments from source documents.
 
-    Called by hooks.py scheduler_events at 23:59 daily.
-    This is the ONLY time heavy SQL queries run automatically.
+    Called by hooks.py scheduler_events at 23:59 daily. During the day the
+    segments are kept current by on_document_change, so this is the drift
+    repair pass (and warms the default 12-month range).
 
-    Execution time: ~2-5 seconds (runs 6 SQL queries once).
     Cache TTL: 25 hours (ensures overlap past next cron cycle).
     """
     try:
         frappe.logger('fct').info("FCT Cache Rebuild: Starting 23:59 scheduled job...")
 
-        # ── Build intelligence data (KPIs + ROI + Tiers) ─────────────────
-        intel = _build_and_cache_intelligence()
+        # ── Build intelligence segments (KPIs + customer debts) ──────────
+        intel = _assemble_intelligence(force=True)
         frappe.logger('fct').info(
             f"FCT Cache Rebuild: Intelligence OK — "
             f"KPIs={bool(intel.get('kpis'))}, "
@@ -204,17 +321,16 @@ def rebuild_fct_cache():
             f"C={len(intel.get('tiers',{}).get('C',[]))}"
         )
 
-        # ── Build periodic data (default 12-month range) ────────────────
-        periodic = _build_and_cache_periodic()
+        # ── Build monthly buckets (default 12-month range) ──────────────
+        periodic = _build_periodic_result(
+            getdate(add_months(nowdate(), -12)), getdate(nowdate()), force=True
+        )
         frappe.logger('fct').info(
             f"FCT Cache Rebuild: Periodic OK — "
             f"Investment months={len(periodic.get('monthly_investment',[]))}, "
             f"Collection months={len(periodic.get('collection_efficiency',[]))}"
         )
 
-        # ── Store timestamp ──────────────────────────────────────────────
-        frappe.cache().set_value('fct_cache_timestamp', str(now_datetime()), expires_in_sec=CACHE_TTL)
-
         frappe.logger('fct').info("FCT Cache Rebuild: ✅ Complete")
 
     except Exception as e:
@@ -398,62 +514,9 @@ def _compute_roi(kpis):
         }
     }
 
-def _compute_tier_debts():
-    """
-    customer_classification bo'yicha jami qarzdorlik.
-    net_paid JOIN multiplication muammosi hal qilindi:
-    avval customer darajasida debt hisoblanadi,
-    keyin classification bo'yicha yig'iladi.
-    """
-    rows = frappe.db.sql("""
-        SELECT
-            COALESCE(cust.customer_classification, 'A') AS classification,
-            SUM(cust_debt.debt) AS total_debt
-        FROM (
-            SELECT
-                ia.customer,
-                (
-                    COALESCE(SUM(ia.custom_grand_total_with_interest), 0)
-                    - COALESCE(MAX(pe_agg.net_paid), 0)
-                ) AS debt
-            FROM `tabInstallment Application` ia
-            LEFT JOIN (
-                SELECT
-                    pe.party AS customer_ref,
-                    SUM(
-                        CASE
-                            WHEN pe.payment_type = 'Receive' THEN pe.received_amount
-                            WHEN pe.payment_type = 'Pay'     THEN -pe.received_amount
-                            ELSE 0
-                        END
-                    ) AS net_paid
-                FROM `tabPayment Entry` pe
-                WHERE pe.docstatus = 1
-                  AND pe.party_type = 'Customer'
-                GROUP BY pe.party
-            ) pe_agg ON pe_agg.customer_ref = ia.customer
-            WHERE ia.docstatus = 1
-            GROUP BY ia.customer
-        ) cust_debt
-        LEFT JOIN `tabCustomer` cust ON cust.name = cust_debt.customer
-        GROUP BY COALESCE(cust.customer_classification, 'A')
-    """, as_dict=True)
-
-    result = {"A": 0.0, "B": 0.0, "C": 0.0}
-    for row in rows:
-        cls = (row.classification or "A").strip().upper()
-        if cls in result:
-            result[cls] = flt(row.total_debt)
-        else:
-            result["A"] = flt(result["A"]) + flt(row.total_debt)
-    return result
-# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-# INTERNAL: Customer Tier Tables (Re-architected v2)
-# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-def _compute_customer_tiers():
+def _compute_customer_rows(customers=None):
     """
-    Builds 3 tier lists grouped by Customer.customer_classification.
+    Per-customer debt rows — the customer segment of the cache.
 
     ┌──────────────────────────────────────────────────────────────────────┐
     │ GROUPING: By CUSTOMER, not by contract.                            │
@@ -463,16 +526,27 @@ def _compute_customer_tiers():
     │ - Σ(PE.received_amount WHERE type='Receive') [payments received]   │
     │ + Σ(PE.received_amount WHERE type='Pay')     [refunds add back]    │
     │                                                                      │
-    │ Classification: Customer.customer_classification (A, B, or C)      │
-    │ Only customers with positive remaining debt are included.           │
+    │ All customers with a submitted IA are kept (also zero / negative    │
+    │ debt) so tier debts and tier tables derive from the same rows.      │
     └──────────────────────────────────────────────────────────────────────┘
 
-    Returns: { "A": [...], "B": [...], "C": [...] }
-    Each entry: { customer, customer_name, classification, total_debt,
-                  total_billed, total_paid, contract_count }
-    """
+    Args:
+        customers: Optional list of customers to recompute (None = all)
 
-    rows = frappe.db.sql("""
+    Returns: { customer: { customer_name, classification, total_billed,
+                           total_paid, total_debt, contract_count } }
+    """
+    ia_condition = ""
+    pe_condition = ""
+    values = {}
+    if customers is not None:
+        if not customers:
+            return {}
+        ia_condition = "AND ia.customer IN %(customers)s"
+        pe_condition = "AND pe.party IN %(customers)s"
+        values["customers"] = tuple(customers)
+
+    rows = frappe.db.sql(f"""
         SELECT
             ia.customer,
             MAX(ia.customer_name)                        AS customer_name,
@@ -515,51 +589,84 @@ def _compute_customer_tiers():
             FROM `tabPayment Entry` pe
             WHERE pe.docstatus = 1
               AND pe.party_type = 'Customer'
+              {pe_condition}
             GROUP BY pe.party
         ) pe_agg ON pe_agg.customer_ref = ia.customer
 
         WHERE ia.docstatus = 1
+        {ia_condition}
 
         /* GROUP BY only customer ID — never by customer_name or classification
            because customer_name can differ between IA records (renamed/typo)
            and that would create phantom duplicate groups */
         GROUP BY ia.customer
-
-        /* Only customers with positive remaining debt */
-        HAVING total_debt > 0
-
-        ORDER BY total_debt DESC
-    """, as_dict=True)
-
-    tiers = {"A": [], "B": [], "C": []}
+    """, values, as_dict=True)
 
     for row in rows:
-        classification = (row.classification or "").strip().upper()
+        if (row.classification or "").strip().upper() not in ("A", "B", "C") and flt(row.total_debt) > 0:
+            frappe.logger('fct').warning(
+                f"FCT: Customer '{row.customer}' has no classification, defaulted to A"
+            )
 
-        entry = {
-            "customer": row.customer,
+    return {
+        row.customer: {
             "customer_name": row.customer_name or row.customer,
-            "classification": classification,
+            "classification": (row.classification or "").strip().upper(),
             "total_billed": flt(row.total_billed),
             "total_paid": flt(row.net_paid),
             "total_debt": flt(row.total_debt),
             "contract_count": row.contract_count or 0
         }
+        for row in rows
+    }
 
-        if classification == "A":
-            tiers["A"].append(entry)
-        elif classification == "B":
-            tiers["B"].append(entry)
-        elif classification == "C":
-            tiers["C"].append(entry)
+
+def _compute_tier_debts(customer_rows):
+    """
+    customer_classification bo'yicha jami qarzdorlik.
+    Avval customer darajasida debt hisoblanadi (customer segment),
+    keyin classification bo'yicha yig'iladi.
+    """
+    result = {"A": 0.0, "B": 0.0, "C": 0.0}
+    for row in customer_rows.values():
+        cls = row["classification"] if row["classification"] in result else "A"
+        result[cls] = flt(result[cls]) + flt(row["total_debt"])
+    return result
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# INTERNAL: Customer Tier Tables (Re-architected v2)
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def _compute_customer_tiers(customer_rows):
+    """
+    Builds 3 tier lists grouped by Customer.customer_classification
+    from the customer segment.
+
+    Classification: Customer.customer_classification (A, B, or C)
+    Only customers with positive remaining debt are included.
+
+    Returns: { "A": [...], "B": [...], "C": [...] }
+    Each entry: { customer, customer_name, classification, total_debt,
+                  total_billed, total_paid, contract_count }
+    """
+    tiers = {"A": [], "B": [], "C": []}
+
+    rows = sorted(
+        ((customer, row) for customer, row in customer_rows.items() if flt(row["total_debt"]) > 0),
+        key=lambda item: flt(item[1]["total_debt"]),
+        reverse=True
+    )
+
+    for customer, row in rows:
+        entry = dict(row, customer=customer)
+        classification = entry["classification"]
+
+        if classification in tiers:
+            tiers[classification].append(entry)
         else:
             # ── Fallback: unclassified customers go to Tier A ────────
-            # This prevents data loss. Log for audit.
+            # This prevents data loss (logged when the segment is built).
             entry["classification"] = "A"
             tiers["A"].append(entry)
-            frappe.logger('fct').warning(
-                f"FCT: Customer '{row.customer}' has no classification, defaulted to A"
-            )
 
     return tiers
 
@@ -568,46 +675,138 @@ def _compute_customer_tiers():
 # INTERNAL: Periodic / Time-Series Data
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
-def _get_monthly_investment(from_date, to_date):
+def _empty_month_bucket():
+    return {
+        "contracts": 0,
+        "invested": 0.0,
+        "sales": 0.0,
+        "interest": 0.0,
+        "expenses": 0.0
+    }
+
+
+def _compute_month_buckets(from_date, to_date):
     """
-    Monthly investment = Σ(total_amount - downpayment_amount) per month.
-    Returns list of {month, year, label, amount}.
+    Per-month IA and expense sums for the range — one grouped query each.
+
+    IA (transaction_date month):
+      invested  = Σ(total_amount - downpayment_amount)
+      sales     = Σ(custom_grand_total_with_interest - downpayment_amount)
+      interest  = Σ(custom_total_interest)
+      contracts = COUNT(submitted IAs)
+
+    Expenses (posting_date month): Payment Entry rows where
+    party_type='Employee', party_name='Xarajat' and the linked
+    CounterpartyCategory has custom_expense_type='Xarajat'.
+
+    Returns: { (year, month): bucket }
     """
-    result = frappe.db.sql("""
+    values = {"from_date": from_date, "to_date": to_date}
+    buckets = {}
+
+    for r in frappe.db.sql("""
         SELECT
-            YEAR(ia.transaction_date) AS yr,
+            YEAR(ia.transaction_date)  AS yr,
             MONTH(ia.transaction_date) AS mo,
+            COUNT(*) AS contract_count,
             COALESCE(SUM(
                 COALESCE(ia.total_amount, 0) - COALESCE(ia.downpayment_amount, 0)
-            ), 0) AS invested
+            ), 0) AS invested,
+            COALESCE(SUM(
+                COALESCE(ia.custom_grand_total_with_interest, 0)
+                - COALESCE(ia.downpayment_amount, 0)
+            ), 0) AS sales,
+            COALESCE(SUM(COALESCE(ia.custom_total_interest, 0)), 0) AS interest
         FROM `tabInstallment Application` ia
         WHERE ia.docstatus = 1
           AND DATE(ia.transaction_date) BETWEEN %(from_date)s AND %(to_date)s
         GROUP BY YEAR(ia.transaction_date), MONTH(ia.transaction_date)
-        ORDER BY yr, mo
-    """, {"from_date": from_date, "to_date": to_date}, as_dict=True)
+    """, values, as_dict=True):
+        bucket = buckets.setdefault((r.yr, r.mo), _empty_month_bucket())
+        bucket["contracts"] = r.contract_count or 0
+        bucket["invested"] = flt(r.invested)
+        bucket["sales"] = flt(r.sales)
+        bucket["interest"] = flt(r.interest)
+
+    for r in frappe.db.sql("""
+        SELECT
+            YEAR(pe.posting_date)              AS yr,
+            MONTH(pe.posting_date)             AS mo,
+            SUM(
+                CASE
+                    WHEN pe.payment_type = 'Pay'     THEN pe.paid_amount
+                    WHEN pe.payment_type = 'Receive' THEN -pe.received_amount
+                    ELSE 0
+                END
+            )                                  AS monthly_expenses
+        FROM `tabPayment Entry` pe
+        INNER JOIN `tabCounterparty Category` cc
+            ON pe.custom_counterparty_category = cc.name
+        WHERE pe.docstatus = 1
+          AND cc.custom_expense_type = 'Xarajat'
+          AND pe.party_type = 'Employee'
+          AND pe.party_name = 'Xarajat'
+          AND DATE(pe.posting_date) BETWEEN %(from_date)s AND %(to_date)s
+        GROUP BY YEAR(pe.posting_date), MONTH(pe.posting_date)
+    """, values, as_dict=True):
+        buckets.setdefault((r.yr, r.mo), _empty_month_bucket())["expenses"] = flt(r.monthly_expenses)
+
+    return buckets
 
+
+def _month_label(year, month):
+    return f"{calendar.month_abbr[month]} {year}"
+
+
+def _get_monthly_investment(month_buckets):
+    """
+    Monthly investment = Σ(total_amount - downpayment_amount) per month.
+    Returns list of {month, year, label, amount}.
+    """
     return [
         {
-            "year": r.yr,
-            "month": r.mo,
-            "label": f"{calendar.month_abbr[r.mo]} {r.yr}",
-            "amount": flt(r.invested)
+            "year": year,
+            "month": month,
+            "label": _month_label(year, month),
+            "amount": flt(b["invested"])
         }
-        for r in result
+        for year, month, b in month_buckets if b["contracts"]
     ]
 
-def _get_collection_efficiency(from_date, to_date):
+def _compute_collection_months(months):
     """
-    FIFO-based collection efficiency.
+    FIFO-based collection efficiency for the given due_date months.
 
-    1. IA ga bog'liq Payment Schedule dan kutilgan to'lovlar olinadi
+    1. Faqat shu oylarda to'lov muddati bo'lgan IA lar olinadi
     2. Har bir IA uchun barcha to'lovlar FIFO bo'yicha schedule ga yoziladi
     3. Natija due_date OYLI bo'yicha aggregatlanadi (posting_date emas)
+
+    Args:
+        months: [(year, month)]
+
+    Returns: { (year, month): {expected, actual} }
     """
+    months = set(months)
+    if not months:
+        return {}
+
+    first = min(months)
+    last = max(months)
+    values = {
+        "from_date": date(first[0], first[1], 1),
+        "to_date": date(last[0], last[1], calendar.monthrange(last[0], last[1])[1])
+    }
 
-    # ── Step 1: Barcha submitted IA lar uchun payment schedule ──────────
-    schedules = frappe.db.sql("""
+    # IA lar ro'yxati: kamida bitta to'lovi shu oylar oralig'ida
+    ia_filter = """
+        SELECT DISTINCT ps_due.parent
+        FROM `tabPayment Schedule` ps_due
+        WHERE ps_due.parenttype = 'Installment Application'
+          AND ps_due.due_date BETWEEN %(from_date)s AND %(to_date)s
+    """
+
+    # ── Step 1: Tanlangan IA lar uchun to'liq payment schedule ──────────
+    schedules = frappe.db.sql(f"""
         SELECT
             ps.parent       AS ia_name,
             ps.due_date,
@@ -619,17 +818,17 @@ def _get_collection_efficiency(from_date, to_date):
           AND ia.docstatus = 1
           AND ps.due_date IS NOT NULL
           AND ps.payment_amount > 0
+          AND ps.parent IN ({ia_filter})
         ORDER BY ps.parent, ps.due_date ASC, ps.idx ASC
-    """, as_dict=True)
+    """, values, as_dict=True)
 
     if not schedules:
-        return []
+        return {}
 
-    # ── Step 2: Har bir IA uchun barcha to'lovlar (posting_date bo'yicha) ─
-    payments = frappe.db.sql("""
+    # ── Step 2: Shu IA lar bo'yicha to'langan summa (FIFO uchun pool) ───
+    payments = frappe.db.sql(f"""
         SELECT
-            ia.name                             AS ia_name,
-            pe.posting_date,
+            ia.name AS ia_name,
             SUM(
                 CASE
                     WHEN pe.payment_type = 'Receive' THEN pe.received_amount
@@ -637,239 +836,131 @@ def _get_collection_efficiency(from_date, to_date):
                     ELSE 0
                 END
             ) AS net_amount
-            FROM `tabPayment Entry` pe
-            INNER JOIN `tabInstallment Application` ia
+        FROM `tabPayment Entry` pe
+        INNER JOIN `tabInstallment Application` ia
             ON ia.sales_order = pe.custom_contract_reference
-            WHERE pe.docstatus = 1
-                AND pe.party_type = 'Customer'
-                AND pe.custom_contract_reference IS NOT NULL
-                AND pe.custom_contract_reference != ''
-                AND ia.docstatus = 1
-            GROUP BY ia.name, pe.posting_date
-            ORDER BY ia.name, pe.posting_date ASC
-        """, as_dict=True)
+        WHERE pe.docstatus = 1
+          AND pe.party_type = 'Customer'
+          AND pe.custom_contract_reference IS NOT NULL
+          AND pe.custom_contract_reference != ''
+          AND ia.docstatus = 1
+          AND ia.name IN ({ia_filter})
+        GROUP BY ia.name
+    """, values, as_dict=True)
 
     # ── Step 3: IA bo'yicha guruhlash ────────────────────────────────────
-    from collections import defaultdict
-
-    # schedules: { ia_name: [ {due_date, payment_amount, idx}, ... ] }
-    ia_schedules = defaultdict(list)
+    ia_schedules = {}
     for s in schedules:
-        ia_schedules[s.ia_name].append({
-            "due_date": s.due_date,
-            "scheduled": flt(s.payment_amount),
-            "applied": 0.0
-        })
+        ia_schedules.setdefault(s.ia_name, []).append(s)
 
-    # payments pool: { ia_name: total_paid }
-    ia_payments = defaultdict(float)
-    for p in payments:
-        ia_payments[p.ia_name] += flt(p.net_amount)
+    ia_payments = {p.ia_name: flt(p.net_amount) for p in payments}
 
-    # ── Step 4: FIFO reconcile — har bir IA uchun ───────────────────────
-    # due_date oyi bo'yicha: { "YYYY-MM": {expected, actual} }
+    # ── Step 4: FIFO reconcile — barcha IA lar bitta o'tishda ───────────
     month_map = {}
 
-    for ia_name, sched_list in ia_schedules.items():
-        balance = ia_payments.get(ia_name, 0.0)
-
-        for row in sched_list:
-            scheduled = row["scheduled"]
-            applied   = min(balance, scheduled)
-            balance   = max(0.0, balance - applied)
-
-            # Oylik kalit — due_date oyi
-            d = row["due_date"]
+    for allocation in fifo_allocation.allocate(ia_schedules, ia_payments).values():
+        for pos, d in enumerate(allocation.due_date):
             if isinstance(d, str):
                 d = getdate(d)
-            key = f"{d.year}-{d.month:02d}"
-
-            if key not in month_map:
-                month_map[key] = {
-                    "year": d.year,
-                    "month": d.month,
-                    "label": f"{calendar.month_abbr[d.month]} {d.year}",
-                    "expected": 0.0,
-                    "actual": 0.0
-                }
-            month_map[key]["expected"] += scheduled
-            month_map[key]["actual"]   += applied
-
-    # ── Step 5: date range filtri ────────────────────────────────────────
-    from_key = f"{from_date.year}-{from_date.month:02d}"
-    to_key   = f"{to_date.year}-{to_date.month:02d}"
-
-    sorted_months = sorted(
-        [m for m in month_map.values()
-         if f"{m['year']}-{m['month']:02d}" >= from_key
-         and f"{m['year']}-{m['month']:02d}" <= to_key],
-        key=lambda x: (x["year"], x["month"])
-    )
+            key = (d.year, d.month)
+            if key not in months:
+                continue
 
-    # ── Step 6: efficiency % qo'shish ────────────────────────────────────
-    for m in sorted_months:
-        if m["expected"] > 0:
-            m["efficiency_pct"] = round((m["actual"] / m["expected"]) * 100, 1)
-        else:
-            m["efficiency_pct"] = 100.0 if m["actual"] > 0 else 0.0
+            bucket = month_map.setdefault(key, {"expected": 0.0, "actual": 0.0})
+            bucket["expected"] += allocation.amount[pos]
+            bucket["actual"]   += allocation.paid(pos)
+
+    return month_map
 
-    return sorted_months
 
-def _get_monthly_net_profit(from_date, to_date):
+def _get_collection_efficiency(collection_buckets):
+    """
+    Collection efficiency per due_date month from the collection segments.
+    Months without scheduled installments are skipped.
+    """
+    result = []
+    for year, month, b in collection_buckets:
+        if b["expected"] <= 0:
+            continue
+
+        result.append({
+            "year": year,
+            "month": month,
+            "label": _month_label(year, month),
+            "expected": b["expected"],
+            "actual": b["actual"],
+            "efficiency_pct": round((b["actual"] / b["expected"]) * 100, 1)
+        })
+
+    return result
+
+def _get_monthly_net_profit(month_buckets):
     """
     Monthly Net Profit = Monthly Revenue - Monthly Expenses, per month.
 
     Revenue  = SUM(custom_total_interest) from submitted Installment Applications
                grouped by transaction_date month.
 
-    Expenses = SUM(paid_amount) from submitted Payment Entry rows where
-               party_type='Employee', party_name='Xarajat', and the linked
-               CounterpartyCategory has custom_expense_type='Xarajat',
-               grouped by posting_date month.
+    Expenses = Xarajat Payment Entry rows grouped by posting_date month.
 
-    A single LEFT JOIN on (yr, mo) ensures months with revenue but zero
-    expenses still appear, and the subtraction is done entirely in SQL via
-    SUM + GROUP BY — no Python loops, no second round-trip.
+    Only months with revenue (submitted IAs) are listed.
 
     Returns list of {year, month, label, amount}.
     """
-    result = frappe.db.sql("""
-        SELECT
-            rev.yr                                              AS yr,
-            rev.mo                                             AS mo,
-            COALESCE(rev.monthly_interest, 0)
-                - COALESCE(exp.monthly_expenses, 0)            AS net_profit
-        FROM (
-            SELECT
-                YEAR(ia.transaction_date)          AS yr,
-                MONTH(ia.transaction_date)         AS mo,
-                SUM(COALESCE(ia.custom_total_interest, 0)) AS monthly_interest
-            FROM `tabInstallment Application` ia
-            WHERE ia.docstatus = 1
-              AND DATE(ia.transaction_date) BETWEEN %(from_date)s AND %(to_date)s
-            GROUP BY YEAR(ia.transaction_date), MONTH(ia.transaction_date)
-        ) rev
-        LEFT JOIN (
-            SELECT
-                YEAR(pe.posting_date)              AS yr,
-                MONTH(pe.posting_date)             AS mo,
-                SUM(
-                    CASE
-                        WHEN pe.payment_type = 'Pay'     THEN pe.paid_amount
-                        WHEN pe.payment_type = 'Receive' THEN -pe.received_amount
-                        ELSE 0
-                    END
-                )                                  AS monthly_expenses
-            FROM `tabPayment Entry` pe
-            INNER JOIN `tabCounterparty Category` cc
-                ON pe.custom_counterparty_category = cc.name
-            WHERE pe.docstatus = 1
-              AND cc.custom_expense_type = 'Xarajat'
-              AND pe.party_type = 'Employee'
-              AND pe.party_name = 'Xarajat'
-              AND DATE(pe.posting_date) BETWEEN %(from_date)s AND %(to_date)s
-            GROUP BY YEAR(pe.posting_date), MONTH(pe.posting_date)
-        ) exp ON rev.yr = exp.yr AND rev.mo = exp.mo
-        ORDER BY rev.yr, rev.mo
-    """, {"from_date": from_date, "to_date": to_date}, as_dict=True)
-
     return [
         {
-            "year": r.yr,
-            "month": r.mo,
-            "label": f"{calendar.month_abbr[r.mo]} {r.yr}",
-            "amount": flt(r.net_profit)
+            "year": year,
+            "month": month,
+            "label": _month_label(year, month),
+            "amount": flt(b["interest"]) - flt(b["expenses"])
         }
-        for r in result
+        for year, month, b in month_buckets if b["contracts"]
     ]
-def _get_monthly_sales(from_date, to_date):
+def _get_monthly_sales(month_buckets):
     """
     Oylik savdo = SUM(custom_grand_total_with_interest - downpayment_amount)
     """
-    result = frappe.db.sql("""
-        SELECT
-            YEAR(ia.transaction_date)  AS yr,
-            MONTH(ia.transaction_date) AS mo,
-            COALESCE(SUM(
-                COALESCE(ia.custom_grand_total_with_interest, 0)
-                - COALESCE(ia.downpayment_amount, 0)
-            ), 0) AS sales
-        FROM `tabInstallment Application` ia
-        WHERE ia.docstatus = 1
-          AND DATE(ia.transaction_date) BETWEEN %(from_date)s AND %(to_date)s
-        GROUP BY YEAR(ia.transaction_date), MONTH(ia.transaction_date)
-        ORDER BY yr, mo
-    """, {"from_date": from_date, "to_date": to_date}, as_dict=True)
-
     return [
         {
-            "year": r.yr,
-            "month": r.mo,
-            "label": f"{calendar.month_abbr[r.mo]} {r.yr}",
-            "amount": flt(r.sales)
+            "year": year,
+            "month": month,
+            "label": _month_label(year, month),
+            "amount": flt(b["sales"])
         }
-        for r in result
+        for year, month, b in month_buckets if b["contracts"]
     ]
 
 
-def _get_monthly_margin(from_date, to_date):
+def _get_monthly_margin(month_buckets):
     """
     Oylik marja % = (custom_total_interest / savdo) * 100
     savdo = custom_grand_total_with_interest - downpayment_amount
     """
-    result = frappe.db.sql("""
-        SELECT
-            YEAR(ia.transaction_date)  AS yr,
-            MONTH(ia.transaction_date) AS mo,
-            COALESCE(SUM(ia.custom_total_interest), 0) AS total_interest,
-            COALESCE(SUM(
-                COALESCE(ia.custom_grand_total_with_interest, 0)
-                - COALESCE(ia.downpayment_amount, 0)
-            ), 0) AS sales
-        FROM `tabInstallment Application` ia
-        WHERE ia.docstatus = 1
-          AND DATE(ia.transaction_date) BETWEEN %(from_date)s AND %(to_date)s
-        GROUP BY YEAR(ia.transaction_date), MONTH(ia.transaction_date)
-        ORDER BY yr, mo
-    """, {"from_date": from_date, "to_date": to_date}, as_dict=True)
-
     return [
         {
-            "year": r.yr,
-            "month": r.mo,
-            "label": f"{calendar.month_abbr[r.mo]} {r.yr}",
+            "year": year,
+            "month": month,
+            "label": _month_label(year, month),
             "margin_pct": round(
-                (flt(r.total_interest) / flt(r.sales) * 100), 2
-            ) if flt(r.sales) > 0 else 0.0
+                (flt(b["interest"]) / flt(b["sales"]) * 100), 2
+            ) if flt(b["sales"]) > 0 else 0.0
         }
-        for r in result
+        for year, month, b in month_buckets if b["contracts"]
     ]
 
-def _get_monthly_contract_count(from_date, to_date):
+def _get_monthly_contract_count(month_buckets):
     """
     Monthly Contract Count = COUNT of Submitted Installment Applications per month.
     Returns list of {month, year, label, count}.
     """
-    result = frappe.db.sql("""
-        SELECT
-            YEAR(ia.transaction_date) AS yr,
-            MONTH(ia.transaction_date) AS mo,
-            COUNT(*) AS contract_count
-        FROM `tabInstallment Application` ia
-        WHERE ia.docstatus = 1
-          AND DATE(ia.transaction_date) BETWEEN %(from_date)s AND %(to_date)s
-        GROUP BY YEAR(ia.transaction_date), MONTH(ia.transaction_date)
-        ORDER BY yr, mo
-    """, {"from_date": from_date, "to_date": to_date}, as_dict=True)
-
     return [
         {
-            "year": r.yr,
-            "month": r.mo,
-            "label": f"{calendar.month_abbr[r.mo]} {r.yr}",
-            "count": r.contract_count or 0
+            "year": year,
+            "month": month,
+            "label": _month_label(year, month),
+            "count": b["contracts"]
         }
-        for r in result
+        for year, month, b in month_buckets if b["contracts"]
     ]
 
 
@@ -880,21 +971,15 @@ def _get_monthly_contract_count(from_date, to_date):
 def on_document_change(doc, method=None):
     """
     Called by hooks.py doc_events when:
-      - Payment Entry: on_submit, on_cancel
+      - Payment Entry: on_cancel (on_submit → payment_entry_events)
       - Installment Application: on_submit, on_cancel
       - Sales Order: on_submit, on_cancel
 
-    Two actions:
-      1. Clear server-side cache → next API call returns fresh data
-      2. Push WebSocket event → all open browsers auto-refresh
+    Schedules an incremental segment update after commit (apply_document_change)
+    instead of wiping the whole cache, so the next dashboard load is still a hit.
     """
     try:
-        _clear_fct_cache()
-
-        frappe.logger('fct').info(
-            f"FCT: Cache invalidated by {doc.doctype} {doc.name} ({method}). "
-            f"Dashboard will refresh on next manual load."
-        )
+        enqueue_document_change(doc, method)
 
     # ── REMOVED: frappe.publish_realtime() ───────────────────────────
     # Previously pushed 'fct_data_changed' which triggered ALL open
@@ -917,11 +1002,171 @@ def on_document_change(doc, method=None):
             'Financial Control Tower'
         )
 
+
+def enqueue_document_change(doc, method):
+    """Queue apply_document_change for one document event (after commit)"""
+    frappe.enqueue(
+        "cash_flow_app.cash_flow_management.api.financial_control_tower_api.apply_document_change",
+        queue="short",
+        job_id=f"fct_segment_update::{doc.doctype}::{doc.name}::{method}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        doctype=doc.doctype,
+        docname=doc.name,
+        method=method
+    )
+
+
+def apply_document_change(doctype, docname, method):
+    """
+    Job: update cache segments for one submitted / cancelled document.
+
+      - KPI segment        → rebuilt (the job runs after commit, so the
+                             rebuild includes the document exactly once)
+      - customer segment   → the document's customer row is recomputed
+      - month buckets      → only the affected months are invalidated
+                             (lazily rebuilt on the next read)
+    """
+    doc = frappe.get_doc(doctype, docname)
+
+    with _segment_lock():
+        _bump_generation()
+        if doctype == "Payment Entry":
+            _apply_payment_entry_change(doc)
+        elif doctype == "Installment Application":
+            _apply_installment_application_change(doc)
+        _rebuild_kpi_segment()
+
+    frappe.logger('fct').info(
+        f"FCT: Segments updated by {doctype} {docname} ({method})."
+    )
+
+
+def _apply_payment_entry_change(doc):
+    if doc.party_type == "Customer":
+        _refresh_customer_rows([doc.party])
+        if doc.custom_contract_reference:
+            _invalidate_collection_months(
+                _affected_collection_months(doc.custom_contract_reference, abs(flt(doc.received_amount)))
+            )
+
+    elif doc.party_type == "Employee" and doc.party_name == "Xarajat" and doc.custom_counterparty_category \
+            and frappe.db.get_value(
+                "Counterparty Category", doc.custom_counterparty_category, "custom_expense_type"
+            ) == "Xarajat":
+        _invalidate_months([doc.posting_date])
+
+
+def _apply_installment_application_change(doc):
+    _refresh_customer_rows([doc.customer])
+    _invalidate_months([doc.transaction_date])
+    _invalidate_collection_months([row.due_date for row in doc.get("payment_schedule") or []])
+
+
+def _rebuild_kpi_segment():
+    """Recompute the KPI segment if it is cached (otherwise the next read builds it)"""
+    if _seg_get(SEG_KPIS):
+        _seg_set(SEG_KPIS, _new_segment(_compute_kpis()))
+
+
+def _refresh_customer_rows(customers):
+    """Recompute the given customers' rows in the customer segment"""
+    customers = [c for c in customers if c]
+    segment = _seg_get(SEG_CUSTOMERS)
+    if not segment or not customers:
+        return
+
+    fresh = _compute_customer_rows(customers)
+    for customer in customers:
+        if customer in fresh:
+            segment["data"][customer] = fresh[customer]
+        else:
+            segment["data"].pop(customer, None)
+    _seg_set(SEG_CUSTOMERS, segment)
+
+
+def on_classification_change(classifications):
+    """
+    Keep the customer segment's tiers in sync when classifications change
+
+    Args:
+        classifications: {customer: new_classification}
+    """
+    try:
+        with _segment_lock():
+            _bump_generation()
+            segment = _seg_get(SEG_CUSTOMERS)
+            if not segment:
+                return
+            for customer, classification in classifications.items():
+                if customer in segment["data"]:
+                    segment["data"][customer]["classification"] = (classification or "").strip().upper()
+            _seg_set(SEG_CUSTOMERS, segment)
+    except Exception as e:
+        frappe.log_error(f"FCT classification sync error: {str(e)}", 'Financial Control Tower')
+
+
+def _affected_collection_months(sales_order, amount):
+    """
+    Due months whose FIFO allocation can change when `amount` is added to or
+    removed from the contract's paid pool: installments overlapping
+    [paid - amount, paid + amount] on the cumulative schedule.
+    """
+    ia_name = frappe.db.get_value(
+        "Installment Application", {"sales_order": sales_order, "docstatus": 1}, "name"
+    )
+    if not ia_name:
+        return []
+
+    schedule = frappe.db.sql("""
+        SELECT idx, due_date, payment_amount
+        FROM `tabPayment Schedule`
+        WHERE parent = %(ia)s
+          AND parenttype = 'Installment Application'
+          AND due_date IS NOT NULL
+          AND payment_amount > 0
+        ORDER BY due_date ASC, idx ASC
+    """, {"ia": ia_name}, as_dict=True)
+
+    paid = flt(frappe.db.sql("""
+        SELECT COALESCE(SUM(
+            CASE
+                WHEN payment_type = 'Receive' THEN received_amount
+                WHEN payment_type = 'Pay'     THEN -received_amount
+                ELSE 0
+            END
+        ), 0)
+        FROM `tabPayment Entry`
+        WHERE docstatus = 1
+          AND party_type = 'Customer'
+          AND custom_contract_reference = %(so)s
+    """, {"so": sales_order})[0][0])
+
+    allocation = fifo_allocation.ContractAllocation(ia_name, schedule, paid)
+    low, high = paid - amount, paid + amount
+    return [
+        allocation.due_date[pos]
+        for pos in range(len(allocation.amount))
+        if allocation.cumulative[pos] >= low and allocation.cumulative[pos] - allocation.amount[pos] <= high
+    ]
+
+
+def _invalidate_months(dates):
+    for d in {_month_key(getdate(d)) for d in dates if d}:
+        frappe.cache().delete_keys(f"{SEG_MONTH_PREFIX}{d}")
+
+
+def _invalidate_collection_months(dates):
+    for d in {_month_key(getdate(d)) for d in dates if d}:
+        frappe.cache().delete_value(f"{SEG_COLLECTION_PREFIX}{d}")
+
+
 def _clear_fct_cache():
-    """Clear all Financial Control Tower cache keys."""
+    """Clear all Financial Control Tower cache keys (segments included)."""
     cache_keys = [
         'fct_intelligence_data',
         'fct_periodic_data',
+        'fct_cache_timestamp',
         'fct_kpis',
         'fct_roi',
         'fct_tiers',
@@ -934,6 +1179,10 @@ def _clear_fct_cache():
             frappe.cache().delete_value(key)
         except Exception:
             pass
+    try:
+        frappe.cache().delete_keys('fct:seg:')
+    except Exception:
+        pass
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # NEW ENDPOINT: Contract Installment Analysis (v4.1)
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -1099,36 +1348,25 @@ def _fifo_reconcile(schedule, payments):
     └──────────────────────────────────────────────────────────────────────┘
     """
     # Pool all payments into a single balance
-    balance = sum(flt(p.received_amount) for p in payments)
+    allocation = fifo_allocation.ContractAllocation(
+        None, schedule, sum(flt(p.received_amount) for p in payments)
+    )
+    status_labels = {"paid": "Paid", "partial": "Partially Paid", "unpaid": "Unpaid"}
 
     reconciled = []
 
-    for row in schedule:
-        scheduled = flt(row.payment_amount)
-
-        # Apply whatever we can from the running balance
-        applied = min(balance, scheduled)
-        balance -= applied
-        # Ensure no floating-point drift below zero
-        balance = max(0, balance)
-
-        remaining = scheduled - applied
-
-        # Determine status
-        if applied >= scheduled and scheduled > 0:
-            status = "Paid"
-        elif applied > 0:
-            status = "Partially Paid"
-        else:
+    for row in allocation.installments():
+        status = status_labels[row["status"]]
+        if status == "Paid" and row["amount"] <= 0:
             status = "Unpaid"
 
         reconciled.append({
-            "due_date": str(row.due_date),
-            "scheduled_amount": scheduled,
-            "paid_amount": round(applied, 2),
-            "balance": round(remaining, 2),
+            "due_date": str(row["due_date"]),
+            "scheduled_amount": row["amount"],
+            "paid_amount": round(row["paid"], 2),
+            "balance": round(row["outstanding"], 2),
             "status": status,
-            "idx": row.idx
+            "idx": row["idx"]
         })
 
     return reconciled
@@ -4,6 +4,12 @@
 import frappe
 from frappe.utils import getdate, nowdate, date_diff
 
+from cash_flow_app.cash_flow_management.api.financial_control_tower_api import on_classification_change
+from cash_flow_app.utils import bot_cache
+
+# Customers per bulk UPDATE statement in the scheduled classification job
+CLASSIFICATION_BATCH_SIZE = 1000
+
 @frappe.whitelist()
 def get_mode_account(mode_of_payment, company):
     """Get default account for mode of payment"""
@@ -163,6 +169,8 @@ def set_customer_classification(customer_name, classification):
 
 			frappe.db.commit()
 
+			on_classification_change({customer_name: classification})
+
 			frappe.msgprint(
 				f"Customer '{customer_name}' classification updated to '{classification}'",
 				alert=True,
@@ -176,19 +184,123 @@ def set_customer_classification(customer_name, classification):
 		)
 
 
+def get_max_days_overdue_by_customer():
+	"""
+	Barcha customerlar uchun eng katta kechikish (kun) - bitta grouped query
+
+	Sales Invoice va Sales Order Payment Schedule bo'yicha to'lanmagan,
+	muddati o'tgan qatorlar birlashtiriladi.
+
+	Returns:
+		dict: {customer: max_days_overdue}
+	"""
+	rows = frappe.db.sql("""
+		SELECT customer, MAX(days_overdue)
+		FROM (
+			SELECT
+				si.customer,
+				DATEDIFF(CURDATE(), si.due_date) as days_overdue
+			FROM
+				`tabSales Invoice` si
+			WHERE
+				si.docstatus = 1
+				AND si.status != 'Paid'
+				AND si.outstanding_amount > 0
+				AND si.due_date < CURDATE()
+
+			UNION ALL
+
+			SELECT
+				so.customer,
+				DATEDIFF(CURDATE(), ps.due_date) as days_overdue
+			FROM
+				`tabPayment Schedule` ps
+			INNER JOIN
+				`tabSales Order` so ON ps.parent = so.name
+			WHERE
+				so.docstatus = 1
+				AND ps.parenttype = 'Sales Order'
+				AND (ps.payment_amount - IFNULL(ps.paid_amount, 0)) > 0
+				AND ps.due_date < CURDATE()
+		) overdue
+		GROUP BY customer
+	""")
+
+	return {customer: int(days or 0) for customer, days in rows}
+
+
+def _bulk_set_classifications(changes):
+	"""
+	O'zgargan classificationlarni batch bilan yozish + audit comment
+
+	Args:
+		changes: list of (customer, old_classification, new_classification)
+	"""
+	now = frappe.utils.now()
+	user = frappe.session.user
+
+	by_classification = {}
+	for customer_name, _old, new in changes:
+		by_classification.setdefault(new, []).append(customer_name)
+
+	for classification, names in by_classification.items():
+		for start in range(0, len(names), CLASSIFICATION_BATCH_SIZE):
+			batch = names[start:start + CLASSIFICATION_BATCH_SIZE]
+			frappe.db.sql(f"""
+				UPDATE `tabCustomer`
+				SET customer_classification = %s, modified = %s, modified_by = %s
+				WHERE name IN ({", ".join(["%s"] * len(batch))})
+			""", (classification, now, user, *batch))
+
+	frappe.db.bulk_insert(
+		"Comment",
+		fields=["name", "comment_type", "reference_doctype", "reference_name", "content",
+			"comment_email", "creation", "modified", "owner", "modified_by"],
+		values=[
+			(frappe.generate_hash(length=10), "Info", "Customer", customer_name,
+				f"Classification changed: {old or 'A'} → {new}", user, now, now, user, user)
+			for customer_name, old, new in changes
+		]
+	)
+
+	on_classification_change({customer_name: new for customer_name, _old, new in changes})
+
+	# To'g'ridan-to'g'ri UPDATE - Customer hooklari ishlamaydi, bot keshini o'zimiz tozalaymiz
+	bot_cache.invalidate_customers(customer_name for customer_name, _old, _new in changes)
+
+
 @frappe.whitelist()
 def update_all_customers_classification():
-	"""Barcha customerlarning classification ni tekshiradi (Scheduled)"""
-	customers = frappe.get_all("Customer", fields=["name"])
-
-	for customer in customers:
-		try:
-			update_customer_classification(customer.name)
-		except Exception as e:
-			frappe.log_error(
-				message=f"Scheduled classification update error for {customer.name}: {str(e)}",
-				title="Customer Classification - Scheduled Error"
-			)
+	"""
+	Barcha customerlarning classification ni tekshiradi (Scheduled)
+
+	Set-based: kechikishlar bitta grouped query bilan hisoblanadi, faqat
+	o'zgargan A/B/C qiymatlar bulk UPDATE bilan yoziladi va audit
+	commentlari bitta insert bilan qo'shiladi.
+	"""
+	try:
+		max_days = get_max_days_overdue_by_customer()
+		customers = frappe.get_all("Customer", fields=["name", "customer_classification"])
 
-	frappe.db.commit()
+		changes = []
+		for customer in customers:
+			new_classification = get_classification(max_days.get(customer.name, 0))
+			if customer.customer_classification != new_classification:
+				changes.append((customer.name, customer.customer_classification, new_classification))
 
+		if changes:
+			_bulk_set_classifications(changes)
+
+		frappe.db.commit()
+
+		frappe.logger().info(
+			f"Customer classification: {len(customers)} checked, {len(changes)} updated"
+		)
+		return {"checked": len(customers), "updated": len(changes)}
+
+	except Exception as e:
+		frappe.db.rollback()
+		frappe.log_error(
+			message=f"Scheduled classification update error: {str(e)}",
+			title="Customer Classification - Scheduled Error"
+		)
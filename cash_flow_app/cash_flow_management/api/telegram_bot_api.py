@@ -1,12 +1,15 @@
 import frappe
-from frappe.utils import flt, formatdate, today, add_days, nowdate, cstr
+from frappe.utils import flt, formatdate, today, add_days, nowdate, cstr, date_diff, getdate
 from frappe.utils.password import get_decrypted_password
 
+from cash_flow_app.utils import bot_cache, fifo_allocation, telegram_outbox
+
 # ============================================================
 # 1. TELEGRAM ID ORQALI KIRISH (birinchi safar emas)
 # ============================================================
 
 @frappe.whitelist(allow_guest=True)
+@bot_cache.cached("customer", key_by="telegram")
 def get_customer_by_telegram_id(telegram_id: str):
     if not telegram_id:
         return {"success": False, "message": "Telegram ID yo'q"}
@@ -158,6 +161,7 @@ def get_customer_by_id(customer_id: str, telegram_chat_id: str = None):
 # ============================================================
 
 @frappe.whitelist(allow_guest=True)
+@bot_cache.cached("contracts")
 def get_customer_contracts_detailed(customer_id: str):
     try:
         # Asosiy shartnomalar
@@ -233,48 +237,29 @@ def get_customer_contracts_detailed(customer_id: str):
             paid_amounts[contract_id] = total_paid
 
         # Keyingi to'lov - TO'G'RI HISOB-KITOB
+        # Barcha shartnomalar jadvali bitta so'rovda, to'lovlar FIFO taqsimlanadi
+        allocations = fifo_allocation.allocate(fifo_allocation.get_schedules(so_ids), paid_amounts)
+        current_date = getdate(today())
         next_pay = {}
 
-        # Har bir shartnoma uchun to'lov jadvalini olish
-        all_schedules = frappe.db.sql("""
-            SELECT parent, due_date, payment_amount, idx,
-                   DATEDIFF(due_date, CURDATE()) AS days_left
-            FROM `tabPayment Schedule`
-            WHERE parent IN %s
-            ORDER BY parent, idx
-        """, (so_ids,), as_dict=True)
-
-        # Shartnomalar bo'yicha guruhlash
-        schedule_by_contract = {}
-        for row in all_schedules:
-            schedule_by_contract.setdefault(row.parent, []).append(row)
-
-        # Har bir shartnoma uchun keyingi to'lanmagan oyni topish
-        for contract_id, schedule_rows in schedule_by_contract.items():
-            total_paid = paid_amounts.get(contract_id, 0)
-            remaining_payment = total_paid
-
-            for row in schedule_rows:
-                month_amount = flt(row.payment_amount)
+        for contract_id, allocation in allocations.items():
+            # Birinchi to'lanmagan yoki qisman to'langan oy
+            pos = allocation.first_unpaid()
+            if pos is None:
+                continue
 
-                if remaining_payment >= month_amount:
-                    # Bu oy to'liq to'langan
-                    remaining_payment -= month_amount
-                else:
-                    # Bu oy to'lanmagan yoki qisman to'langan
-                    outstanding = month_amount - remaining_payment
-                    days = int(row.days_left or 0)
-                    status = "overdue" if days < 0 else ("today" if days == 0 else ("soon" if days <= 3 else "upcoming"))
-
-                    next_pay[contract_id] = {
-                        "due_date": formatdate(row.due_date, "dd.MM.yyyy"),
-                        "amount": month_amount,
-                        "outstanding": outstanding,
-                        "days_left": days,
-                        "status": status,
-                        "status_uz": "Kechikkan" if days < 0 else ("Bugun" if days == 0 else "Yaqinda")
-                    }
-                    break
+            due_date = allocation.due_date[pos]
+            days = date_diff(due_date, current_date) if due_date else 0
+            status = "overdue" if days < 0 else ("today" if days == 0 else ("soon" if days <= 3 else "upcoming"))
+
+            next_pay[contract_id] = {
+                "due_date": formatdate(due_date, "dd.MM.yyyy"),
+                "amount": allocation.amount[pos],
+                "outstanding": allocation.outstanding(pos),
+                "days_left": days,
+                "status": status,
+                "status_uz": "Kechikkan" if days < 0 else ("Bugun" if days == 0 else "Yaqinda")
+            }
 
         # Yakuniy ro'yxat
         contracts = []
@@ -323,6 +308,7 @@ def get_customer_contracts_detailed(customer_id: str):
 # ============================================================
 
 @frappe.whitelist(allow_guest=True)
+@bot_cache.cached("upcoming_payments")
 def get_upcoming_payments(customer_id: str):
     """
     Mijozning keyingi to'lovlarini TO'G'RI hisoblash.
@@ -343,62 +329,35 @@ def get_upcoming_payments(customer_id: str):
         if not contracts:
             return {"success": True, "payments": []}
 
+        # Barcha shartnomalar jadvali + to'langan summalar (grouped) va FIFO taqsimlash
+        # ✅ Receive qo'shiladi, Pay ayiriladi (customerga pul qaytarilsa)
+        allocations = fifo_allocation.allocate_contracts([c.name for c in contracts])
+        current_date = getdate(today())
+
         result = []
 
         for contract in contracts:
-            contract_id = contract.name
-
-            # 1. To'lov jadvalini olish
-            schedule_rows = frappe.db.sql("""
-                SELECT idx, due_date, payment_amount,
-                       DATEDIFF(due_date, CURDATE()) AS days_left
-                FROM `tabPayment Schedule`
-                WHERE parent = %s ORDER BY idx
-            """, contract_id, as_dict=True)
+            allocation = allocations.get(contract.name)
+            if not allocation:
+                continue
 
-            if not schedule_rows:
+            # Birinchi to'lanmagan oy (faqat shu oy ko'rsatiladi)
+            pos = allocation.first_unpaid()
+            if pos is None:
                 continue
 
-            # 2. Jami to'langan summani olish (custom_contract_reference orqali)
-            # ✅ Receive qo'shiladi, Pay ayiriladi (customerga pul qaytarilsa)
-            total_paid_result = frappe.db.sql("""
-                SELECT COALESCE(
-                    SUM(CASE WHEN payment_type = 'Receive' THEN paid_amount ELSE -paid_amount END),
-                    0
-                ) as total_paid
-                FROM `tabPayment Entry`
-                WHERE custom_contract_reference = %s
-                  AND docstatus = 1
-                  AND payment_type IN ('Receive', 'Pay')
-            """, contract_id)
-
-            total_paid = flt(total_paid_result[0][0]) if total_paid_result else 0
-
-            # 3. Birinchi to'lanmagan oyni topish
-            remaining_payment = total_paid
-
-            for row in schedule_rows:
-                month_amount = flt(row.payment_amount)
-
-                if remaining_payment >= month_amount:
-                    # Bu oy to'liq to'langan - keyingisiga o'tish
-                    remaining_payment -= month_amount
-                else:
-                    # Bu oy to'lanmagan yoki qisman to'langan
-                    outstanding = month_amount - remaining_payment
-                    days = int(row.days_left or 0)
-
-                    result.append({
-                        "contract_id": contract_id,
-                        "contract_date": formatdate(contract.transaction_date, "dd.MM.yyyy"),
-                        "due_date": formatdate(row.due_date, "dd.MM.yyyy"),
-                        "amount": month_amount,
-                        "outstanding": outstanding,
-                        "days_left": days,
-                        "status": "overdue" if days < 0 else ("today" if days == 0 else "upcoming"),
-                        "status_text": f"{abs(days)} kun kechikkan" if days < 0 else f"{days} kun qoldi"
-                    })
-                    break  # Faqat birinchi to'lanmagan oyni olish
+            days = date_diff(allocation.due_date[pos], current_date) if allocation.due_date[pos] else 0
+
+            result.append({
+                "contract_id": contract.name,
+                "contract_date": formatdate(contract.transaction_date, "dd.MM.yyyy"),
+                "due_date": formatdate(allocation.due_date[pos], "dd.MM.yyyy"),
+                "amount": allocation.amount[pos],
+                "outstanding": allocation.outstanding(pos),
+                "days_left": days,
+                "status": "overdue" if days < 0 else ("today" if days == 0 else "upcoming"),
+                "status_text": f"{abs(days)} kun kechikkan" if days < 0 else f"{days} kun qoldi"
+            })
 
         # Sanasi bo'yicha tartiblash
         result.sort(key=lambda x: x.get("days_left", 0))
@@ -414,6 +373,7 @@ def get_upcoming_payments(customer_id: str):
 # ============================================================
 
 @frappe.whitelist(allow_guest=True)
+@bot_cache.cached("payment_schedule", key_by="contract")
 def get_payment_schedule(contract_id: str):
     """
     To'lov jadvalini TO'G'RI hisoblash.
@@ -426,70 +386,31 @@ def get_payment_schedule(contract_id: str):
        - Agar to'lov = 0: oy "unpaid" (to'lanmagan)
        - Ortiqcha summa keyingi oyga o'tkaziladi
     """
-    # 1. Oylik to'lov jadvalini olish
-    rows = frappe.db.sql("""
-        SELECT idx, due_date, payment_amount,
-               DATEDIFF(due_date, CURDATE()) AS days_left
-        FROM `tabPayment Schedule`
-        WHERE parent = %s ORDER BY idx
-    """, contract_id, as_dict=True)
-
-    if not rows:
+    # 1. Oylik to'lov jadvali + JAMI to'langan summa (Contract Balance / Payment Entry)
+    # ✅ Receive qo'shiladi, Pay ayiriladi (customerga pul qaytarilsa)
+    allocation = fifo_allocation.allocate_contracts([contract_id]).get(contract_id)
+
+    if not allocation:
         return {"success": True, "schedule": []}
 
-    # 2. Payment Entry dan JAMI to'langan summani olish (custom_contract_reference orqali)
-    # ✅ Receive qo'shiladi, Pay ayiriladi (customerga pul qaytarilsa)
-    total_paid_result = frappe.db.sql("""
-        SELECT COALESCE(
-            SUM(CASE WHEN payment_type = 'Receive' THEN paid_amount ELSE -paid_amount END),
-            0
-        ) as total_paid
-        FROM `tabPayment Entry`
-        WHERE custom_contract_reference = %s
-          AND docstatus = 1
-          AND payment_type IN ('Receive', 'Pay')
-    """, contract_id)
-
-    total_paid = flt(total_paid_result[0][0]) if total_paid_result else 0
-
-    # 3. To'lovlarni OYMA-OY taqsimlash
-    remaining_payment = total_paid  # Taqsimlash uchun qolgan to'lov
+    # 2. To'lovlarni OYMA-OY taqsimlash (ortiqcha summa keyingi oyga o'tadi)
+    current_date = getdate(today())
     schedule = []
 
-    for r in rows:
-        days = int(r.days_left or 0)
-        month_amount = flt(r.payment_amount)
-
-        # Bu oy uchun to'langan summa
-        if remaining_payment >= month_amount:
-            # To'liq to'langan
-            month_paid = month_amount
-            month_outstanding = 0
-            status = "paid"
-            remaining_payment -= month_amount
-        elif remaining_payment > 0:
-            # Qisman to'langan
-            month_paid = remaining_payment
-            month_outstanding = month_amount - remaining_payment
-            status = "partial"
-            remaining_payment = 0
-        else:
-            # To'lanmagan
-            month_paid = 0
-            month_outstanding = month_amount
-            status = "unpaid"
-
-        # Kechikkan bo'lsa
-        is_overdue = days < 0 and month_outstanding > 0
+    for pos, idx in enumerate(allocation.idx):
+        due_date = allocation.due_date[pos]
+        days = date_diff(due_date, current_date) if due_date else 0
+        month_outstanding = allocation.outstanding(pos)
 
         schedule.append({
-            "month": r.idx,
-            "due_date": formatdate(r.due_date, "dd.MM.yyyy"),
-            "amount": month_amount,
-            "paid": month_paid,
+            "month": idx,
+            "due_date": formatdate(due_date, "dd.MM.yyyy"),
+            "amount": allocation.amount[pos],
+            "paid": allocation.paid(pos),
             "outstanding": month_outstanding,
-            "status": status,
-            "is_overdue": is_overdue
+            "status": allocation.status(pos),
+            # Kechikkan bo'lsa
+            "is_overdue": days < 0 and month_outstanding > 0
         })
 
     return {"success": True, "schedule": schedule}
@@ -500,6 +421,7 @@ def get_payment_schedule(contract_id: str):
 # ============================================================
 
 @frappe.whitelist(allow_guest=True)
+@bot_cache.cached("payment_history_with_products", key_by="contract")
 def get_payment_history_with_products(contract_id: str):
     try:
         # 1. Shartnoma asosiy ma'lumotlari
@@ -627,6 +549,7 @@ def get_payment_history_with_products(contract_id: str):
 # ============================================================
 
 @frappe.whitelist(allow_guest=True)
+@bot_cache.cached("reminders", key_by="telegram")
 def get_reminders_by_telegram_id(telegram_id: str):
     """
     Telegram ID orqali customerning eslatmalarini olish.
@@ -673,75 +596,34 @@ def get_reminders_by_telegram_id(telegram_id: str):
                 "message": "Eslatmalar yuklandi"
             }
 
+        # 3. Barcha shartnomalar jadvali + to'langan summalar (grouped) va FIFO taqsimlash
+        allocations = fifo_allocation.allocate_contracts([c.name for c in contracts])
+        current_date = getdate(today())
+
         result = []
 
         for contract in contracts:
             contract_id = contract.name
+            allocation = allocations.get(contract_id)
 
-            # 3. To'lov jadvalini olish (30 kun oralig'i)
-            schedule_rows = frappe.db.sql("""
-                SELECT idx, due_date, payment_amount,
-                       DATEDIFF(due_date, CURDATE()) AS days_left
-                FROM `tabPayment Schedule`
-                WHERE parent = %s
-                  AND idx > 1
-                  AND due_date BETWEEN CURDATE() - INTERVAL 1 DAY AND CURDATE() + INTERVAL 30 DAY
-                ORDER BY idx
-            """, contract_id, as_dict=True)
-
-            if not schedule_rows:
+            if not allocation:
                 continue
 
-            # 4. Jami to'langan summani olish (custom_contract_reference orqali)
-            # ✅ Receive qo'shiladi, Pay ayiriladi (customerga pul qaytarilsa)
-            total_paid_result = frappe.db.sql("""
-                SELECT COALESCE(
-                    SUM(CASE WHEN payment_type = 'Receive' THEN paid_amount ELSE -paid_amount END),
-                    0
-                ) as total_paid
-                FROM `tabPayment Entry`
-                WHERE custom_contract_reference = %s
-                  AND docstatus = 1
-                  AND payment_type IN ('Receive', 'Pay')
-            """, contract_id)
-
-            total_paid = flt(total_paid_result[0][0]) if total_paid_result else 0
-
-            # 5. Oldingi oylarni hisobga olish uchun barcha jadvaldan olish
-            all_schedule = frappe.db.sql("""
-                SELECT idx, payment_amount
-                FROM `tabPayment Schedule`
-                WHERE parent = %s ORDER BY idx
-            """, contract_id, as_dict=True)
-
-            # 6. Har bir oy uchun to'lovni taqsimlash
-            remaining_payment = total_paid
-            month_status = {}  # idx -> (paid, outstanding, status)
-
-            for row in all_schedule:
-                month_amount = flt(row.payment_amount)
-                idx = row.idx
-
-                if remaining_payment >= month_amount:
-                    month_status[idx] = (month_amount, 0, "paid")
-                    remaining_payment -= month_amount
-                elif remaining_payment > 0:
-                    month_status[idx] = (remaining_payment, month_amount - remaining_payment, "partial")
-                    remaining_payment = 0
-                else:
-                    month_status[idx] = (0, month_amount, "unpaid")
+            # 4. 30 kun oralig'idagi to'lanmagan oylarni eslatmaga qo'shish
+            for pos, idx in enumerate(allocation.idx):
+                if idx <= 1 or not allocation.due_date[pos]:
+                    continue
 
-            # 7. 30 kun oralig'idagi to'lanmagan oylarni eslatmaga qo'shish
-            for row in schedule_rows:
-                idx = row.idx
-                paid, outstanding, status = month_status.get(idx, (0, flt(row.payment_amount), "unpaid"))
+                days = date_diff(allocation.due_date[pos], current_date)
+                if days < -1 or days > 30:
+                    continue
+
+                outstanding = allocation.outstanding(pos)
 
                 # Faqat to'lanmagan yoki qisman to'langan oylarni ko'rsatish
                 if outstanding <= 0:
                     continue
 
-                days = int(row.days_left or 0)
-
                 # Status va prioritet aniqlash
                 if days < -1:
                     reminder_status = "critically_overdue"
@@ -771,8 +653,8 @@ def get_reminders_by_telegram_id(telegram_id: str):
                 result.append({
                     "contract_id": contract_id,
                     "contract_date": formatdate(contract.transaction_date, "dd.MM.yyyy"),
-                    "due_date": formatdate(row.due_date, "dd.MM.yyyy"),
-                    "amount": flt(row.payment_amount),
+                    "due_date": formatdate(allocation.due_date[pos], "dd.MM.yyyy"),
+                    "amount": allocation.amount[pos],
                     "outstanding": outstanding,
                     "days_left": days,
                     "status": reminder_status,
@@ -806,6 +688,7 @@ def get_reminders_by_telegram_id(telegram_id: str):
 # ============================================================
 
 @frappe.whitelist(allow_guest=True)
+@bot_cache.cached("payment_history", key_by="telegram")
 def get_payment_history_by_telegram_id(telegram_id: str):
     """
     Telegram ID orqali customerning barcha to'lovlar tarixini olish.
@@ -924,6 +807,7 @@ def get_payment_history_by_telegram_id(telegram_id: str):
 # ============================================================
 
 @frappe.whitelist(allow_guest=True)
+@bot_cache.cached("my_contracts", key_by="telegram")
 def get_my_contracts_by_telegram_id(telegram_id: str):
     """
     Telegram ID orqali customerning barcha shartnomalarini olish.
@@ -998,8 +882,6 @@ def _process_payment_notification(doc, action):
 	Umumiy logika: Tokenni olish, Customerni topish va yuborish.
 	"""
 	try:
-		import requests
-
 		payment_id = doc.name
 		customer_id = doc.party
 		payment_type = doc.payment_type
@@ -1037,12 +919,10 @@ def _process_payment_notification(doc, action):
 
 def _send_via_telegram_api(bot_token, telegram_id, doc, payment_type, action):
 	"""
-	Xabar matnini tayyorlash va Telegram API ga yuborish.
+	Xabar matnini tayyorlash va Telegram Outbox navbatiga qo'yish.
 	Args:
 		action: 'submit' (tasdiqlash) yoki 'cancel' (bekor qilish)
 	"""
-	import requests
-
 	try:
 		formatted_amount = frappe.utils.fmt_money(doc.paid_amount, currency="USD")
 		date_str = formatdate(doc.posting_date, "dd.MM.yyyy")
@@ -1112,30 +992,17 @@ Mablag' hisobingizga muvaffaqiyatli qaytarildi."""
 			return  # Noma'lum action
 
 		# -------------------------------------------------------
-		# TELEGRAMGA YUBORISH (REQUESTS)
+		# TELEGRAMGA YUBORISH (OUTBOX - commitdan keyin fonda)
 		# -------------------------------------------------------
-		url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-		data = {
-			"chat_id": telegram_id,
-			"text": message,
-			"parse_mode": "HTML"
-		}
-
-		# Timeout 5 soniya yetadi
-		response = requests.post(url, json=data, timeout=5)
-
-		if response.status_code == 200:
-			frappe.logger().info(f"✅ [TELEGRAM] Sent to {telegram_id} for Payment {doc.name}")
-			return True
-		else:
-			# Telegramdan xato kelsa (masalan 400, 403 - bot bloklangan)
-			error_text = f"Telegram API Error: {response.status_code} - {response.text}"
-			frappe.log_error(error_text, "Telegram Send Error")
-			return False
-
-	except requests.exceptions.Timeout:
-		frappe.log_error("Telegram API Timeout (>5s)", "Telegram Timeout")
-		return False
+		telegram_outbox.queue_message(
+			chat_id=telegram_id,
+			text=message,
+			bot="Customer",
+			dedup_key=f"payment:{doc.name}:{action}",
+			reference_doctype="Payment Entry",
+			reference_name=doc.name
+		)
+		return True
 
 	except Exception as e:
 		frappe.log_error(frappe.get_traceback(), "Telegram Send Exception")
@@ -1174,6 +1041,107 @@ def _send_via_bot_webhook(webhook_url, telegram_id, doc, payment_type):
 # 12. AVTOMATIK ESLATMALAR (SCHEDULED NOTIFICATIONS) - TO'G'RI HISOB-KITOB
 # ============================================================
 
+# To'lov sanalari bo'yicha eslatmalar
+REMINDER_CONFIGS = [
+    {"days": 3, "message_template": "⏰ Eslatma: {days} kun ichida to'lov muddati tugaydi!"},
+    {"days": 1, "message_template": "⚠️ Muhim: Ertaga to'lov muddati tugaydi!"},
+    {"days": 0, "message_template": "🔴 DIQQAT: Bugun to'lov muddati!"},
+    {"days": -1, "message_template": "❌ To'lov muddati o'tgan! Iltimos, tezda to'lang!"}
+]
+
+
+def plan_payment_reminders(reminder_configs=None, telegram_only=True):
+    """
+    Eslatmalar rejasini tuzish - SQL so'rovlar soni shartnomalar soniga bog'liq emas.
+
+    1. Barcha eslatma sanalari (3, 1, 0, -1 kun) uchun to'lov qatorlari - 1 so'rov
+    2. Shu shartnomalarning jadvali va to'langan summalari - grouped so'rovlar
+    3. Qoldiq xotirada FIFO bo'yicha hisoblanadi
+
+    Args:
+        reminder_configs: [{"days", "message_template"}] (default: REMINDER_CONFIGS)
+        telegram_only: Faqat Telegram ID si bor mijozlar
+
+    Returns:
+        list: [{"days", "contract_id", "customer", "customer_name", "telegram_id", "phone",
+                "due_date", "amount", "outstanding", "idx", "message"}]
+    """
+    configs = reminder_configs or REMINDER_CONFIGS
+    config_by_date = {getdate(add_days(today(), c["days"])): c for c in configs}
+    config_order = {c["days"]: pos for pos, c in enumerate(configs)}
+
+    telegram_condition = """
+          AND c.custom_telegram_id IS NOT NULL
+          AND c.custom_telegram_id != ''
+    """ if telegram_only else ""
+
+    # Barcha sanalarda to'lov qilishi kerak bo'lgan shartnomalarni olish
+    schedule_rows = frappe.db.sql(f"""
+        SELECT
+            ps.parent AS contract_id,
+            ps.due_date,
+            ps.payment_amount,
+            ps.idx,
+            so.customer,
+            c.customer_name,
+            c.custom_telegram_id,
+            c.custom_phone_1
+        FROM `tabPayment Schedule` ps
+        JOIN `tabSales Order` so ON so.name = ps.parent
+        JOIN `tabCustomer` c ON c.name = so.customer
+        WHERE ps.due_date IN %(dates)s
+          AND ps.idx > 1
+          AND so.docstatus = 1
+          {telegram_condition}
+        ORDER BY c.name
+    """, {"dates": tuple(config_by_date)}, as_dict=True)
+
+    if not schedule_rows:
+        return []
+
+    # Barcha shartnomalar uchun FIFO taqsimlash (grouped queries)
+    allocations = fifo_allocation.allocate_contracts({row.contract_id for row in schedule_rows})
+
+    plan = []
+    for row in schedule_rows:
+        config = config_by_date.get(getdate(row.due_date))
+        allocation = allocations.get(row.contract_id)
+        outstanding = allocation.outstanding_for_idx(row.idx) if allocation else 0
+
+        # Bu oy to'liq to'langan, eslatma kerak emas
+        if not config or outstanding <= 0:
+            continue
+
+        payment_data = frappe._dict({
+            "contract_id": row.contract_id,
+            "due_date": row.due_date,
+            "payment_amount": row.payment_amount,
+            "outstanding": outstanding,
+            "idx": row.idx,
+            "customer": row.customer,
+            "customer_name": row.customer_name
+        })
+
+        plan.append(frappe._dict({
+            "days": config["days"],
+            "contract_id": row.contract_id,
+            "customer": row.customer,
+            "customer_name": row.customer_name,
+            "telegram_id": row.custom_telegram_id,
+            "phone": row.custom_phone_1,
+            "due_date": row.due_date,
+            "amount": flt(row.payment_amount),
+            "outstanding": outstanding,
+            "idx": row.idx,
+            "message": _format_reminder_message(payment_data, config["message_template"], config["days"])
+                if config.get("message_template") else None
+        }))
+
+    # Eslatma turi bo'yicha (3, 1, 0, -1), keyin mijoz bo'yicha
+    plan.sort(key=lambda r: config_order[r.days])
+    return plan
+
+
 def send_payment_reminders():
     """
     Har kuni avtomatik ravishda eslatmalarni yuborish.
@@ -1187,155 +1155,31 @@ def send_payment_reminders():
     - 1 kun keyin (kechikkan)
 
     TO'G'RI HISOB-KITOB:
-    - Jami to'langan summani Payment Entry dan oladi
+    - Eslatmalar rejasi plan_payment_reminders() da bir necha grouped so'rov bilan tuziladi
     - To'lovlarni oyma-oy taqsimlaydi
     - Faqat haqiqiy qoldiq bo'lgan oylar uchun eslatma yuboradi
     """
     try:
-        import requests
-        from frappe.utils import now_datetime
-
-        # Telegram bot API URL ni config dan olish (Cash Settings dan)
+        # Telegram bot tokeni bo'lmasa navbatga qo'yishdan foyda yo'q
         bot_token = frappe.db.get_single_value("Cash Settings", "telegram_bot_token")
 
         if not bot_token:
             frappe.log_error("Telegram bot token topilmadi", "Payment Reminder Error")
             return
 
-        # To'lov sanalari bo'yicha eslatmalar
-        reminder_configs = [
-            {"days": 3, "message_template": "⏰ Eslatma: {days} kun ichida to'lov muddati tugaydi!"},
-            {"days": 1, "message_template": "⚠️ Muhim: Ertaga to'lov muddati tugaydi!"},
-            {"days": 0, "message_template": "🔴 DIQQAT: Bugun to'lov muddati!"},
-            {"days": -1, "message_template": "❌ To'lov muddati o'tgan! Iltimos, tezda to'lang!"}
-        ]
-
-        for config in reminder_configs:
-            days = config["days"]
-            target_date = add_days(today(), days)
-
-            # Shu sanada to'lov qilishi kerak bo'lgan shartnomalarni olish
-            schedule_rows = frappe.db.sql("""
-                SELECT
-                    ps.parent AS contract_id,
-                    ps.due_date,
-                    ps.payment_amount,
-                    ps.idx,
-                    so.customer,
-                    c.customer_name,
-                    c.custom_telegram_id
-                FROM `tabPayment Schedule` ps
-                JOIN `tabSales Order` so ON so.name = ps.parent
-                JOIN `tabCustomer` c ON c.name = so.customer
-                WHERE ps.due_date = %s
-                  AND ps.idx > 1
-                  AND so.docstatus = 1
-                  AND c.custom_telegram_id IS NOT NULL
-                  AND c.custom_telegram_id != ''
-                ORDER BY c.name
-            """, target_date, as_dict=True)
-
-            # Har bir shartnoma uchun to'g'ri qoldiqni hisoblash
-            for row in schedule_rows:
-                contract_id = row.contract_id
-                telegram_id = row.custom_telegram_id
-
-                if not telegram_id:
-                    continue
-
-                # Jami to'langan summani olish (custom_contract_reference orqali)
-                # ✅ Receive qo'shiladi, Pay ayiriladi (customerga pul qaytarilsa)
-                total_paid_result = frappe.db.sql("""
-                    SELECT COALESCE(
-                        SUM(CASE WHEN payment_type = 'Receive' THEN paid_amount ELSE -paid_amount END),
-                        0
-                    ) as total_paid
-                    FROM `tabPayment Entry`
-                    WHERE custom_contract_reference = %s
-                      AND docstatus = 1
-                      AND payment_type IN ('Receive', 'Pay')
-                """, contract_id)
-
-                total_paid = flt(total_paid_result[0][0]) if total_paid_result else 0
-
-                # Barcha jadvaldan oldingi oylarni olish
-                all_schedule = frappe.db.sql("""
-                    SELECT idx, payment_amount
-                    FROM `tabPayment Schedule`
-                    WHERE parent = %s ORDER BY idx
-                """, contract_id, as_dict=True)
-
-                # To'lovlarni oyma-oy taqsimlash va bu oy uchun qoldiqni aniqlash
-                remaining_payment = total_paid
-                outstanding_for_this_month = 0
-
-                for sched_row in all_schedule:
-                    month_amount = flt(sched_row.payment_amount)
-
-                    if sched_row.idx == row.idx:
-                        # Bu oy - qoldiqni hisoblash
-                        if remaining_payment >= month_amount:
-                            outstanding_for_this_month = 0
-                        else:
-                            outstanding_for_this_month = month_amount - remaining_payment
-                        break
-                    else:
-                        # Oldingi oylar
-                        if remaining_payment >= month_amount:
-                            remaining_payment -= month_amount
-                        else:
-                            remaining_payment = 0
-
-                # Agar bu oy uchun qoldiq bo'lsa, eslatma yuborish
-                if outstanding_for_this_month <= 0:
-                    continue  # Bu oy to'liq to'langan, eslatma kerak emas
-
-                # Xabar tayyorlash
-                payment_data = {
-                    "contract_id": contract_id,
-                    "due_date": row.due_date,
-                    "payment_amount": row.payment_amount,
-                    "outstanding": outstanding_for_this_month,
-                    "idx": row.idx,
-                    "customer": row.customer,
-                    "customer_name": row.customer_name
-                }
-
-                message = _format_reminder_message(payment_data, config["message_template"], days)
-
-                # Telegram bot API ga yuborish
-                try:
-                    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-                    data = {
-                        "chat_id": telegram_id,
-                        "text": message,
-                        "parse_mode": "HTML"
-                    }
-
-                    response = requests.post(url, json=data, timeout=10)
-
-                    if response.status_code == 200:
-                        # Log qilish - muvaffaqiyatli yuborildi
-                        _log_notification(
-                            customer_id=row.customer,
-                            telegram_id=telegram_id,
-                            contract_id=contract_id,
-                            notification_type=f"reminder_day_{days}",
-                            status="sent",
-                            message=message
-                        )
-                    else:
-                        # Xato
-                        frappe.log_error(
-                            f"Telegram API xatosi: {response.text}",
-                            f"Reminder Send Failed - {row.customer}"
-                        )
-
-                except Exception as send_error:
-                    frappe.log_error(
-                        frappe.get_traceback(),
-                        f"Reminder Send Error - {row.customer}"
-                    )
+        # Yuborish Telegram Outbox worker'ida (parallel, rate-limited, retry bilan)
+        run_date = today()
+        telegram_outbox.queue_messages([
+            {
+                "chat_id": reminder.telegram_id,
+                "text": reminder.message,
+                "bot": "Customer",
+                "dedup_key": f"reminder:{reminder.contract_id}:{reminder.idx}:{reminder.days}:{run_date}",
+                "reference_doctype": "Sales Order",
+                "reference_name": reminder.contract_id
+            }
+            for reminder in plan_payment_reminders()
+        ])
 
         frappe.db.commit()
 
@@ -1368,25 +1212,6 @@ Savollar uchun: /help
     return message.strip()
 
 
-def _log_notification(customer_id, telegram_id, contract_id, notification_type, status, message):
-    """Notification logini saqlash"""
-    try:
-        # Notification Log doctype yaratish kerak (agar bo'lmasa)
-        # Hozircha faqat frappe.log_error ga yozamiz
-        log_message = f"""
-Customer: {customer_id}
-Telegram ID: {telegram_id}
-Contract: {contract_id}
-Type: {notification_type}
-Status: {status}
-Message: {message}
-"""
-        frappe.log_error(log_message, "Notification Sent Log")
-
-    except Exception as e:
-        pass
-
-
 @frappe.whitelist(allow_guest=True)
 def get_customers_needing_reminders(days: int = 3):
     """
@@ -1398,90 +1223,24 @@ def get_customers_needing_reminders(days: int = 3):
     try:
         target_date = add_days(today(), int(days))
 
-        # Shu sanada to'lov qilishi kerak bo'lgan shartnomalarni olish
-        schedule_rows = frappe.db.sql("""
-            SELECT
-                ps.parent AS contract_id,
-                ps.due_date,
-                ps.payment_amount,
-                ps.idx,
-                so.customer,
-                c.customer_name,
-                c.custom_telegram_id,
-                c.custom_phone_1
-            FROM `tabPayment Schedule` ps
-            JOIN `tabSales Order` so ON so.name = ps.parent
-            JOIN `tabCustomer` c ON c.name = so.customer
-            WHERE ps.due_date = %s
-              AND ps.idx > 1
-              AND so.docstatus = 1
-            ORDER BY c.name
-        """, target_date, as_dict=True)
-
-        result = []
-
-        for row in schedule_rows:
-            contract_id = row.contract_id
-
-            # Jami to'langan summani olish (custom_contract_reference orqali)
-            # ✅ Receive qo'shiladi, Pay ayiriladi (customerga pul qaytarilsa)
-            total_paid_result = frappe.db.sql("""
-                SELECT COALESCE(
-                    SUM(CASE WHEN payment_type = 'Receive' THEN paid_amount ELSE -paid_amount END),
-                    0
-                ) as total_paid
-                FROM `tabPayment Entry`
-                WHERE custom_contract_reference = %s
-                  AND docstatus = 1
-                  AND payment_type IN ('Receive', 'Pay')
-            """, contract_id)
-
-            total_paid = flt(total_paid_result[0][0]) if total_paid_result else 0
-
-            # Barcha jadvaldan oldingi oylarni olish
-            all_schedule = frappe.db.sql("""
-                SELECT idx, payment_amount
-                FROM `tabPayment Schedule`
-                WHERE parent = %s ORDER BY idx
-            """, contract_id, as_dict=True)
-
-            # To'lovlarni oyma-oy taqsimlash va bu oy uchun qoldiqni aniqlash
-            remaining_payment = total_paid
-            outstanding_for_this_month = 0
-
-            for sched_row in all_schedule:
-                month_amount = flt(sched_row.payment_amount)
-
-                if sched_row.idx == row.idx:
-                    # Bu oy - qoldiqni hisoblash
-                    if remaining_payment >= month_amount:
-                        outstanding_for_this_month = 0
-                    else:
-                        outstanding_for_this_month = month_amount - remaining_payment
-                    break
-                else:
-                    # Oldingi oylar
-                    if remaining_payment >= month_amount:
-                        remaining_payment -= month_amount
-                    else:
-                        remaining_payment = 0
-
-            # Faqat qoldiq bo'lgan oylarni ko'rsatish
-            if outstanding_for_this_month <= 0:
-                continue
+        # Eslatmalar rejasi (Telegram ID si yo'q mijozlar ham)
+        reminders = plan_payment_reminders([{"days": int(days)}], telegram_only=False)
 
-            result.append({
-                "customer_id": row.customer,
-                "customer_name": row.customer_name,
-                "telegram_id": row.custom_telegram_id or "Bog'lanmagan",
-                "phone": row.custom_phone_1 or "",
-                "contract_id": contract_id,
-                "due_date": formatdate(row.due_date, "dd.MM.yyyy"),
-                "amount": flt(row.payment_amount),
-                "outstanding": outstanding_for_this_month,
-                "payment_number": row.idx - 1,
-                "has_telegram": bool(row.custom_telegram_id)
-            })
+        result = [
+            {
+                "customer_id": r.customer,
+                "customer_name": r.customer_name,
+                "telegram_id": r.telegram_id or "Bog'lanmagan",
+                "phone": r.phone or "",
+                "contract_id": r.contract_id,
+                "due_date": formatdate(r.due_date, "dd.MM.yyyy"),
+                "amount": r.amount,
+                "outstanding": r.outstanding,
+                "payment_number": r.idx - 1,
+                "has_telegram": bool(r.telegram_id)
+            }
+            for r in reminders
+        ]
 
         return {
             "success": True,
@@ -1606,83 +1365,28 @@ def get_all_active_due_payments():
 	Bot bu funksiyani har soatda chaqiradi va kerakli xabarni yuboradi.
 	"""
 	try:
-		# 1. Telegram ID si bor customerlarning aktiv shartnomalarini olamiz
-		contracts = frappe.db.sql("""
-            SELECT
-                so.name,
-                so.customer,
-                so.transaction_date,
-                c.customer_name,
-                c.custom_telegram_id
-            FROM `tabSales Order` so
-            JOIN `tabCustomer` c ON c.name = so.customer
-            WHERE so.docstatus = 1
-              AND so.status != 'Cancelled'
-              AND c.custom_telegram_id IS NOT NULL
-              AND c.custom_telegram_id != ''
-        """, as_dict=True)
-
-		due_payments = []
-
-		for contract in contracts:
-			contract_id = contract.name
-
-			# 2. To'lov jadvalini olamiz
-			schedule_rows = frappe.db.sql("""
-                SELECT idx, due_date, payment_amount
-                FROM `tabPayment Schedule`
-                WHERE parent = %s ORDER BY idx
-            """, contract_id, as_dict=True)
-
-			if not schedule_rows:
-				continue
-
-			# 3. Jami to'langan summani aniqlaymiz
-			total_paid_result = frappe.db.sql("""
-                SELECT COALESCE(
-                    SUM(CASE WHEN payment_type = 'Receive' THEN paid_amount ELSE -paid_amount END),
-                    0
-                ) as total_paid
-                FROM `tabPayment Entry`
-                WHERE custom_contract_reference = %s
-                  AND docstatus = 1
-                  AND payment_type IN ('Receive', 'Pay')
-            """, contract_id)
-
-			total_paid = flt(total_paid_result[0][0]) if total_paid_result else 0
-
-			# 4. Navbatdagi to'lanmagan oyni topamiz
-			remaining_payment = total_paid
-
-			next_payment_date = None
-			next_payment_amount = 0
-
-			for row in schedule_rows:
-				month_amount = flt(row.payment_amount)
-
-				if remaining_payment >= month_amount:
-					# Bu oy to'liq to'langan, keyingisiga o'tamiz
-					remaining_payment -= month_amount
-				else:
-					# Mana shu oy to'lanmagan yoki qisman to'langan
-					outstanding = month_amount - remaining_payment
-
-					# Agar qoldiq juda kichik bo'lsa (tiyinlar), hisobga olmaymiz
-					if outstanding > 1:
-						next_payment_date = row.due_date
-						next_payment_amount = outstanding
-						break  # Birinchi qarzdorlikni topdik, tsiklni to'xtatamiz
-
-			# Agar qarzdorlik topilgan bo'lsa, ro'yxatga qo'shamiz
-			if next_payment_date:
-				due_payments.append({
-					"name": contract.name,  # Shartnoma raqami
-					"customer": contract.customer,
-					"customer_name": contract.customer_name,
-					"custom_telegram_id": contract.custom_telegram_id,
-					"next_payment_date": str(next_payment_date),  # YYYY-MM-DD format
-					"next_payment_amount": next_payment_amount
-				})
+		# Navbatdagi to'lov Contract Balance da tayyor turadi (to'lovlar hooklarda yangilanadi),
+		# shuning uchun jadval va to'lovlar tarixini qayta hisoblash shart emas.
+		# Tiyinlar qoldig'i (MIN_DUE_OUTSTANDING) pointer hisoblanganda tashlab o'tilgan.
+		due_payments = frappe.db.sql("""
+			SELECT
+				cb.name,
+				cb.customer,
+				c.customer_name,
+				c.custom_telegram_id,
+				cb.next_due_date AS next_payment_date,
+				cb.next_due_amount AS next_payment_amount
+			FROM `tabContract Balance` cb
+			JOIN `tabCustomer` c ON c.name = cb.customer
+			WHERE cb.status = 'Open'
+			  AND cb.next_due_date IS NOT NULL
+			  AND c.custom_telegram_id IS NOT NULL
+			  AND c.custom_telegram_id != ''
+		""", as_dict=True)
+
+		for row in due_payments:
+			row.next_payment_date = str(row.next_payment_date)  # YYYY-MM-DD format
+			row.next_payment_amount = flt(row.next_payment_amount)
 
 		return {"data": due_payments}
 
@@ -1744,7 +1448,6 @@ def _get_validated_admin_chat_ids():
 
 
 import frappe
-import requests
 from frappe.utils import formatdate, flt, get_url_to_form
 from frappe.utils.password import get_decrypted_password
 
@@ -1759,6 +1462,21 @@ def get_admin_bot_token():
 								  "telegram_notification_bot_token")
 
 
+def _queue_admin_message(admin_chat_ids, message, reference_doctype, reference_name, dedup_prefix):
+	"""Admin chatlarga xabarni Telegram Outbox navbatiga qo'yish (submit kutmaydi)"""
+	telegram_outbox.queue_messages([
+		{
+			"chat_id": chat_id,
+			"text": message,
+			"bot": "Admin",
+			"dedup_key": f"{dedup_prefix}:{chat_id}",
+			"reference_doctype": reference_doctype,
+			"reference_name": reference_name
+		}
+		for chat_id in admin_chat_ids
+	])
+
+
 def get_doc_link(doctype, name):
 	"""Hujjatga frappe ichidagi linkni generatsiya qiladi"""
 	# Masalan: http://site.com/app/customer/CUST-001
@@ -1797,10 +1515,8 @@ def send_customer_notification(doc, method):
 
 {doc_link}"""
 
-		url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-		for chat_id in admin_chat_ids:
-			requests.post(url, json={"chat_id": chat_id, "text": message, "parse_mode": "HTML"},
-						  timeout=5)
+		_queue_admin_message(admin_chat_ids, message, "Customer", doc.name,
+							 f"customer:{doc.name}")
 
 	except Exception as e:
 		frappe.log_error(frappe.get_traceback(), f"Customer Notification Error - {doc.name}")
@@ -1863,10 +1579,8 @@ def send_installment_notification(doc, method):
 
 {doc_link}"""
 
-		url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-		for chat_id in admin_chat_ids:
-			requests.post(url, json={"chat_id": chat_id, "text": message, "parse_mode": "HTML"},
-						  timeout=5)
+		_queue_admin_message(admin_chat_ids, message, "Installment Application", doc.name,
+							 f"installment:{doc.name}:{doc.docstatus}:{doc.modified}")
 
 	except Exception as e:
 		frappe.log_error(frappe.get_traceback(), f"Installment Notification Error - {doc.name}")
@@ -1917,10 +1631,8 @@ def send_payment_notification_v2(doc, method):
 
 {doc_link}"""
 
-		url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-		for chat_id in admin_chat_ids:
-			requests.post(url, json={"chat_id": chat_id, "text": message, "parse_mode": "HTML"},
-						  timeout=5)
+		_queue_admin_message(admin_chat_ids, message, "Payment Entry", doc.name,
+							 f"payment_v2:{doc.name}:{doc.docstatus}")
 
 	except Exception as e:
 		frappe.log_error(frappe.get_traceback(), f"Payment Notification V2 Error - {doc.name}")
@@ -1,7 +1,11 @@
+import functools
+
 import frappe
 from frappe import _
 from frappe.utils import flt, today
 
+from cash_flow_app.utils import coalesced_job
+
 def update_supplier_debt_on_submit(doc, method=None):
     # print(f"\n🟢 update_supplier_debt_on_submit CALLED for {doc.name}")
 
@@ -84,68 +88,100 @@ def create_gl_entries_for_installment(doc, customer_name, total_amount, supplier
         gle_supp.voucher_no = doc.name
         gle_supp.insert(ignore_permissions=True)
 
-        # Update supplier
-        supplier = frappe.get_doc("Supplier", supplier_name)
-        supplier.custom_total_debt = flt(supplier.get("custom_total_debt", 0)) + amount
-        supplier.custom_remaining_debt = supplier.custom_total_debt - flt(supplier.get("custom_paid_amount", 0))
-        supplier.save(ignore_permissions=True)
+    # Update supplier (commitdan keyin fonda)
+    queue_supplier_debt_refresh(supplier_debts)
 
 def update_supplier_debt_on_cancel_installment(doc, method=None):
     if not doc.items:
         return
-    supplier_debts = {}
-    for item in doc.items:
-        if item.custom_supplier:
-            supplier = item.custom_supplier
-            item_total = flt(item.qty) * flt(item.rate)
-            supplier_debts[supplier] = supplier_debts.get(supplier, 0) + item_total
-
-    for supplier_name, amount in supplier_debts.items():
-        supplier = frappe.get_doc("Supplier", supplier_name)
-        supplier.custom_total_debt = max(0, flt(supplier.get("custom_total_debt", 0)) - amount)
-        supplier.custom_remaining_debt = supplier.custom_total_debt - flt(supplier.get("custom_paid_amount", 0))
-        supplier.save(ignore_permissions=True)
+    queue_supplier_debt_refresh(item.custom_supplier for item in doc.items)
 
 def update_supplier_debt_on_payment(doc, method=None):
     """
-    Payment Entry submit bo'lganda supplier qarzini yangilash
+    Payment Entry submit / cancel bo'lganda supplier qarzini qayta hisoblash (commitdan keyin)
     Pay: Biz to'laymiz -> custom_paid_amount ortadi, qarz kamayadi
     Receive: Supplier bizga to'laydi -> custom_total_debt ortadi (kredit), qarz ortadi
     """
-    if doc.party_type != "Supplier":
+    if doc.party_type != "Supplier" or not doc.party:
         return
 
-    supplier = frappe.get_doc("Supplier", doc.party)
+    queue_supplier_debt_refresh([doc.party])
 
-    if doc.payment_type == "Pay":
-        # Biz supplier'ga to'ladik - paid_amount ortadi
-        supplier.custom_paid_amount = flt(supplier.get("custom_paid_amount", 0)) + flt(doc.paid_amount)
-    elif doc.payment_type == "Receive":
-        # Supplier bizga to'ladi - bu kredit (qarz ortadi)
-        supplier.custom_total_debt = flt(supplier.get("custom_total_debt", 0)) + flt(doc.paid_amount)
+def _refresh_job_key(supplier):
+    return f"supplier_debt::{supplier}"
 
-    # Qoldiq qarzni hisoblash
-    supplier.custom_remaining_debt = flt(supplier.get("custom_total_debt", 0)) - flt(supplier.get("custom_paid_amount", 0))
-    supplier.save(ignore_permissions=True)
+def queue_supplier_debt_refresh(suppliers):
+    """
+    Supplier qarzini commitdan keyin fonda qayta hisoblash
 
-def update_supplier_debt_on_cancel_payment(doc, method=None):
+    Qarz - hosila jami, submit yo'lida uni hech narsa o'qimaydi; og'ir
+    agregatsiyalar submit lock'lari ushlab turilganda bajarilmaydi.
+    Bir supplier uchun bir vaqtda bitta job (coalesced_job).
     """
-    Payment Entry cancel bo'lganda supplier qarzini qaytarish
-    Pay cancel: custom_paid_amount kamayadi
-    Receive cancel: custom_total_debt kamayadi
+    suppliers = {s for s in suppliers if s}
+    if suppliers:
+        frappe.db.after_commit.add(functools.partial(_request_refreshes, suppliers))
+
+def _request_refreshes(suppliers):
+    for supplier in suppliers:
+        coalesced_job.request(
+            _refresh_job_key(supplier),
+            "cash_flow_app.cash_flow_management.custom.supplier_debt_tracking.refresh_supplier_debt",
+            supplier=supplier
+        )
+
+def refresh_supplier_debt(supplier):
+    """Job: supplier qarzini qayta hisoblash (supplier bo'yicha coalesced)"""
+    def work():
+        recalculate_supplier_debt(supplier)
+        frappe.db.commit()
+
+    coalesced_job.run(_refresh_job_key(supplier), work)
+
+def recalculate_supplier_debt(supplier):
     """
-    if doc.party_type != "Supplier":
-        return
+    Supplier qarzini manba hujjatlardan qayta hisoblash
+
+    - custom_total_debt = Installment Application + Payment Entry (Receive)
+    - custom_paid_amount = Payment Entry (Pay)
+    - custom_remaining_debt = custom_total_debt - custom_paid_amount
 
-    supplier = frappe.get_doc("Supplier", doc.party)
+    Submit / cancel joblari va patch shu bitta formuladan foydalanadi, shuning uchun
+    qiymatlar hech qachon delta xatolari bilan siljib ketmaydi.
 
-    if doc.payment_type == "Pay":
-        # Pay cancel - paid_amount kamayadi
-        supplier.custom_paid_amount = max(0, flt(supplier.get("custom_paid_amount", 0)) - flt(doc.paid_amount))
-    elif doc.payment_type == "Receive":
-        # Receive cancel - total_debt kamayadi
-        supplier.custom_total_debt = max(0, flt(supplier.get("custom_total_debt", 0)) - flt(doc.paid_amount))
+    Args:
+        supplier: Supplier name
 
-    # Qoldiq qarzni hisoblash
-    supplier.custom_remaining_debt = flt(supplier.get("custom_total_debt", 0)) - flt(supplier.get("custom_paid_amount", 0))
-    supplier.save(ignore_permissions=True)
+    Returns:
+        dict: Yangi qiymatlar
+    """
+    # 1. Installment Application - KREDIT (biz supplier'dan qarz oldik)
+    installment_total = frappe.db.sql("""
+        SELECT COALESCE(SUM(item.qty * item.rate), 0)
+        FROM `tabInstallment Application` ia
+        INNER JOIN `tabInstallment Application Item` item ON item.parent = ia.name
+        WHERE ia.docstatus = 1
+        AND item.custom_supplier = %s
+    """, (supplier,))[0][0]
+
+    # 2. Payment Entry Receive - KREDIT, Pay - DEBIT
+    receive_total, pay_total = frappe.db.sql("""
+        SELECT
+            COALESCE(SUM(CASE WHEN payment_type = 'Receive' THEN paid_amount ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN payment_type = 'Pay' THEN paid_amount ELSE 0 END), 0)
+        FROM `tabPayment Entry`
+        WHERE party = %s
+        AND party_type = 'Supplier'
+        AND payment_type IN ('Receive', 'Pay')
+        AND docstatus = 1
+    """, (supplier,))[0]
+
+    total_debt = flt(installment_total) + flt(receive_total)
+    paid_amount = flt(pay_total)
+    values = {
+        "custom_total_debt": total_debt,
+        "custom_paid_amount": paid_amount,
+        "custom_remaining_debt": total_debt - paid_amount
+    }
+    frappe.db.set_value("Supplier", supplier, values, update_modified=False)
+    return values
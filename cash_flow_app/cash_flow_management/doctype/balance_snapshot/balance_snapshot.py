@@ -0,0 +1,14 @@
+# Copyright (c) 2026, AsadStack and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class BalanceSnapshot(Document):
+	pass
+
+
+def on_doctype_update():
+	# "Oxirgi snapshot <= sana" qidiruvi uchun
+	frappe.db.add_index("Balance Snapshot", ["snapshot_type", "party", "month_end"])
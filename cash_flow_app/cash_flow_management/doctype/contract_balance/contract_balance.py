@@ -0,0 +1,14 @@
+# Copyright (c) 2026, AsadStack and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class ContractBalance(Document):
+	pass
+
+
+def on_doctype_update():
+	# Eslatmalar: ochiq shartnomalar navbatdagi to'lov sanasi bo'yicha
+	frappe.db.add_index("Contract Balance", ["status", "next_due_date"])
@@ -1,27 +1,144 @@
 """
 Auto-naming for Item
 Generates ITEM-0001, ITEM-0002, etc.
+
+The counter lives in Frappe's `tabSeries` (key "ITEM-") and is moved with a
+row lock (SELECT ... FOR UPDATE + UPDATE), so concurrent inserts never get
+the same code and no Item table scan is needed. Bulk intake can reserve
+codes in blocks:
+
+    with item_code_block(1000):
+        for row in rows:
+            frappe.get_doc({"doctype": "Item", ...}).insert()
+
+Data Import (frappe.flags.in_import) switches to block mode automatically.
 """
 
+from contextlib import contextmanager
+
 import frappe
+from frappe.utils import cint
+
+ITEM_PREFIX = "ITEM-"
+ITEM_DIGITS = 4
+
+# Codes reserved per lock in block mode
+DEFAULT_BLOCK_SIZE = 500
+
 
 def autoname_item(doc, method=None):
     """Auto-generate item code"""
     if not doc.item_code:
-        # Get last item number
-        last_item = frappe.db.sql("""
-            SELECT name 
-            FROM `tabItem` 
-            WHERE name LIKE 'ITEM-%' 
-            ORDER BY creation DESC 
-            LIMIT 1
-        """, as_dict=1)
-        
-        if last_item:
-            last_num = int(last_item[0].name.split('-')[1])
-            new_num = last_num + 1
-        else:
-            new_num = 1
-        
-        doc.item_code = f"ITEM-{new_num:04d}"
+        doc.item_code = format_item_code(next_item_number())
         doc.item_name = doc.item_code
+    elif _parse_item_number(doc.item_code):
+        # Qo'lda berilgan ITEM-#### - hisoblagich undan orqada qolmasin
+        _advance_series(_parse_item_number(doc.item_code))
+
+
+def _parse_item_number(item_code):
+    suffix = (item_code or "")[len(ITEM_PREFIX):]
+    if item_code.startswith(ITEM_PREFIX) and suffix.isdigit():
+        return cint(suffix)
+    return 0
+
+
+def format_item_code(number):
+    return f"{ITEM_PREFIX}{cint(number):0{ITEM_DIGITS}d}"
+
+
+def next_item_number():
+    """Next number: from the reserved block in block mode, otherwise one atomic increment"""
+    block = getattr(frappe.local, "item_code_block", None)
+    if block is None and frappe.flags.in_import:
+        # Data Import: blok rejimi shu import jobi oxirigacha
+        block = frappe.local.item_code_block = {"size": DEFAULT_BLOCK_SIZE, "numbers": []}
+    if block is None:
+        return reserve_item_numbers(1)[0]
+
+    if not block["numbers"]:
+        first, last = reserve_item_numbers(block["size"])
+        block["numbers"] = list(range(last, first - 1, -1))
+        # Rollback counterni ham qaytaradi - qolgan raqamlar boshqalarga beriladi
+        frappe.db.after_rollback.add(block["numbers"].clear)
+    return block["numbers"].pop()
+
+
+def reserve_item_numbers(count):
+    """
+    Atomically reserve `count` consecutive item numbers
+
+    The tabSeries row stays locked until the current transaction ends.
+
+    Returns:
+        tuple: (first, last) reserved numbers
+    """
+    count = max(cint(count), 1)
+    _ensure_series()
+
+    current = cint(frappe.db.sql(
+        "SELECT `current` FROM `tabSeries` WHERE `name` = %s FOR UPDATE", ITEM_PREFIX
+    )[0][0])
+    frappe.db.sql(
+        "UPDATE `tabSeries` SET `current` = %s WHERE `name` = %s", (current + count, ITEM_PREFIX)
+    )
+    return current + 1, current + count
+
+
+@contextmanager
+def item_code_block(size=DEFAULT_BLOCK_SIZE):
+    """
+    Block-reservation mode for bulk item creation
+
+    Items inserted inside the block take codes from ranges reserved `size`
+    at a time, one counter lock per range instead of one per item. Codes
+    left unused when the block ends are skipped (gaps, never duplicates);
+    a rollback discards the rest of the range, since the counter update
+    was rolled back with it.
+    """
+    previous = getattr(frappe.local, "item_code_block", None)
+    frappe.local.item_code_block = {"size": max(cint(size), 1), "numbers": []}
+    try:
+        yield
+    finally:
+        frappe.local.item_code_block = previous
+
+
+def _get_max_item_number():
+    """Largest numeric suffix among existing ITEM-#### codes"""
+    return cint(frappe.db.sql("""
+        SELECT MAX(CAST(SUBSTRING(name, %(start)s) AS UNSIGNED))
+        FROM `tabItem`
+        WHERE name LIKE %(pattern)s
+    """, {"start": len(ITEM_PREFIX) + 1, "pattern": f"{ITEM_PREFIX}%"})[0][0])
+
+
+def _ensure_series():
+    """Create the counter row once, seeded from existing items"""
+    if frappe.db.sql("SELECT 1 FROM `tabSeries` WHERE `name` = %s", ITEM_PREFIX):
+        return
+
+    frappe.db.sql(
+        "INSERT IGNORE INTO `tabSeries` (`name`, `current`) VALUES (%s, %s)",
+        (ITEM_PREFIX, _get_max_item_number())
+    )
+
+
+def _advance_series(number):
+    _ensure_series()
+    frappe.db.sql(
+        "UPDATE `tabSeries` SET `current` = GREATEST(`current`, %s) WHERE `name` = %s",
+        (cint(number), ITEM_PREFIX)
+    )
+
+
+def sync_item_series():
+    """
+    Move the counter forward if items were created past it
+    (e.g. inserted with explicit codes before this allocator existed)
+
+    Returns:
+        int: Counter value after sync
+    """
+    _advance_series(_get_max_item_number())
+    return cint(frappe.db.sql("SELECT `current` FROM `tabSeries` WHERE `name` = %s", ITEM_PREFIX)[0][0])
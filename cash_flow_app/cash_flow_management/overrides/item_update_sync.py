@@ -6,6 +6,8 @@ When Item is updated, sync changes to Installment Application Item child table
 import frappe
 from frappe import _
 
+from cash_flow_app.utils.imei_index import index_applications
+
 def on_update_item(doc, method=None):
     """
     Sync Item changes to Installment Application Item
@@ -51,6 +53,8 @@ def on_update_item(doc, method=None):
             frappe.clear_cache(doctype='Installment Application', name=item.parent)
         
         if updated_count > 0:
+            # IMEI qidiruv indeksini yangilash
+            index_applications([item.parent for item in installment_items])
             frappe.db.commit()
             frappe.msgprint(
                 _("✅ IMEI yangilandi: {0} ta Installment Application'da").format(updated_count),
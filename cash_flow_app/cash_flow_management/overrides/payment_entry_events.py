@@ -0,0 +1,97 @@
+"""
+Payment Entry post-commit event pipeline
+
+Only ledger-critical work (Sales Order / Payment Schedule linkage and the
+customer debt ledger delta) runs inside the submit transaction. Everything
+else is dispatched after commit as background jobs:
+
+- per document:  Telegram notifications
+- per customer:  dashboard delta for sessions viewing the customer (coalesced)
+- per customer:  classification (coalesced)
+- per supplier:  supplier debt recalculation (coalesced)
+- per document:  Financial Control Tower cache segment update
+
+Frappe's job_id deduplication also skips a job that is already running, and
+that run may have read the database before the new payment committed, so
+the coalesced refreshes go through utils.coalesced_job instead.
+"""
+import functools
+
+import frappe
+
+from cash_flow_app.cash_flow_management.custom.supplier_debt_tracking import queue_supplier_debt_refresh
+from cash_flow_app.cash_flow_management.overrides.payment_entry_linkage import (
+	publish_customer_dashboard_refresh,
+)
+from cash_flow_app.utils import coalesced_job
+
+
+def _dispatch(method, job_id, queue="short", **kwargs):
+	frappe.enqueue(
+		method,
+		queue=queue,
+		job_id=job_id,
+		deduplicate=True,
+		enqueue_after_commit=True,
+		**kwargs
+	)
+
+
+def dispatch_on_submit(doc, method=None):
+	"""Hook: Payment Entry on_submit - side effects after commit"""
+	_dispatch(
+		"cash_flow_app.cash_flow_management.overrides.payment_entry_events.run_document_side_effects",
+		job_id=f"payment_entry_submit::{doc.name}",
+		payment_entry=doc.name
+	)
+
+	if doc.party_type == "Customer" and doc.party:
+		publish_customer_dashboard_refresh(doc)
+		frappe.db.after_commit.add(functools.partial(_queue_customer_refresh, doc.party))
+	elif doc.party_type == "Supplier" and doc.party:
+		queue_supplier_debt_refresh([doc.party])
+
+	_dispatch(
+		"cash_flow_app.cash_flow_management.api.financial_control_tower_api.apply_document_change",
+		job_id=f"fct_segment_update::{doc.doctype}::{doc.name}::on_submit",
+		doctype=doc.doctype,
+		docname=doc.name,
+		method="on_submit"
+	)
+
+
+def run_document_side_effects(payment_entry):
+	"""Job: notifications for one submitted Payment Entry"""
+	from cash_flow_app.cash_flow_management.api import telegram_bot_api
+
+	doc = frappe.get_doc("Payment Entry", payment_entry)
+	if doc.docstatus != 1:
+		# Cancelled before the job ran - cancel hooks already notified
+		return
+
+	telegram_bot_api.send_payment_notification(doc, "on_submit")
+	telegram_bot_api.send_payment_notification_v2(doc, "on_submit")
+	frappe.db.commit()
+
+
+def _refresh_job_key(customer):
+	return f"customer_refresh::{customer}"
+
+
+def _queue_customer_refresh(customer):
+	coalesced_job.request(
+		_refresh_job_key(customer),
+		"cash_flow_app.cash_flow_management.overrides.payment_entry_events.refresh_customer",
+		customer=customer
+	)
+
+
+def refresh_customer(customer):
+	"""Job: customer-level derived data (coalesced per customer)"""
+	from cash_flow_app.cash_flow_management.api.payment_entry import update_customer_classification
+
+	def work():
+		update_customer_classification(customer)
+		frappe.db.commit()
+
+	coalesced_job.run(_refresh_job_key(customer), work)
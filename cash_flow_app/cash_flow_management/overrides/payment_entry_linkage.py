@@ -136,14 +136,18 @@ def on_submit_payment_entry(doc, method=None):
         
         # Get sum of all submitted payments for this SO (excluding current one)
         print(f"   🔍 Checking for existing SUBMITTED payments...")
-        existing_payments_sum = frappe.db.sql("""
-            SELECT COALESCE(SUM(paid_amount), 0) as total
-            FROM `tabPayment Entry`
-            WHERE custom_contract_reference = %(so)s
-                AND docstatus = 1
-                AND name != %(pe)s
-                AND payment_type = 'Receive'
-        """, {'so': so.name, 'pe': doc.name}, as_dict=1)[0].total
+        # Contract Balance hook runs after this one, so received_total
+        # does not include the current payment yet
+        existing_payments_sum = frappe.db.get_value("Contract Balance", so.name, "received_total")
+        if existing_payments_sum is None:
+            existing_payments_sum = frappe.db.sql("""
+                SELECT COALESCE(SUM(paid_amount), 0) as total
+                FROM `tabPayment Entry`
+                WHERE custom_contract_reference = %(so)s
+                    AND docstatus = 1
+                    AND name != %(pe)s
+                    AND payment_type = 'Receive'
+            """, {'so': so.name, 'pe': doc.name}, as_dict=1)[0].total
         
         existing_payments_sum = flt(existing_payments_sum)
         print(f"   💵 Existing SUBMITTED payments sum: ${existing_payments_sum}")
@@ -402,25 +406,15 @@ def reverse_payment_schedule(sales_order, cancelled_amount):
 
 def publish_customer_dashboard_refresh(doc, method=None):
     """
-    ✅ Publish realtime event to refresh Customer Dashboard
-    Called after Payment Entry is submitted
+    ✅ Push Customer Dashboard delta after Payment Entry submit / cancel
+
+    Only sessions that have this customer open receive it (doc room);
+    bursts are coalesced per customer - customer_history.queue_dashboard_push
     """
-    if doc.party_type == "Customer" and doc.party:
-        # Publish realtime event via socket.io
-        # ✅ SEND TO ALL USERS (not just current user!)
-        frappe.publish_realtime(
-            "payment_entry_submitted",
-            {
-                "customer": doc.party,
-                "payment_entry": doc.name,
-                "amount": flt(doc.paid_amount),
-                "contract": doc.custom_contract_reference
-            },
-            # Remove user filter to send to ALL users
-            after_commit=True  # Send after DB commit completes
-        )
-        
-        frappe.logger().info(f"📡 Published dashboard refresh event for customer: {doc.party}")
+    if doc.party_type == "Customer" and doc.party and doc.custom_contract_reference:
+        from cash_flow_app.cash_flow_management.api.customer_history import queue_dashboard_push
+
+        queue_dashboard_push(doc.party, doc.custom_contract_reference, doc.name)
 
 
 # ================================================================================
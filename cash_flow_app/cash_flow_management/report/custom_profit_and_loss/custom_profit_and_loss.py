@@ -40,21 +40,32 @@ def format_money(amount):
 	return "${:,.0f}".format(round(flt(amount)))
 
 
-def get_balance_sheet_net_profit(from_date, to_date):
+def _period_format(periodicity):
+	"""SQL DATE_FORMAT pattern that yields get_period_list keys"""
+	return "%%Y" if periodicity == "Yearly" else "%%Y-%%m"
+
+
+def get_balance_sheet_net_profit_by_period(from_date, to_date, periodicity="Monthly"):
 	"""
-	Balance Sheet reportidagi Sof Foyda ni hisoblash.
+	Balance Sheet reportidagi Sof Foyda ni har bir davr uchun hisoblash.
 	Bu funksiya operational_balance_sheet.py dagi logikani takrorlaydi.
+
+	Barcha davrlar bitta grouped query bilan olinadi.
+
+	Returns:
+		dict: {period_key: net_profit}
 	"""
-	interest_result = frappe.db.sql("""
-		SELECT IFNULL(SUM(custom_total_interest), 0) as total
+	period_format = _period_format(periodicity)
+	result = {}
+
+	for period_key, total in frappe.db.sql(f"""
+		SELECT DATE_FORMAT(transaction_date, '{period_format}'), IFNULL(SUM(custom_total_interest), 0)
 		FROM `tabInstallment Application`
 		WHERE docstatus = 1
 		AND DATE(transaction_date) BETWEEN %s AND %s
-	""", (from_date, to_date), as_dict=1)
-
-	interest = flt(interest_result[0].total if interest_result else 0)
-
-	expenses = 0
+		GROUP BY 1
+	""", (from_date, to_date)):
+		result[period_key] = flt(total)
 
 	categories = frappe.db.sql("""
 		SELECT name, category_name, category_type, custom_expense_type
@@ -64,35 +75,37 @@ def get_balance_sheet_net_profit(from_date, to_date):
 
 	category_map = {c["name"]: c for c in categories}
 
-	payment_entries = frappe.db.sql("""
+	payment_entries = frappe.db.sql(f"""
 		SELECT
+			DATE_FORMAT(posting_date, '{period_format}') as period_key,
 			custom_counterparty_category,
-			paid_amount,
-			party_type,
-			party_name
+			SUM(paid_amount) as paid_amount
 		FROM `tabPayment Entry`
 		WHERE docstatus = 1
 		AND DATE(posting_date) BETWEEN %s AND %s
 		AND custom_counterparty_category IS NOT NULL
 		AND party_type = 'Employee'
 		AND party_name = 'Xarajat'
+		GROUP BY 1, custom_counterparty_category
 	""", (from_date, to_date), as_dict=1)
 
 	for pe in payment_entries:
 		category = category_map.get(pe.get("custom_counterparty_category"))
 
-		if (category
-			and category.get("custom_expense_type") == "Xarajat"
-			and pe.get("party_type") == "Employee"
-			and pe.get("party_name") == "Xarajat"):
+		if category and category.get("custom_expense_type") == "Xarajat":
 			amount = flt(pe["paid_amount"])
 
 			if category.get("category_type") == "Income":
 				amount = -amount
 
-			expenses += amount
+			result[pe.period_key] = result.get(pe.period_key, 0) - amount
+
+	return result
 
-	return interest - expenses
+
+def get_balance_sheet_net_profit(from_date, to_date):
+	"""Balance Sheet Sof Foyda — bitta davr uchun"""
+	return sum(get_balance_sheet_net_profit_by_period(from_date, to_date, "Yearly").values())
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -346,20 +359,72 @@ def get_period_list(filters):
 	return period_list
 
 
+def get_installment_totals_by_period(filters):
+	"""
+	Shartnomalar soni, Savdo, Tannarx va Yalpi foyda — barcha davrlar
+	uchun bitta grouped query
+
+	Returns:
+		dict: {period_key: row(cnt, revenue, cost, margin)}
+	"""
+	period_format = _period_format(filters.get("periodicity"))
+	rows = frappe.db.sql(f"""
+		SELECT
+			DATE_FORMAT(transaction_date, '{period_format}') as period_key,
+			COUNT(*) as cnt,
+			IFNULL(SUM(custom_grand_total_with_interest - downpayment_amount), 0) as revenue,
+			IFNULL(SUM(finance_amount), 0) as cost,
+			IFNULL(SUM(custom_total_interest), 0) as margin
+		FROM `tabInstallment Application`
+		WHERE docstatus = 1
+		AND DATE(transaction_date) BETWEEN %s AND %s
+		GROUP BY 1
+	""", (getdate(filters["from_date"]), getdate(filters["to_date"])), as_dict=1)
+
+	return {row.period_key: row for row in rows}
+
+
+def get_expenses_by_period(filters):
+	"""
+	Xarajat kategoriyalari bo'yicha summalar — barcha davrlar uchun
+	bitta grouped query
+
+	Returns:
+		list: [row(period_key, category_id, category_name, category_type, amount)]
+	"""
+	period_format = _period_format(filters.get("periodicity"))
+	return frappe.db.sql(f"""
+		SELECT
+			DATE_FORMAT(pe.posting_date, '{period_format}') as period_key,
+			cc.name         as category_id,
+			cc.category_name,
+			cc.category_type,
+			SUM(pe.paid_amount) as amount
+		FROM `tabPayment Entry` pe
+		INNER JOIN `tabCounterparty Category` cc
+			ON pe.custom_counterparty_category = cc.name
+		WHERE pe.docstatus = 1
+		AND cc.custom_expense_type = 'Xarajat'
+		AND pe.party_type = 'Employee'
+		AND pe.party_name = 'Xarajat'
+		AND DATE(pe.posting_date) BETWEEN %s AND %s
+		GROUP BY 1, cc.name, cc.category_name, cc.category_type
+	""", (getdate(filters["from_date"]), getdate(filters["to_date"])), as_dict=1)
+
+
 def get_data(filters):
 	period_list = get_period_list(filters)
 	data = []
 
+	# Barcha davrlar bir martada olinadi, qatorlar xotirada yig'iladi
+	ia_totals = get_installment_totals_by_period(filters)
+	empty = frappe._dict(cnt=0, revenue=0, cost=0, margin=0)
+
 	# ── 1. SHARTNOMALAR SONI ────────────────────────────────────────
 	quantity_row = {"account": "Shartnomalar soni", "indent": 0}
 	total_qty = 0
 	for period in period_list:
-		qty = frappe.db.sql("""
-			SELECT COUNT(*) as cnt
-			FROM `tabInstallment Application`
-			WHERE docstatus = 1
-			AND DATE(transaction_date) BETWEEN %s AND %s
-		""", (period["from_date"], period["to_date"]), as_dict=1)[0].cnt
+		qty = ia_totals.get(period["key"], empty).cnt
 		quantity_row[period["key"]] = int(qty)
 		total_qty += qty
 	quantity_row["total"] = int(total_qty)
@@ -374,12 +439,7 @@ def get_data(filters):
 	revenue_row_raw = {}
 	total_revenue   = 0
 	for period in period_list:
-		result = frappe.db.sql("""
-			SELECT IFNULL(SUM(custom_grand_total_with_interest - downpayment_amount), 0) as total
-			FROM `tabInstallment Application`
-			WHERE docstatus = 1
-			AND DATE(transaction_date) BETWEEN %s AND %s
-		""", (period["from_date"], period["to_date"]), as_dict=1)[0].total
+		result = ia_totals.get(period["key"], empty).revenue
 		revenue_row_raw[period["key"]] = flt(result)
 		revenue_row[period["key"]]     = format_money(result)
 		total_revenue                 += flt(result)
@@ -394,12 +454,7 @@ def get_data(filters):
 	}
 	total_cost = 0
 	for period in period_list:
-		result = frappe.db.sql("""
-			SELECT IFNULL(SUM(finance_amount), 0) as total
-			FROM `tabInstallment Application`
-			WHERE docstatus = 1
-			AND DATE(transaction_date) BETWEEN %s AND %s
-		""", (period["from_date"], period["to_date"]), as_dict=1)[0].total
+		result = ia_totals.get(period["key"], empty).cost
 		cost_row[period["key"]] = format_money(result)
 		total_cost             += flt(result)
 	cost_row["total"] = format_money(total_cost)
@@ -414,12 +469,7 @@ def get_data(filters):
 	margin_row_raw = {}
 	total_margin   = 0
 	for period in period_list:
-		result = frappe.db.sql("""
-			SELECT IFNULL(SUM(custom_total_interest), 0) as total
-			FROM `tabInstallment Application`
-			WHERE docstatus = 1
-			AND DATE(transaction_date) BETWEEN %s AND %s
-		""", (period["from_date"], period["to_date"]), as_dict=1)[0].total
+		result = ia_totals.get(period["key"], empty).margin
 		margin_row_raw[period["key"]] = flt(result)
 		margin_row[period["key"]]     = format_money(result)
 		total_margin                 += flt(result)
@@ -458,50 +508,38 @@ def get_data(filters):
 	for period in period_list:
 		operational_row_raw[period["key"]] = 0
 
-		expenses = frappe.db.sql("""
-			SELECT
-				cc.name         as category_id,
-				cc.category_name,
-				cc.category_type,
-				SUM(pe.paid_amount) as amount
-			FROM `tabPayment Entry` pe
-			INNER JOIN `tabCounterparty Category` cc
-				ON pe.custom_counterparty_category = cc.name
-			WHERE pe.docstatus = 1
-			AND cc.custom_expense_type = 'Xarajat'
-			AND pe.party_type = 'Employee'
-			AND pe.party_name = 'Xarajat'
-			AND DATE(pe.posting_date) BETWEEN %s AND %s
-			GROUP BY cc.name, cc.category_name, cc.category_type
-		""", (period["from_date"], period["to_date"]), as_dict=1)
-
-		for exp in expenses:
-			cat_name = exp.category_name
-			cat_id   = exp.category_id
-			amount   = flt(exp.amount)
-
-			if exp.category_type == "Income":
-				amount = -amount
-
-			if cat_name not in expense_categories:
-				expense_categories[cat_name] = {
-					"account":     f"  {cat_name}",
-					"indent":      1,
-					"category_id": cat_id,
-					"_raw":        {},
-					"_raw_total":  0
-				}
-				for p in period_list:
-					expense_categories[cat_name][p["key"]] = "$0"
-				expense_categories[cat_name]["total"] = "$0"
-
-			expense_categories[cat_name]["_raw"][period["key"]] = (
-				expense_categories[cat_name]["_raw"].get(period["key"], 0) + amount
-			)
-			expense_categories[cat_name]["_raw_total"] += amount
-
-			operational_row_raw[period["key"]] += amount
-			total_expense                      += amount
+	period_keys = set(operational_row_raw)
+	for exp in get_expenses_by_period(filters):
+		period_key = exp.period_key
+		if period_key not in period_keys:
+			continue
+
+		cat_name = exp.category_name
+		cat_id   = exp.category_id
+		amount   = flt(exp.amount)
+
+		if exp.category_type == "Income":
+			amount = -amount
+
+		if cat_name not in expense_categories:
+			expense_categories[cat_name] = {
+				"account":     f"  {cat_name}",
+				"indent":      1,
+				"category_id": cat_id,
+				"_raw":        {},
+				"_raw_total":  0
+			}
+			for p in period_list:
+				expense_categories[cat_name][p["key"]] = "$0"
+			expense_categories[cat_name]["total"] = "$0"
+
+		expense_categories[cat_name]["_raw"][period_key] = (
+			expense_categories[cat_name]["_raw"].get(period_key, 0) + amount
+		)
+		expense_categories[cat_name]["_raw_total"] += amount
+
+		operational_row_raw[period_key] += amount
+		total_expense                      += amount
 
 	for period in period_list:
 		operational_row[period["key"]] = format_money(operational_row_raw[period["key"]])
@@ -565,8 +603,12 @@ def get_data(filters):
 	}
 	total_check_difference = 0
 
+	bs_net_profits = get_balance_sheet_net_profit_by_period(
+		getdate(filters["from_date"]), getdate(filters["to_date"]), filters.get("periodicity")
+	)
+
 	for period in period_list:
-		bs_net_profit = get_balance_sheet_net_profit(period["from_date"], period["to_date"])
+		bs_net_profit = bs_net_profits.get(period["key"], 0)
 		pl_net_profit = net_profit_row_raw[period["key"]]
 		difference    = pl_net_profit - bs_net_profit
 		check_row[period["key"]] = format_money(difference)
@@ -87,63 +87,38 @@ def get_columns():
 
 def get_data(filters):
     """
-    To'liq optimallashtirilgan report data.
-    4 ta bulk query - N+1 muammo yo'q.
-    FIFO waterfall - to'lov sanasiga qarab guruh tanlash.
+    Faqat ochiq shartnomalar - Contract Balance dagi navbatdagi to'lov
+    ko'rsatkichi (pointer) orqali.
+
+    Pointer (birinchi to'lanmagan oy, sanasi, summasi, qolgan qarz) to'lov va
+    shartnoma hooklarida yangilanadi, shuning uchun jadval va to'lovlar
+    tarixi qayta hisoblanmaydi. 2 ta query: pointerlar + oxirgi izohlar.
     """
     today = getdate(nowdate())
 
-    # ── BULK QUERY 1: Barcha submitted Installment Applications ─────────────────
-    applications = frappe.get_all(
-        "Installment Application",
-        filters={"docstatus": 1},
-        fields=["name", "customer", "custom_grand_total_with_interest", "sales_order"]
-    )
-
-    if not applications:
-        return []
-
-    app_names    = [a.name for a in applications]
-    sales_orders = [a.sales_order for a in applications if a.sales_order]
-
-    if not sales_orders:
+    # ── QUERY 1: Ochiq shartnomalar, to'lov sanasigacha kunlar bilan ────────────
+    pointers = frappe.db.sql("""
+        SELECT
+            cb.installment_application,
+            cb.customer,
+            cb.next_due_installment_amount,
+            cb.next_due_amount,
+            cb.outstanding,
+            DATEDIFF(cb.next_due_date, %(today)s) AS days_diff
+        FROM `tabContract Balance` cb
+        WHERE cb.status = 'Open'
+          AND cb.next_due_date IS NOT NULL
+          AND cb.installment_application IS NOT NULL
+          AND cb.outstanding > 0.01
+        ORDER BY cb.next_due_date, cb.installment_application
+    """, {"today": today}, as_dict=1)
+
+    if not pointers:
         return []
 
-    # sales_order → app.name xaritalash (1:1 kafolatlangan)
-    so_to_app = {a.sales_order: a.name for a in applications if a.sales_order}
-
-    # ── BULK QUERY 2: Barcha Payment Schedules ───────────────────────────────────
-    all_schedules_raw = frappe.db.sql("""
-        SELECT parent, due_date, payment_amount
-        FROM `tabPayment Schedule`
-        WHERE parent IN %(app_names)s
-          AND parenttype = 'Installment Application'
-        ORDER BY parent, due_date ASC
-    """, {"app_names": app_names}, as_dict=1)
+    app_names = [p.installment_application for p in pointers]
 
-    # { app_name: [ {due_date, payment_amount}, ... ] } — sana bo'yicha tartiblangan
-    schedules_map = {}
-    for row in all_schedules_raw:
-        schedules_map.setdefault(row.parent, []).append(row)
-
-    # ── BULK QUERY 3: Jami to'lovlar sales_order bo'yicha ───────────────────────
-    paid_raw = frappe.db.sql("""
-        SELECT custom_contract_reference, SUM(paid_amount) AS total_paid
-        FROM `tabPayment Entry`
-        WHERE custom_contract_reference IN %(sales_orders)s
-          AND docstatus = 1
-          AND payment_type = 'Receive'
-        GROUP BY custom_contract_reference
-    """, {"sales_orders": sales_orders}, as_dict=1)
-
-    # { app_name: total_paid } — sales_order orqali app.name ga o'tkazildi
-    paid_map = {}
-    for r in paid_raw:
-        app_name = so_to_app.get(r.custom_contract_reference)
-        if app_name:
-            paid_map[app_name] = flt(r.total_paid)
-
-    # ── BULK QUERY 4: Har bir shartnoma uchun eng oxirgi izoh ────────────────────
+    # ── QUERY 2: Har bir shartnoma uchun eng oxirgi izoh ─────────────────────────
     notes_raw = frappe.db.sql("""
         SELECT cn.contract_reference,
                cn.note_text,
@@ -174,37 +149,19 @@ def get_data(filters):
         "due_later":      [],   # 14 kundan keyin
     }
 
-    for app in applications:
-        contract_total = flt(app.custom_grand_total_with_interest)
-        total_paid     = paid_map.get(app.name, 0.0)
-        remaining_debt = contract_total - total_paid
-
-        # To'liq to'langan shartnomalarni o'tkazib yuborish
-        if remaining_debt <= 0.01:
-            continue
-
-        schedule = schedules_map.get(app.name)
-        if not schedule:
-            continue
-
-        # ── FIFO Waterfall: birinchi to'liq to'lanmagan installmentni top ────────
-        active = _find_active_installment(schedule, total_paid)
-        if not active:
-            continue
-
-        due_date     = getdate(active["due_date"])
-        days_diff    = (due_date - today).days
+    for pointer in pointers:
+        days_diff    = int(pointer.days_diff)
         overdue_days = abs(days_diff) if days_diff < 0 else None
 
-        note = notes_map.get(app.name, {})
+        note = notes_map.get(pointer.installment_application, {})
 
         row = {
             "group_header":          "",
-            "contract_link":         app.name,
-            "customer_link":         app.customer,
-            "current_month_payment": active["schedule_amount"],
-            "due_amount":            active["due_amount"],
-            "remaining_debt":        remaining_debt,
+            "contract_link":         pointer.installment_application,
+            "customer_link":         pointer.customer,
+            "current_month_payment": flt(pointer.next_due_installment_amount),
+            "due_amount":            flt(pointer.next_due_amount),
+            "remaining_debt":        flt(pointer.outstanding),
             "overdue_days":          overdue_days,
             "note_text":             note.get("note_text", "")     if note else "",
             "note_category":         note.get("note_category", "") if note else "",
@@ -213,66 +170,31 @@ def get_data(filters):
             "bold":                  0,
         }
 
-        # ── Guruh tanlash mantiq ──────────────────────────────────────────────────
-        # Qoida: chala to'langan bo'lsa ham due_date o'tgan bo'lsa — overdue guruh.
-        # To'liq to'lana solmay FIFO bo'yicha keyingi oyga o'tilmaydi.
-        if days_diff < 0:
-            if days_diff <= -15:
-                groups["overdue_more"].append(row)
-            elif days_diff <= -8:
-                groups["overdue_2weeks"].append(row)
-            else:
-                groups["overdue_1week"].append(row)
-        elif days_diff == 0:
-            groups["today"].append(row)
-        elif days_diff <= 7:
-            groups["due_1week"].append(row)
-        elif days_diff <= 14:
-            groups["due_2weeks"].append(row)
-        else:
-            groups["due_later"].append(row)
+        groups[_group_key(days_diff)].append(row)
 
     return _build_output(groups)
 
 
-def _find_active_installment(schedule, total_paid):
+def _group_key(days_diff):
     """
-    FIFO Waterfall algoritmi.
-
-    To'langan summani birinchi oydan boshlab ketma-ket yutib boradi.
-    Birinchi to'liq to'lanmagan installmentni qaytaradi.
+    Guruh tanlash mantiq.
 
-    Qaytaradigan dict:
-        due_date        — installmentning to'lov sanasi
-        schedule_amount — ushbu oyning to'liq summasi
-        due_amount      — hali to'lanishi kerak bo'lgan qoldiq
+    Qoida: chala to'langan bo'lsa ham due_date o'tgan bo'lsa — overdue guruh.
+    To'liq to'lana solmay FIFO bo'yicha keyingi oyga o'tilmaydi.
     """
-    temp_paid = flt(total_paid)
-
-    for item in schedule:
-        amount = flt(item.payment_amount)
-
-        if temp_paid >= amount - 0.01:
-            # Bu installment to'liq to'langan — keyingiga o't
-            temp_paid -= amount
-            temp_paid  = max(temp_paid, 0.0)
-            continue
-
-        # Bu installment to'liq to'lanmagan — aktiv installment shu
-        return {
-            "due_date":        item.due_date,
-            "schedule_amount": amount,
-            "due_amount":      round(amount - temp_paid, 2),
-        }
-
-    # Barcha schedule qatorlari consumed lekin remaining_debt > 0 —
-    # bu holat normal emas, oxirgi qatorni qaytaramiz
-    last = schedule[-1]
-    return {
-        "due_date":        last.due_date,
-        "schedule_amount": flt(last.payment_amount),
-        "due_amount":      0.0,
-    }
+    if days_diff < 0:
+        if days_diff <= -15:
+            return "overdue_more"
+        if days_diff <= -8:
+            return "overdue_2weeks"
+        return "overdue_1week"
+    if days_diff == 0:
+        return "today"
+    if days_diff <= 7:
+        return "due_1week"
+    if days_diff <= 14:
+        return "due_2weeks"
+    return "due_later"
 
 
 def _build_output(groups):
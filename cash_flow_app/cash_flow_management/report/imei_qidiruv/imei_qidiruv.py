@@ -5,6 +5,8 @@
 import frappe
 from frappe import _
 
+from cash_flow_app.utils.imei_index import INDEX_JOIN, REPORT_LIMIT, get_search_prefix
+
 
 def execute(filters=None):
 	columns = get_columns()
@@ -64,10 +66,12 @@ def get_columns():
 
 def get_data(filters):
 	"""IMEI Qidiruv report ma'lumotlari"""
-	conditions = get_conditions(filters)
+	filters = frappe._dict(filters or {})
+	joins, conditions = get_conditions(filters)
 
 	query = """
-		SELECT
+		SELECT DISTINCT
+			iai.name as item_row,
 			iai.item_name,
 			iai.imei,
 			COALESCE(iai.custom_supplier, '') as supplier_name,
@@ -77,6 +81,7 @@ def get_data(filters):
 			ia.transaction_date
 		FROM
 			`tabInstallment Application Item` iai
+		{joins}
 		INNER JOIN
 			`tabInstallment Application` ia ON iai.parent = ia.name
 		WHERE
@@ -84,19 +89,35 @@ def get_data(filters):
 			{conditions}
 		ORDER BY
 			ia.transaction_date DESC
-	""".format(conditions=conditions)
+		LIMIT {limit}
+	""".format(joins=joins, conditions=conditions, limit=REPORT_LIMIT)
 
 	data = frappe.db.sql(query, filters, as_dict=1)
 	return data
 
 
 def get_conditions(filters):
-	"""Filtrlar asosida SQL shart yaratish"""
+	"""
+	Filtrlar asosida SQL join va shart yaratish
+
+	IMEI IMEI Search Index (suffiks indeks) bilan join qilib qidiriladi, shunda
+	filtrlar, saralash va LIMIT barcha topilganlarga qo'llanadi; indeks uchun
+	juda qisqa matn bo'lsa - oddiy LIKE.
+
+	Returns:
+		tuple: (joins, conditions)
+	"""
+	joins = ""
 	conditions = ""
 
 	if filters.get("imei"):
-		conditions += " AND iai.imei LIKE %(imei)s"
-		filters["imei"] = f"%{filters['imei']}%"
+		prefix = get_search_prefix(filters["imei"])
+		if prefix is None:
+			conditions += " AND iai.imei LIKE %(imei)s"
+			filters["imei"] = f"%{filters['imei']}%"
+		else:
+			joins = INDEX_JOIN
+			filters["imei_prefix"] = prefix
 
 	if filters.get("supplier_name"):
 		conditions += " AND iai.custom_supplier LIKE %(supplier_name)s"
@@ -104,4 +125,4 @@ def get_conditions(filters):
 	if filters.get("customer_name"):
 		conditions += " AND ia.customer_name LIKE %(customer_name)s"
 
-	return conditions
+	return joins, conditions
@@ -2,7 +2,9 @@
 
 import frappe
 from frappe import _
-from frappe.utils import flt
+from frappe.utils import add_days, flt, getdate
+
+from cash_flow_app.utils import balance_snapshot
 
 
 # ============================================================
@@ -349,57 +351,12 @@ def get_summary(data, filters=None):
 # ============================================================
 
 def get_opening_balance(from_date, cash_account=None):
-	"""from_date dan oldingi barcha kirim - chiqim"""
+	"""from_date dan oldingi barcha kirim - chiqim (snapshot + delta)"""
 
 	if not from_date:
 		return 0.0
 
-	conditions = ["pe.docstatus = 1"]
-	params = {"from_date": from_date, "cash_account": cash_account}
-
-	conditions.append("pe.posting_date < %(from_date)s")
-
-	if cash_account:
-		conditions.append("(pe.paid_from = %(cash_account)s OR pe.paid_to = %(cash_account)s)")
-
-	where_clause = " AND ".join(conditions)
-
-	# Internal Transfer logic faqat cash_account berilgan bo'lsa ishlaydi
-	if cash_account:
-		internal_transfer_receive = "WHEN pe.payment_type = 'Internal Transfer' AND pe.paid_to = %(cash_account)s THEN pe.received_amount"
-		internal_transfer_pay = "WHEN pe.payment_type = 'Internal Transfer' AND pe.paid_from = %(cash_account)s THEN pe.paid_amount"
-	else:
-		internal_transfer_receive = ""
-		internal_transfer_pay = ""
-
-	query = f"""
-		SELECT
-			COALESCE(SUM(
-				CASE
-					WHEN pe.payment_type = 'Receive' THEN pe.paid_amount
-					{internal_transfer_receive}
-					ELSE 0
-				END
-			), 0) as total_receive,
-			COALESCE(SUM(
-				CASE
-					WHEN pe.payment_type = 'Pay' THEN pe.paid_amount
-					{internal_transfer_pay}
-					ELSE 0
-				END
-			), 0) as total_pay
-		FROM `tabPayment Entry` pe
-		WHERE {where_clause}
-	"""
-
-	result = frappe.db.sql(query, params, as_dict=1)
-
-	if result and result[0]:
-		total_receive = flt(result[0].get('total_receive', 0))
-		total_pay = flt(result[0].get('total_pay', 0))
-		return total_receive - total_pay
-
-	return 0.0
+	return get_cash_balance(add_days(getdate(from_date), -1), cash_account)
 
 
 # ============================================================
@@ -407,54 +364,21 @@ def get_opening_balance(from_date, cash_account=None):
 # ============================================================
 
 def get_net_balance(to_date, cash_account=None):
-	"""to_date gacha barcha kirim - chiqim"""
+	"""to_date gacha barcha kirim - chiqim (snapshot + delta)"""
 
 	if not to_date:
 		return 0.0
 
-	conditions = ["pe.docstatus = 1"]
-	params = {"to_date": to_date, "cash_account": cash_account}
+	return get_cash_balance(getdate(to_date), cash_account)
 
-	conditions.append("pe.posting_date <= %(to_date)s")
-
-	if cash_account:
-		conditions.append("(pe.paid_from = %(cash_account)s OR pe.paid_to = %(cash_account)s)")
-
-	where_clause = " AND ".join(conditions)
-
-	# Internal Transfer logic faqat cash_account berilgan bo'lsa ishlaydi
-	if cash_account:
-		internal_transfer_receive = "WHEN pe.payment_type = 'Internal Transfer' AND pe.paid_to = %(cash_account)s THEN pe.received_amount"
-		internal_transfer_pay = "WHEN pe.payment_type = 'Internal Transfer' AND pe.paid_from = %(cash_account)s THEN pe.paid_amount"
-	else:
-		internal_transfer_receive = ""
-		internal_transfer_pay = ""
 
-	query = f"""
-		SELECT
-			COALESCE(SUM(
-				CASE
-					WHEN pe.payment_type = 'Receive' THEN pe.paid_amount
-					{internal_transfer_receive}
-					ELSE 0
-				END
-			), 0) as total_receive,
-			COALESCE(SUM(
-				CASE
-					WHEN pe.payment_type = 'Pay' THEN pe.paid_amount
-					{internal_transfer_pay}
-					ELSE 0
-				END
-			), 0) as total_pay
-		FROM `tabPayment Entry` pe
-		WHERE {where_clause}
+def get_cash_balance(upto, cash_account=None):
 	"""
+	Kassa qoldig'i upto sanasigacha (shu kun ham kiradi)
 
-	result = frappe.db.sql(query, params, as_dict=1)
-
-	if result and result[0]:
-		total_receive = flt(result[0].get('total_receive', 0))
-		total_pay = flt(result[0].get('total_pay', 0))
-		return total_receive - total_pay
-
-	return 0.0
+	Oxirgi yopilgan oy snapshoti + undan keyingi to'lovlar (Balance Snapshot).
+	Kassa berilmasa barcha hisoblar yig'iladi - Internal Transfer ikki
+	tomonda bir-birini yopadi, natija Receive - Pay ga teng.
+	"""
+	parties = [cash_account] if cash_account else None
+	return flt(balance_snapshot.get_net_balance("Cash Account", upto, parties))
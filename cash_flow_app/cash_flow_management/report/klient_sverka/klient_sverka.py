@@ -3,7 +3,9 @@
 
 import frappe
 from frappe import _
-from frappe.utils import flt, getdate
+from frappe.utils import add_days, flt, getdate
+
+from cash_flow_app.utils import balance_snapshot
 
 
 def execute(filters=None):
@@ -120,7 +122,15 @@ def calculate_opening_balance(customer, from_date, contract_filter=None):
 	"""
 	Calculate opening balance (boshlang'ich qoldiq):
 	Sum of all contracts before from_date - Sum of all payments before from_date
+
+	Shartnoma filtri bo'lmasa mijoz snapshoti + undan keyingi hujjatlar
+	(Balance Snapshot) ishlatiladi; shartnoma bo'yicha esa to'g'ridan-to'g'ri hisoblanadi.
 	"""
+	if not contract_filter:
+		return flt(balance_snapshot.get_net_balance(
+			"Customer", add_days(getdate(from_date), -1), [customer]
+		))
+
 	# Get all contracts before from_date
 	contract_conditions = """
 		WHERE customer = %s
@@ -7,7 +7,15 @@ import os
 from frappe import _
 from frappe.utils import flt, getdate, add_days, get_last_day, get_first_day
 from datetime import datetime
-from collections import defaultdict
+
+from cash_flow_app.utils import balance_snapshot
+from cash_flow_app.utils.cumulative_balance import (
+	CumulativeSeries,
+	bucket_sql,
+	get_cut_dates,
+	get_split_months,
+	group_series,
+)
 
 
 @frappe.whitelist()
@@ -254,143 +262,244 @@ def get_quarter_end(quarter_start):
 
 
 class OperationalBalanceData:
-	"""Optimized data loader - single query per entity type"""
+	"""
+	Pre-aggregated data loader
+
+	Balance Sheet is a cumulative report showing position from business start
+	to end of each period. Every entity is loaded with one grouped query that
+	sums transactions per (party, date bucket) - see utils.cumulative_balance -
+	so Python works with month buckets instead of raw rows and answers
+	"balance as of period end" by bisect over prefix sums.
+
+	Cash accounts and suppliers start from the closed-month Balance Snapshot
+	on or before the earliest cut date (one bucket per party) and only read
+	documents dated after it.
+	"""
 
 	def __init__(self, filters):
 		self.filters = filters
 		self.to_date = filters["to_date"]
 		self.periods = get_periods(filters)
+		cut_dates = get_cut_dates(self.periods)
+		self.snapshot_date = balance_snapshot.get_snapshot_base(min(cut_dates)) if cut_dates else None
+		self.values = {
+			"split_months": get_split_months(cut_dates),
+			# Snapshot oyidan keyingi hujjatlar (snapshot bo'lmasa - hammasi)
+			"snapshot_date": self.snapshot_date or "1900-01-01"
+		}
 
 	def load_all_data(self):
-		"""Load ALL historical data from beginning of time (no date filter in SQL)
-
-		Balance Sheet is a cumulative report showing position from business start
-		to end of each period. Date filtering is done in Python code per period.
-		"""
+		"""Load bucketed history for all entities (no date filter in SQL)"""
 		return {
 			"cash_accounts": self.load_cash_accounts(),
-			"sales_orders": self.load_sales_orders(),
-			"payment_entries": self.load_payment_entries(),
-			"installment_applications": self.load_installment_applications(),
-			"installment_application_items": self.load_installment_application_items(),
-			"counterparty_categories": self.load_counterparty_categories(),
+			"customers": self.load_customers(),
+			"suppliers": self.load_suppliers(),
+			"shareholder_series": self.load_shareholder_series(),
+			"interest": self.load_interest(),
+			"expenses": self.load_expenses(),
 			"shareholders": self.load_shareholders()
 		}
 
 	def load_cash_accounts(self):
-		"""Load ALL cash transactions from beginning of time (no date filter)"""
-		query = """
+		"""
+		Cash balance movements per account
+
+		Returns:
+			dict: {account: CumulativeSeries} (accounts without payments included)
+		"""
+		rows = frappe.db.sql(f"""
 			SELECT
 				acc.name as account_name,
-				pe.posting_date,
-				CASE
+				{bucket_sql("pe.posting_date")} as bucket,
+				SUM(CASE
 					WHEN pe.payment_type = 'Receive' AND pe.paid_to = acc.name THEN pe.received_amount
 					WHEN pe.payment_type = 'Pay' AND pe.paid_from = acc.name THEN -pe.paid_amount
 					WHEN pe.payment_type = 'Internal Transfer' AND pe.paid_to = acc.name THEN pe.received_amount
 					WHEN pe.payment_type = 'Internal Transfer' AND pe.paid_from = acc.name THEN -pe.paid_amount
 					ELSE 0
-				END as amount
+				END) as amount
 			FROM `tabAccount` acc
 			LEFT JOIN `tabPayment Entry` pe ON (
 				(pe.paid_to = acc.name OR pe.paid_from = acc.name)
 				AND pe.docstatus = 1
+				AND pe.posting_date > %(snapshot_date)s
 			)
 			WHERE acc.account_type = 'Cash'
 				AND acc.is_group = 0
-			ORDER BY acc.name, pe.posting_date
+			GROUP BY acc.name, bucket
+		""", self.values, as_dict=1)
+
+		accounts = {row.account_name for row in rows}
+		snapshots = balance_snapshot.get_snapshot_totals("Cash Account", self.snapshot_date, list(accounts))
+		rows = [r for r in rows if r.bucket] + [
+			frappe._dict(account_name=account, bucket=self.snapshot_date, amount=debit - credit)
+			for account, (debit, credit) in snapshots.items()
+		]
+
+		series = group_series(rows, "account_name")
+		for account in accounts:
+			series.setdefault(account, CumulativeSeries())
+		return series
+
+	def load_customers(self):
 		"""
-		return frappe.db.sql(query, as_dict=1)
+		Customer balance (debit - credit) per customer group and customer
 
-	def load_sales_orders(self):
-		"""Load ALL sales orders from beginning (no date filter)"""
-		return frappe.db.sql("""
+		Debit: Sales Orders (grand_total), Payment Entry Pay (paid_amount)
+		Credit: Payment Entry Receive (received_amount)
+
+		Returns:
+			dict: {group: {customer: CumulativeSeries}}
+		"""
+		rows = frappe.db.sql(f"""
 			SELECT
-				so.name,
-				so.customer,
-				so.customer_name,
-				so.transaction_date,
-				so.grand_total,
-				cg.customer_group_name
-			FROM `tabSales Order` so
-			LEFT JOIN `tabCustomer` c ON c.name = so.customer
+				IFNULL(NULLIF(cg.customer_group_name, ''), 'Boshqa') as group_name,
+				t.party,
+				{bucket_sql("t.posting_date")} as bucket,
+				SUM(t.amount) as amount
+			FROM (
+				SELECT so.customer as party, so.transaction_date as posting_date, so.grand_total as amount
+				FROM `tabSales Order` so
+				WHERE so.docstatus = 1
+
+				UNION ALL
+
+				SELECT
+					pe.party,
+					pe.posting_date,
+					CASE WHEN pe.payment_type = 'Pay' THEN pe.paid_amount ELSE -pe.received_amount END
+				FROM `tabPayment Entry` pe
+				WHERE pe.docstatus = 1
+					AND pe.party_type = 'Customer'
+					AND pe.payment_type IN ('Pay', 'Receive')
+			) t
+			LEFT JOIN `tabCustomer` c ON c.name = t.party
 			LEFT JOIN `tabCustomer Group` cg ON cg.name = c.customer_group
-			WHERE so.docstatus = 1
-			ORDER BY cg.customer_group_name, so.customer, so.transaction_date
-		""", as_dict=1)
+			GROUP BY group_name, t.party, bucket
+		""", self.values, as_dict=1)
 
-	def load_payment_entries(self):
-		"""Load ALL payment entries from beginning (no date filter)"""
-		return frappe.db.sql("""
+		return group_series(rows, "group_name", "party")
+
+	def load_suppliers(self):
+		"""
+		Supplier balance (credit - debit) per supplier group and supplier
+
+		Credit: Installment Application items (qty * rate), Payment Entry Receive
+		Debit: Payment Entry Pay (paid_amount)
+
+		Returns:
+			dict: {group: {supplier: CumulativeSeries}}
+		"""
+		rows = frappe.db.sql(f"""
 			SELECT
-				pe.name,
-				pe.posting_date,
-				pe.party_type,
+				IFNULL(NULLIF(sg.supplier_group_name, ''), 'Boshqa') as group_name,
+				t.party,
+				{bucket_sql("t.posting_date")} as bucket,
+				SUM(t.amount) as amount
+			FROM (
+				SELECT
+					item.custom_supplier as party,
+					ia.transaction_date as posting_date,
+					item.qty * item.rate as amount
+				FROM `tabInstallment Application` ia
+				INNER JOIN `tabInstallment Application Item` item ON item.parent = ia.name
+				WHERE ia.docstatus = 1
+					AND ia.transaction_date > %(snapshot_date)s
+					AND item.custom_supplier IS NOT NULL
+					AND item.custom_supplier != ''
+
+				UNION ALL
+
+				SELECT
+					pe.party,
+					pe.posting_date,
+					CASE WHEN pe.payment_type = 'Receive' THEN pe.received_amount ELSE -pe.paid_amount END
+				FROM `tabPayment Entry` pe
+				WHERE pe.docstatus = 1
+					AND pe.posting_date > %(snapshot_date)s
+					AND pe.party_type = 'Supplier'
+					AND pe.payment_type IN ('Pay', 'Receive')
+
+				UNION ALL
+
+				SELECT snap.party, snap.month_end, snap.credit - snap.debit
+				FROM ({balance_snapshot.snapshot_sql("Supplier")}) snap
+			) t
+			LEFT JOIN `tabSupplier` s ON s.name = t.party
+			LEFT JOIN `tabSupplier Group` sg ON sg.name = s.supplier_group
+			GROUP BY group_name, t.party, bucket
+		""", self.values, as_dict=1)
+
+		return group_series(rows, "group_name", "party")
+
+	def load_shareholder_series(self):
+		"""
+		Shareholder movements by category
+
+		Ustav Kapitali: Receive (received_amount) - Pay (paid_amount)
+		Dividends: Pay (paid_amount)
+
+		Returns:
+			dict: {"Ustav Kapitali": {shareholder: series}, "Dividends": {shareholder: series}}
+		"""
+		rows = frappe.db.sql(f"""
+			SELECT
+				sh.custom_category as category,
 				pe.party,
-				pe.party_name,
-				pe.payment_type,
-				pe.paid_amount,
-				pe.received_amount,
-				pe.custom_counterparty_category,
-				CASE
-					WHEN pe.party_type = 'Customer' THEN cg.customer_group_name
-					WHEN pe.party_type = 'Supplier' THEN sg.supplier_group_name
-					ELSE NULL
-				END as group_name
+				{bucket_sql("pe.posting_date")} as bucket,
+				SUM(CASE
+					WHEN sh.custom_category = 'Dividends' THEN pe.paid_amount
+					WHEN pe.payment_type = 'Receive' THEN pe.received_amount
+					WHEN pe.payment_type = 'Pay' THEN -pe.paid_amount
+					ELSE 0
+				END) as amount
 			FROM `tabPayment Entry` pe
-			LEFT JOIN `tabCustomer` c ON c.name = pe.party AND pe.party_type = 'Customer'
-			LEFT JOIN `tabCustomer Group` cg ON cg.name = c.customer_group
-			LEFT JOIN `tabSupplier` s ON s.name = pe.party AND pe.party_type = 'Supplier'
-			LEFT JOIN `tabSupplier Group` sg ON sg.name = s.supplier_group
+			INNER JOIN `tabShareholder` sh ON sh.name = pe.party
 			WHERE pe.docstatus = 1
-			ORDER BY pe.party_type, pe.party, pe.posting_date
-		""", as_dict=1)
+				AND pe.party_type = 'Shareholder'
+				AND (
+					sh.custom_category = 'Ustav Kapitali'
+					OR (sh.custom_category = 'Dividends' AND pe.payment_type = 'Pay')
+				)
+			GROUP BY sh.custom_category, pe.party, bucket
+		""", self.values, as_dict=1)
 
-	def load_installment_applications(self):
-		"""Load ALL installment applications from beginning (no date filter)"""
-		return frappe.db.sql("""
-			SELECT
-				ia.name,
-				ia.customer,
-				ia.customer_name,
-				ia.transaction_date,
-				ia.custom_total_interest,
-				ia.finance_amount,
-				cg.customer_group_name
-			FROM `tabInstallment Application` ia
-			LEFT JOIN `tabCustomer` c ON c.name = ia.customer
-			LEFT JOIN `tabCustomer Group` cg ON cg.name = c.customer_group
-			WHERE ia.docstatus = 1
-			ORDER BY cg.customer_group_name, ia.customer, ia.transaction_date
-		""", as_dict=1)
+		series = group_series(rows, "category", "party")
+		series.setdefault("Ustav Kapitali", {})
+		series.setdefault("Dividends", {})
+		return series
 
-	def load_installment_application_items(self):
-		"""Load ALL installment application items from beginning (no date filter)"""
-		return frappe.db.sql("""
+	def load_interest(self):
+		"""Installment Application interest (custom_total_interest) by transaction date"""
+		rows = frappe.db.sql(f"""
 			SELECT
-				ia.name as parent_ia,
-				ia.transaction_date,
-				item.custom_supplier as supplier,
-				item.qty,
-				item.rate,
-				(item.qty * item.rate) as amount,
-				sg.supplier_group_name
+				{bucket_sql("ia.transaction_date")} as bucket,
+				SUM(ia.custom_total_interest) as amount
 			FROM `tabInstallment Application` ia
-			INNER JOIN `tabInstallment Application Item` item ON item.parent = ia.name
-			LEFT JOIN `tabSupplier` s ON s.name = item.custom_supplier
-			LEFT JOIN `tabSupplier Group` sg ON sg.name = s.supplier_group
 			WHERE ia.docstatus = 1
-				AND item.custom_supplier IS NOT NULL
-				AND item.custom_supplier != ''
-			ORDER BY sg.supplier_group_name, item.custom_supplier, ia.transaction_date
-		""", as_dict=1)
+			GROUP BY bucket
+		""", self.values, as_dict=1)
+		return CumulativeSeries((r.bucket, r.amount) for r in rows)
 
-	def load_counterparty_categories(self):
-		"""Load active counterparty categories"""
-		return frappe.db.sql("""
-			SELECT name, category_name, category_type, custom_expense_type
-			FROM `tabCounterparty Category`
-			WHERE is_active = 1
-		""", as_dict=1)
+	def load_expenses(self):
+		"""
+		Xarajat expenses by posting date: Employee 'Xarajat' payments with an
+		active Xarajat counterparty category (Income categories count negative)
+		"""
+		rows = frappe.db.sql(f"""
+			SELECT
+				{bucket_sql("pe.posting_date")} as bucket,
+				SUM(CASE WHEN cc.category_type = 'Income' THEN -pe.paid_amount ELSE pe.paid_amount END) as amount
+			FROM `tabPayment Entry` pe
+			INNER JOIN `tabCounterparty Category` cc ON cc.name = pe.custom_counterparty_category
+			WHERE pe.docstatus = 1
+				AND cc.is_active = 1
+				AND cc.custom_expense_type = 'Xarajat'
+				AND pe.party_type = 'Employee'
+				AND pe.party_name = 'Xarajat'
+			GROUP BY bucket
+		""", self.values, as_dict=1)
+		return CumulativeSeries((r.bucket, r.amount) for r in rows)
 
 	def load_shareholders(self):
 		"""Load all shareholders with their custom_category"""
@@ -452,12 +561,22 @@ def build_tree_structure(raw_data, filters):
 		row.update(kwargs)
 		return row
 
-	# Create category lookup dictionary
-	category_dict = {cc["name"]: cc for cc in raw_data["counterparty_categories"]}
-
 	# Create shareholder lookup dictionary
 	shareholder_dict = {sh["name"]: sh for sh in raw_data["shareholders"]}
 
+	# Balance as of each period end, per party (prefix sums + bisect)
+	def balances(series):
+		return {period["key"]: series.as_of(period["to_date"]) for period in periods}
+
+	customer_groups = {
+		group: {customer: balances(series) for customer, series in customers.items()}
+		for group, customers in raw_data["customers"].items()
+	}
+	supplier_payables = {
+		group: {supplier: balances(series) for supplier, series in suppliers.items()}
+		for group, suppliers in raw_data["suppliers"].items()
+	}
+
 	# ============================================================
 	# SECTION 1: AKTIVLAR (ASSETS) - ALL CUMULATIVE
 	# ============================================================
@@ -469,21 +588,15 @@ def build_tree_structure(raw_data, filters):
 	pul_row = create_row("Pul", indent=1, is_group=True)
 	data.append(pul_row)
 
-	cash_accounts = defaultdict(list)
-	for t in raw_data["cash_accounts"]:
-		if t.get("account_name"):
-			cash_accounts[t["account_name"]].append(t)
+	cash_accounts = raw_data["cash_accounts"]
 
 	for account_name in sorted(cash_accounts.keys()):
 		account_row = create_row(account_name, indent=2)
-		transactions = cash_accounts[account_name]
+		series = cash_accounts[account_name]
 
 		for period in periods:
 			# CUMULATIVE: From beginning to period end
-			balance = sum(
-				flt(t["amount"]) for t in transactions
-				if t.get("posting_date") and getdate(t["posting_date"]) <= period["to_date"]
-			)
+			balance = series.as_of(period["to_date"])
 			account_row[period["key"]] = balance
 			pul_row[period["key"]] += balance
 			aktivlar_row[period["key"]] += balance
@@ -497,78 +610,17 @@ def build_tree_structure(raw_data, filters):
 	debitorka_mijozlar_row = create_row("Mijozlar", indent=2, is_group=True)
 	data.append(debitorka_mijozlar_row)
 
-	customer_groups = defaultdict(lambda: defaultdict(lambda: {"debit": [], "credit": []}))
-
-	# Sales Orders - DEBIT
-	for so in raw_data["sales_orders"]:
-		group = so.get("customer_group_name") or "Boshqa"
-		customer_groups[group][so["customer"]]["debit"].append({
-			"type": "sales_order",
-			"date": so["transaction_date"],
-			"amount": flt(so["grand_total"])
-		})
-
-	# Supplier Payables initialization
-	supplier_payables = defaultdict(lambda: defaultdict(lambda: {"credit": [], "debit": []}))
-
-	# Installment Application Items - CREDIT
-	for ia_item in raw_data["installment_application_items"]:
-		group = ia_item.get("supplier_group_name") or "Boshqa"
-		supplier_payables[group][ia_item["supplier"]]["credit"].append({
-			"type": "ia_item",
-			"date": ia_item["transaction_date"],
-			"amount": flt(ia_item["amount"])
-		})
-	# Payment Entries - Customer va Supplier
-	for pe in raw_data["payment_entries"]:
-		if pe["party_type"] == "Customer":
-			group = pe.get("group_name") or "Boshqa"
-			if pe["payment_type"] == "Pay":
-				customer_groups[group][pe["party"]]["debit"].append({
-					"type": "payment_pay",
-					"date": pe["posting_date"],
-					"amount": flt(pe["paid_amount"])
-				})
-			elif pe["payment_type"] == "Receive":
-				customer_groups[group][pe["party"]]["credit"].append({
-					"type": "payment_receive",
-					"date": pe["posting_date"],
-					"amount": flt(pe["received_amount"])
-				})
-		elif pe["party_type"] == "Supplier":
-			group = pe.get("group_name") or "Boshqa"
-			if pe["payment_type"] == "Pay":
-				supplier_payables[group][pe["party"]]["debit"].append({
-					"type": "payment_pay",
-					"date": pe["posting_date"],
-					"amount": flt(pe["paid_amount"])
-				})
-			elif pe["payment_type"] == "Receive":
-				supplier_payables[group][pe["party"]]["credit"].append({
-					"type": "payment_receive",
-					"date": pe["posting_date"],
-					"amount": flt(pe["received_amount"])
-				})
-
 	for group_name in sorted(customer_groups.keys()):
 		group_row = create_row(group_name, indent=3, is_group=True)
 		data.append(group_row)
 
 		for customer in sorted(customer_groups[group_name].keys()):
 			customer_row = create_row(customer, indent=4)
-			debit_transactions = customer_groups[group_name][customer]["debit"]
-			credit_transactions = customer_groups[group_name][customer]["credit"]
+			customer_balances = customer_groups[group_name][customer]
 
 			for period in periods:
-				total_debit = sum(
-					t["amount"] for t in debit_transactions
-					if getdate(t["date"]) <= period["to_date"]
-				)
-				total_credit = sum(
-					t["amount"] for t in credit_transactions
-					if getdate(t["date"]) <= period["to_date"]
-				)
-				balance = total_debit - total_credit
+				# debit - credit
+				balance = customer_balances[period["key"]]
 				if balance > 0:
 					customer_row[period["key"]] = balance
 					group_row[period["key"]] += balance
@@ -590,20 +642,12 @@ def build_tree_structure(raw_data, filters):
 		temp_suppliers = []
 		for supplier in sorted(supplier_payables[group_name].keys()):
 			supplier_row = create_row(supplier, indent=4)
-			credit_transactions = supplier_payables[group_name][supplier]["credit"]
-			debit_transactions = supplier_payables[group_name][supplier]["debit"]
+			supplier_balances = supplier_payables[group_name][supplier]
 			has_negative = False
 
 			for period in periods:
-				total_credit = sum(
-					t["amount"] for t in credit_transactions
-					if getdate(t["date"]) <= period["to_date"]
-				)
-				total_debit = sum(
-					t["amount"] for t in debit_transactions
-					if getdate(t["date"]) <= period["to_date"]
-				)
-				balance = total_credit - total_debit
+				# credit - debit
+				balance = supplier_balances[period["key"]]
 				if balance < 0:
 					supplier_row[period["key"]] = abs(balance)
 					group_row[period["key"]] += abs(balance)
@@ -642,20 +686,11 @@ def build_tree_structure(raw_data, filters):
 		temp_customers = []
 		for customer in sorted(customer_groups[group_name].keys()):
 			customer_row = create_row(customer, indent=4)
-			debit_transactions = customer_groups[group_name][customer]["debit"]
-			credit_transactions = customer_groups[group_name][customer]["credit"]
+			customer_balances = customer_groups[group_name][customer]
 			has_negative = False
 
 			for period in periods:
-				total_debit = sum(
-					t["amount"] for t in debit_transactions
-					if getdate(t["date"]) <= period["to_date"]
-				)
-				total_credit = sum(
-					t["amount"] for t in credit_transactions
-					if getdate(t["date"]) <= period["to_date"]
-				)
-				balance = total_debit - total_credit
+				balance = customer_balances[period["key"]]
 				if balance < 0:
 					customer_row[period["key"]] = abs(balance)
 					group_row[period["key"]] += abs(balance)
@@ -684,19 +719,10 @@ def build_tree_structure(raw_data, filters):
 
 		for supplier in sorted(supplier_payables[group_name].keys()):
 			supplier_row = create_row(supplier, indent=4)
-			credit_transactions = supplier_payables[group_name][supplier]["credit"]
-			debit_transactions = supplier_payables[group_name][supplier]["debit"]
+			supplier_balances = supplier_payables[group_name][supplier]
 
 			for period in periods:
-				total_credit = sum(
-					t["amount"] for t in credit_transactions
-					if getdate(t["date"]) <= period["to_date"]
-				)
-				total_debit = sum(
-					t["amount"] for t in debit_transactions
-					if getdate(t["date"]) <= period["to_date"]
-				)
-				balance = total_credit - total_debit
+				balance = supplier_balances[period["key"]]
 				if balance > 0:
 					supplier_row[period["key"]] = balance
 					group_row[period["key"]] += balance
@@ -711,30 +737,16 @@ def build_tree_structure(raw_data, filters):
 	ustav_row = create_row("Ustav Kapitali", indent=1, is_group=True)
 	data.append(ustav_row)
 
-	ustav_shareholders = defaultdict(list)
-	for pe in raw_data["payment_entries"]:
-		if (pe["party_type"] == "Shareholder"
-			and pe.get("party") in shareholder_dict
-			and shareholder_dict.get(pe["party"], {}).get("custom_category") == "Ustav Kapitali"):
-			ustav_shareholders[pe["party"]].append(pe)
+	ustav_shareholders = raw_data["shareholder_series"]["Ustav Kapitali"]
 
 	for shareholder in sorted(ustav_shareholders.keys()):
 		shareholder_name = shareholder_dict.get(shareholder, {}).get("title") or shareholder
 		shareholder_row = create_row(shareholder_name, indent=2)
-		payments = ustav_shareholders[shareholder]
+		series = ustav_shareholders[shareholder]
 
 		for period in periods:
-			receive = sum(
-				flt(pe["received_amount"]) for pe in payments
-				if pe["payment_type"] == "Receive"
-				and getdate(pe["posting_date"]) <= period["to_date"]
-			)
-			pay = sum(
-				flt(pe["paid_amount"]) for pe in payments
-				if pe["payment_type"] == "Pay"
-				and getdate(pe["posting_date"]) <= period["to_date"]
-			)
-			balance = receive - pay
+			# receive - pay
+			balance = series.as_of(period["to_date"])
 			shareholder_row[period["key"]] = balance
 			ustav_row[period["key"]] += balance
 
@@ -749,64 +761,24 @@ def build_tree_structure(raw_data, filters):
 	current_profit_row    = create_row("Joriy Sof Foyda", indent=2)
 	dividends_row         = create_row("Dividends", indent=2)
 
-	shareholder_dividends = defaultdict(list)
-	for pe in raw_data["payment_entries"]:
-		if (pe["party_type"] == "Shareholder"
-			and pe["payment_type"] == "Pay"
-			and pe.get("party") in shareholder_dict
-			and shareholder_dict.get(pe["party"], {}).get("custom_category") == "Dividends"):
-			shareholder_dividends[pe["party"]].append(pe)
+	shareholder_dividends = raw_data["shareholder_series"]["Dividends"]
+	interest = raw_data["interest"]
+	expenses = raw_data["expenses"]
+
+	def total_dividends_as_of(date):
+		return sum(series.as_of(date) for series in shareholder_dividends.values())
 
 	for i, period in enumerate(periods):
-		current_interest = sum(
-			flt(ia["custom_total_interest"]) for ia in raw_data["installment_applications"]
-			if period["from_date"] <= getdate(ia["transaction_date"]) <= period["to_date"]
-		)
-		current_expenses = 0
-		for pe in raw_data["payment_entries"]:
-			if (period["from_date"] <= getdate(pe["posting_date"]) <= period["to_date"]
-				and pe.get("custom_counterparty_category")):
-				category = category_dict.get(pe["custom_counterparty_category"])
-				if (category
-					and category.get("custom_expense_type") == "Xarajat"
-					and pe.get("party_type") == "Employee"
-					and pe.get("party_name") == "Xarajat"):
-					amount = flt(pe["paid_amount"])
-					if category.get("category_type") == "Income":
-						amount = -amount
-					current_expenses += amount
+		current_interest = interest.between(period["from_date"], period["to_date"])
+		current_expenses = expenses.between(period["from_date"], period["to_date"])
 
 		current_period_profit = current_interest - current_expenses
 		current_profit_row[period["key"]] = current_period_profit
 
 		if i == 0:
 			prev_date = add_days(period["from_date"], -1)
-			prev_interest = sum(
-				flt(ia["custom_total_interest"]) for ia in raw_data["installment_applications"]
-				if getdate(ia["transaction_date"]) <= prev_date
-			)
-			prev_expenses = 0
-			for pe in raw_data["payment_entries"]:
-				if (getdate(pe["posting_date"]) <= prev_date
-					and pe.get("custom_counterparty_category")):
-					category = category_dict.get(pe["custom_counterparty_category"])
-					if (category
-						and category.get("custom_expense_type") == "Xarajat"
-						and pe.get("party_type") == "Employee"
-						and pe.get("party_name") == "Xarajat"):
-						amount = flt(pe["paid_amount"])
-						if category.get("category_type") == "Income":
-							amount = -amount
-						prev_expenses += amount
-			prev_total_profit = prev_interest - prev_expenses
-			prev_dividends = sum(
-				flt(pe["paid_amount"]) for pe in raw_data["payment_entries"]
-				if pe["party_type"] == "Shareholder"
-				and pe["payment_type"] == "Pay"
-				and pe.get("party") in shareholder_dict
-				and shareholder_dict.get(pe["party"], {}).get("custom_category") == "Dividends"
-				and getdate(pe["posting_date"]) <= prev_date
-			)
+			prev_total_profit = interest.as_of(prev_date) - expenses.as_of(prev_date)
+			prev_dividends = total_dividends_as_of(prev_date)
 			retained = prev_total_profit - prev_dividends
 		else:
 			prev_period_key = periods[i-1]["key"]
@@ -814,14 +786,7 @@ def build_tree_structure(raw_data, filters):
 
 		retained_earnings_row[period["key"]] = retained
 
-		total_dividends_cumulative = sum(
-			flt(pe["paid_amount"]) for pe in raw_data["payment_entries"]
-			if pe["party_type"] == "Shareholder"
-			and pe["payment_type"] == "Pay"
-			and pe.get("party") in shareholder_dict
-			and shareholder_dict.get(pe["party"], {}).get("custom_category") == "Dividends"
-			and getdate(pe["posting_date"]) <= period["to_date"]
-		)
+		total_dividends_cumulative = total_dividends_as_of(period["to_date"])
 		dividends_row[period["key"]] = -total_dividends_cumulative
 
 		net_profit_parent_row[period["key"]] = (
@@ -839,12 +804,7 @@ def build_tree_structure(raw_data, filters):
 		shareholder_name = shareholder_dict.get(shareholder, {}).get("title") or shareholder
 		shareholder_row = create_row(shareholder_name, indent=3)
 		for period in periods:
-			paid_amount = sum(
-				flt(pe["paid_amount"]) for pe in shareholder_dividends[shareholder]
-				if pe["payment_type"] == "Pay"
-				and getdate(pe["posting_date"]) <= period["to_date"]
-			)
-			shareholder_row[period["key"]] = -paid_amount
+			shareholder_row[period["key"]] = -shareholder_dividends[shareholder].as_of(period["to_date"])
 		data.append(shareholder_row)
 
 	# JAMI KREDITORKA CALCULATION
@@ -3,6 +3,9 @@
 
 import frappe
 from frappe import _
+from frappe.utils import flt
+
+from cash_flow_app.utils import balance_snapshot
 
 
 def execute(filters=None):
@@ -34,79 +37,25 @@ def get_columns():
 def get_data(filters):
 	"""Get kassa balance data - ALL Cash accounts from Account doctype"""
 
-	# Barcha Cash type accountlarni olish va balansini hisoblash
-	query = """
-		SELECT
-			acc.name as kassa_name,
-			COALESCE(bal.qoldiq_summa, 0) as qoldiq_summa
-		FROM `tabAccount` acc
-		LEFT JOIN (
-			SELECT
-				kassa_name,
-				SUM(amount) as qoldiq_summa
-			FROM (
-				-- Receive: paid_to ga pul kirib keladi (kassaga kirim)
-				SELECT
-					pe.paid_to as kassa_name,
-					pe.received_amount as amount
-				FROM
-					`tabPayment Entry` pe
-				WHERE
-					pe.docstatus = 1
-					AND pe.payment_type = 'Receive'
-					AND pe.paid_to IS NOT NULL
-					AND pe.paid_to != ''
-
-				UNION ALL
-
-				-- Pay: paid_from dan pul ketadi (kassadan chiqim)
-				SELECT
-					pe.paid_from as kassa_name,
-					-pe.paid_amount as amount
-				FROM
-					`tabPayment Entry` pe
-				WHERE
-					pe.docstatus = 1
-					AND pe.payment_type = 'Pay'
-					AND pe.paid_from IS NOT NULL
-					AND pe.paid_from != ''
-
-				UNION ALL
-
-				-- Internal Transfer: paid_from dan ayriladi
-				SELECT
-					pe.paid_from as kassa_name,
-					-pe.paid_amount as amount
-				FROM
-					`tabPayment Entry` pe
-				WHERE
-					pe.docstatus = 1
-					AND pe.payment_type = 'Internal Transfer'
-					AND pe.paid_from IS NOT NULL
-					AND pe.paid_from != ''
-
-				UNION ALL
-
-				-- Internal Transfer: paid_to ga qo'shiladi
-				SELECT
-					pe.paid_to as kassa_name,
-					pe.received_amount as amount
-				FROM
-					`tabPayment Entry` pe
-				WHERE
-					pe.docstatus = 1
-					AND pe.payment_type = 'Internal Transfer'
-					AND pe.paid_to IS NOT NULL
-					AND pe.paid_to != ''
-			) as combined
-			GROUP BY kassa_name
-		) as bal ON bal.kassa_name = acc.name
-		WHERE acc.account_type = 'Cash'
-		AND acc.is_group = 0
-		ORDER BY acc.name
-	"""
-
-	data = frappe.db.sql(query, as_dict=1)
+	# Barcha Cash type accountlar
+	accounts = frappe.get_all(
+		"Account",
+		filters={"account_type": "Cash", "is_group": 0},
+		pluck="name",
+		order_by="name"
+	)
+
+	# Qoldiq: oxirgi oy snapshoti + undan keyingi barcha to'lovlar
+	# (Receive/Internal Transfer paid_to ga kirim, Pay/Internal Transfer paid_from dan chiqim)
+	balances = balance_snapshot.get_balances("Cash Account", parties=accounts)
+
+	data = []
+	for account in accounts:
+		debit, credit = balances.get(account, (0.0, 0.0))
+		data.append({
+			"kassa_name": account,
+			"qoldiq_summa": flt(debit - credit)
+		})
 	return data
 
 
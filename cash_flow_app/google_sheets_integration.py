@@ -6,13 +6,222 @@ Professional implementation with comprehensive error handling
 
 import frappe
 from frappe import _
+from frappe.utils import add_days, cint, get_datetime, now_datetime
+import itertools
 import json
 import os
+import queue
+import random
+import threading
+import time
+from collections import deque
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 
+# Sheets API: 60 requests per minute per user (service account) - keep a margin
+REQUESTS_PER_MINUTE = 55
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 64
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Pages buffered per DocType by a prefetch thread
+PREFETCH_PAGES = 4
+
+_credentials_lock = threading.Lock()
+_credentials_cache = {}
+_service_local = threading.local()
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_sheets_service(creds_file, scopes):
+    """
+    Cached credentials (process-wide) and Sheets client (per thread - the
+    HTTP transport is not thread-safe); rebuilt when the credentials file changes
+
+    Returns:
+        tuple: (credentials, service)
+    """
+    key = (creds_file, os.path.getmtime(creds_file), tuple(scopes))
+
+    with _credentials_lock:
+        if _credentials_cache.get('key') != key:
+            _credentials_cache.clear()
+            _credentials_cache.update({
+                'key': key,
+                'credentials': service_account.Credentials.from_service_account_file(
+                    creds_file, scopes=scopes
+                )
+            })
+        credentials = _credentials_cache['credentials']
+
+    services = getattr(_service_local, 'services', None)
+    if services is None:
+        services = _service_local.services = {}
+    if key not in services:
+        services.clear()
+        services[key] = build('sheets', 'v4', credentials=credentials, cache_discovery=False)
+        frappe.logger().info("Google Sheets service initialized")
+
+    return credentials, services[key]
+
+
+class SheetsQuotaGovernor:
+    """
+    Process-wide pacing of Sheets API requests
+
+    - at most requests_per_minute requests in any 60 second window
+    - 429 / 5xx are retried with exponential backoff + jitter
+    """
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, max_retries=MAX_RETRIES):
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.sent = deque()
+        self.request_count = 0
+        self.retry_count = 0
+
+    def acquire(self):
+        """Block until a request slot is free in the current window"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.sent and now - self.sent[0] >= 60:
+                    self.sent.popleft()
+                if len(self.sent) < self.requests_per_minute:
+                    self.sent.append(now)
+                    self.request_count += 1
+                    return
+                wait = 60 - (now - self.sent[0])
+            time.sleep(max(wait, 0.05))
+
+    def execute(self, request):
+        """Execute an API request within the quota, retrying throttled / failed calls"""
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            try:
+                return request.execute()
+            except HttpError as e:
+                status = getattr(getattr(e, 'resp', None), 'status', None)
+                if cint(status) not in RETRY_STATUSES or attempt == self.max_retries:
+                    raise
+                self.retry_count += 1
+                delay = min(BACKOFF_BASE_SECONDS * (2 ** attempt), BACKOFF_MAX_SECONDS)
+                time.sleep(delay + random.uniform(0, 1))
+
+
+def get_quota_governor():
+    """Shared governor - all exporters of the process draw from one quota"""
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = SheetsQuotaGovernor()
+    return _governor
+
+
+class _GovernedResource:
+    """
+    Proxy over a Sheets service / resource: every request's execute()
+    goes through the quota governor, call sites stay unchanged
+    """
+
+    def __init__(self, target, governor):
+        self._target = target
+        self._governor = governor
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if hasattr(result, 'execute'):
+                return _GovernedRequest(result, self._governor)
+            return _GovernedResource(result, self._governor)
+
+        return call
+
+
+class _GovernedRequest:
+    def __init__(self, request, governor):
+        self._request = request
+        self._governor = governor
+
+    def execute(self):
+        return self._governor.execute(self._request)
+
+
+_PREFETCH_DONE = object()
+
+
+class _PagePrefetcher(threading.Thread):
+    """
+    Reads export pages of one DocType in a background thread with its own
+    site connection; pages are handed over through a bounded queue so
+    memory stays at PREFETCH_PAGES pages per DocType
+    """
+
+    def __init__(self, exporter, doctype_name, filters=None, fields=None, maxsize=PREFETCH_PAGES):
+        super().__init__(name=f"sheets-prefetch-{doctype_name}", daemon=True)
+        self.exporter = exporter
+        self.doctype_name = doctype_name
+        self.filters = filters
+        self.fields = fields
+        self.site = frappe.local.site
+        self.sites_path = frappe.local.sites_path
+        self.user = frappe.session.user
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.cancelled = threading.Event()
+
+    def run(self):
+        # init/connect ham try ichida: xato bo'lsa ham iste'molchi xabar oladi
+        try:
+            frappe.init(site=self.site, sites_path=self.sites_path)
+            frappe.connect()
+            frappe.set_user(self.user)
+            for page in self.exporter._iter_doctype_pages(self.doctype_name, self.filters, self.fields):
+                if not self._put(page):
+                    return
+            self._put(_PREFETCH_DONE)
+        except Exception as e:
+            self._put(e)
+        finally:
+            frappe.destroy()
+
+    def _put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def pages(self):
+        """Consume prefetched pages (raises the worker's exception, if any)"""
+        while True:
+            try:
+                item = self.queue.get(timeout=1)
+            except queue.Empty:
+                if not self.is_alive() and self.queue.empty():
+                    raise RuntimeError(f"Prefetch thread for {self.doctype_name} stopped unexpectedly")
+                continue
+            if item is _PREFETCH_DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def cancel(self):
+        self.cancelled.set()
+
+
 class GoogleSheetsExporter:
     """
     Professional Google Sheets Export Handler
@@ -20,6 +229,16 @@ class GoogleSheetsExporter:
     """
     
     SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+    # Parents per page when reading a DocType
+    PAGE_SIZE = 500
+
+    # Cells per values write request (keeps request bodies small)
+    WRITE_BATCH_CELLS = 50000
+
+    # Incremental export: watermark + row index per sheet, full rewrite every N days
+    SYNC_STATE_DOCTYPE = 'Google Sheets Sync State'
+    FULL_RESYNC_DAYS = 7
     
     # Fields to exclude from export (non-data/virtual fields)
     EXCLUDED_FIELDTYPES = [
@@ -28,14 +247,27 @@ class GoogleSheetsExporter:
         'Column Break', 'Section Break', 'Tab Break'
     ]
     
-    def __init__(self):
-        """Initialize with service account credentials"""
+    def __init__(self, service=None, governor=None):
+        """
+        Initialize with service account credentials
+
+        Args:
+            service: Optional Sheets service (e.g. FakeSheetsService for offline benchmarks)
+            governor: Optional SheetsQuotaGovernor (default: process-wide one)
+        """
         self.service = None
         self.credentials = None
-        self._init_google_service()
+        self.governor = governor or get_quota_governor()
+        self._sheet_ids = {}
+        # False for offline benchmarks - the sheet state is not real
+        self.persist_sync_state = True
+        if service is None:
+            self._init_google_service()
+        else:
+            self.service = _GovernedResource(service, self.governor)
     
     def _init_google_service(self):
-        """Initialize Google Sheets API service"""
+        """Initialize Google Sheets API service (cached credentials / client)"""
         try:
             # Get credentials file path
             site_path = frappe.utils.get_site_path()
@@ -46,16 +278,11 @@ class GoogleSheetsExporter:
                 frappe.log_error(error_msg, "Google Sheets Init")
                 frappe.throw(_(error_msg))
             
-            # Load credentials
-            self.credentials = service_account.Credentials.from_service_account_file(
-                creds_file,
-                scopes=self.SCOPES
-            )
+            # Load credentials + build service (reused while the file is unchanged)
+            self.credentials, service = get_sheets_service(creds_file, self.SCOPES)
             
-            # Build service
-            self.service = build('sheets', 'v4', credentials=self.credentials)
-            
-            frappe.logger().info("Google Sheets service initialized")
+            # Every request goes through the quota governor
+            self.service = _GovernedResource(service, self.governor)
             
         except Exception as e:
             error_msg = f"Failed to initialize Google Sheets: {str(e)}"
@@ -63,16 +290,21 @@ class GoogleSheetsExporter:
             frappe.throw(_(error_msg))
     
     def export_doctype(self, doctype_name, filters=None, fields=None,
-                      spreadsheet_id=None, sheet_name=None):
+                      spreadsheet_id=None, sheet_name=None, sync_state=False, pages=None):
         """
         Export DocType data to Google Sheets
-        
+
+        Parents are read page by page and written in size-bounded chunks,
+        so memory does not grow with the table.
+
         Args:
             doctype_name (str): DocType to export
             filters (dict): Filters to apply
             fields (list): Fields to export (None = all)
             spreadsheet_id (str): Existing spreadsheet ID or None
             sheet_name (str): Sheet tab name
+            sync_state (bool): Save watermark + row index for incremental exports
+            pages (iterable): Optional prefetched pages (see _PagePrefetcher)
             
         Returns:
             dict: Export result with success status and details
@@ -87,28 +319,44 @@ class GoogleSheetsExporter:
             if not frappe.db.exists('DocType', doctype_name):
                 return {'success': False, 'message': f'DocType {doctype_name} does not exist'}
             
-            # Get data
-            data = self._fetch_doctype_data(doctype_name, filters, fields)
+            # Get data (lazy, page by page)
+            pages = iter(pages if pages is not None else self._iter_doctype_pages(doctype_name, filters, fields))
+            first_page = next(pages, None)
             
-            if not data:
+            if not first_page:
                 return {
                     'success': False,
                     'message': 'No data found to export'
                 }
             
             # Prepare for sheets
-            headers = list(data[0].keys())
-            rows = [[self._format_cell_value(row.get(h)) for h in headers] for row in data]
-            sheet_data = [headers] + rows
+            headers = list(first_page[0].keys())
+            pages = itertools.chain([first_page], pages)
+            tracker = {'row_index': {}, 'last_modified': None}
+            if sync_state:
+                pages = self._track_rows(pages, tracker)
+            row_chunks = (
+                [[self._format_cell_value(row.get(h)) for h in headers] for row in page]
+                for page in pages
+            )
             
             # Export to Google Sheets
-            result = self._write_to_google_sheets(
-                sheet_data,
+            result = self._write_rows(
+                headers,
+                row_chunks,
                 spreadsheet_id,
                 sheet_name or doctype_name
             )
+            rows_exported = result['rows_written']
+
+            if sync_state:
+                self._save_sync_state(
+                    result['sheet_name'], doctype_name, result['spreadsheet_id'], headers,
+                    tracker['row_index'], tracker['last_modified'],
+                    row_count=rows_exported + 1, full_sync=True
+                )
             
-            frappe.logger().info(f"Export completed: {len(data)} rows")
+            frappe.logger().info(f"Export completed: {rows_exported} rows")
             
             return {
                 'success': True,
@@ -116,9 +364,9 @@ class GoogleSheetsExporter:
                 'url': result['spreadsheet_url'],  # Add url key for frontend
                 'spreadsheet_url': result['spreadsheet_url'],
                 'sheet_name': result['sheet_name'],
-                'rows_exported': len(data),
-                'records_exported': len(data),  # Add for compatibility
-                'message': f'Successfully exported {len(data)} records'
+                'rows_exported': rows_exported,
+                'records_exported': rows_exported,  # Add for compatibility
+                'message': f'Successfully exported {rows_exported} records'
             }
             
         except Exception as e:
@@ -130,124 +378,393 @@ class GoogleSheetsExporter:
                 'message': error_msg
             }
     
-    def _fetch_doctype_data(self, doctype_name, filters=None, fields=None):
-        """Fetch DocType data with proper field validation"""
+    def plan_incremental(self, doctype_name, spreadsheet_id, sheet_name=None, force_full=False):
+        """
+        Sync state usable for a delta export of the sheet
+
+        Returns:
+            dict | None: {'state', 'headers'} or None when a full export is needed
+        """
+        sheet_name = sheet_name or doctype_name
+        state = self._get_sync_state(sheet_name)
+
+        if not state or force_full or not spreadsheet_id \
+                or state.spreadsheet_id != spreadsheet_id \
+                or state.export_doctype != doctype_name or not state.last_modified \
+                or not state.last_full_sync \
+                or get_datetime(state.last_full_sync) <= add_days(now_datetime(), -self.FULL_RESYNC_DAYS):
+            return None
+
+        headers = json.loads(state.headers or '[]')
+        if 'name' not in headers or 'modified' not in headers:
+            return None
+
+        return {'state': state, 'headers': headers}
+
+    def delta_filters(self, filters, plan):
+        """Filters selecting documents changed since the plan's watermark"""
+        # >= : documents saved in the same instant as the watermark are re-sent (idempotent)
+        return self._filter_list(filters, ['modified', '>=', get_datetime(plan['state'].last_modified)])
+
+    def export_doctype_incremental(self, doctype_name, spreadsheet_id, sheet_name=None,
+                                  filters=None, fields=None, force_full=False,
+                                  plan=None, pages=None):
+        """
+        Export only documents modified since the last run
+
+        Changed rows are updated in place via the saved row index
+        (name → sheet row), new ones are appended. A full export runs
+        instead when there is no usable state, the columns changed or the
+        last full sync is older than FULL_RESYNC_DAYS (deleted documents
+        leave the sheet only on a full sync).
+
+        Args:
+            plan: Result of plan_incremental (computed if not given)
+            pages: Optional prefetched pages matching the plan
+                (delta_filters for a plan, plain filters otherwise)
+
+        Returns:
+            dict: Same shape as export_doctype plus 'mode' ('full' / 'delta')
+        """
+        sheet_name = sheet_name or doctype_name
+        if plan is None and pages is None:
+            plan = self.plan_incremental(doctype_name, spreadsheet_id, sheet_name, force_full)
+
+        if not plan:
+            result = self.export_doctype(
+                doctype_name, filters=filters, fields=fields,
+                spreadsheet_id=spreadsheet_id, sheet_name=sheet_name,
+                sync_state=True, pages=pages
+            )
+            result['mode'] = 'full'
+            return result
+
+        state = plan['state']
+        headers = plan['headers']
+
         try:
-            # Get DocType metadata
-            meta = frappe.get_meta(doctype_name)
-
-            # Get valid database columns
-            db_columns = set(frappe.db.get_table_columns(doctype_name))
-
-            # Determine fields to fetch (parent fields)
-            if not fields:
-                fields = []
-
-                # Add standard fields
-                for std_field in ['name', 'owner', 'creation', 'modified', 'modified_by', 'docstatus']:
-                    if std_field in db_columns:
-                        fields.append(std_field)
-
-                # Add DocType fields
-                for field in meta.fields:
-                    if (field.fieldtype not in self.EXCLUDED_FIELDTYPES and
-                        field.fieldname in db_columns and
-                        field.fieldname not in fields):
-                        fields.append(field.fieldname)
-
-            # Validate all fields exist in database
-            parent_fields = [f for f in fields if f in db_columns]
-
-            if not parent_fields:
-                frappe.throw(_("No valid parent fields found for export"))
-
-            frappe.logger().info(f"Fetching {len(parent_fields)} parent fields for {doctype_name}")
-
-            # Fetch parent data
-            parents = frappe.get_all(
-                doctype_name,
-                filters=filters or {},
-                fields=parent_fields,
-                limit_page_length=0,  # No limit
-                order_by='modified desc'
+            row_index = json.loads(state.row_index or '{}')
+            row_count = cint(state.row_count)
+            last_modified = get_datetime(state.last_modified)
+
+            updates = []
+            appends = []
+            changed = 0
+            if pages is None:
+                pages = self._iter_doctype_pages(doctype_name, self.delta_filters(filters, plan), fields)
+
+            for page in pages:
+                if list(page[0].keys()) != headers:
+                    # Columns changed (new field etc.) - rewrite the whole sheet
+                    return self.export_doctype_incremental(
+                        doctype_name, spreadsheet_id, sheet_name, filters, fields, force_full=True
+                    )
+
+                for row in page:
+                    values = [self._format_cell_value(row.get(h)) for h in headers]
+                    if row['name'] in row_index:
+                        updates.append((row_index[row['name']], values))
+                    else:
+                        row_count += 1
+                        row_index[row['name']] = row_count
+                        appends.append(values)
+                    last_modified = max(last_modified, get_datetime(row['modified']))
+                    changed += 1
+
+                if len(updates) + len(appends) >= max(self.WRITE_BATCH_CELLS // len(headers), 1):
+                    self._write_delta(spreadsheet_id, sheet_name, updates, appends)
+                    updates, appends = [], []
+
+            self._write_delta(spreadsheet_id, sheet_name, updates, appends)
+
+            self._save_sync_state(
+                sheet_name, doctype_name, spreadsheet_id, headers,
+                row_index, last_modified, row_count=row_count
             )
 
-            frappe.logger().info(f"Fetched {len(parents)} parent records")
+            frappe.logger().info(f"Delta export completed: {sheet_name} - {changed} rows")
+
+            spreadsheet_url = f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}"
+            return {
+                'success': True,
+                'mode': 'delta',
+                'spreadsheet_id': spreadsheet_id,
+                'url': spreadsheet_url,
+                'spreadsheet_url': spreadsheet_url,
+                'sheet_name': sheet_name,
+                'rows_exported': changed,
+                'records_exported': changed,
+                'message': f'Successfully exported {changed} changed records'
+            }
+
+        except Exception as e:
+            error_msg = f"Delta export failed: {str(e)}"
+            frappe.log_error(error_msg, "Google Sheets Export")
+            frappe.logger().error(error_msg)
+            return {
+                'success': False,
+                'message': error_msg
+            }
 
-            # Check if doc has any child tables
-            child_tables = []
-            for f in meta.fields:
-                if f.fieldtype == 'Table':
-                    child_tables.append({'fieldname': f.fieldname, 'doctype': f.options})
+    def _write_delta(self, spreadsheet_id, sheet_name, updates, appends):
+        """In-place row updates in one values().batchUpdate, new rows appended"""
+        if updates:
+            self.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={
+                    'valueInputOption': 'USER_ENTERED',
+                    'data': [
+                        {'range': f"'{sheet_name}'!A{row_number}", 'values': [values]}
+                        for row_number, values in updates
+                    ]
+                }
+            ).execute()
 
-            rows = []
+        if appends:
+            self._flush_rows(spreadsheet_id, sheet_name, appends, first_write=False)
 
-            # If there are child tables, include them as JSON in parent row
-            if child_tables:
-                frappe.logger().info(f"Found {len(child_tables)} child tables for {doctype_name}: {[ct['fieldname'] for ct in child_tables]}")
-
-                for p in parents:
-                    parent_name = p.get('name')
-                    parent_row = {**p}  # Copy parent data
-                    
-                    # Fetch each child table and add as JSON column
-                    for ct in child_tables:
-                        child_fieldname = ct['fieldname']
-                        child_doctype = ct['doctype']
-                        
-                        try:
-                            # Prepare child fields to fetch
-                            child_meta = frappe.get_meta(child_doctype)
-                            child_db_cols = set(frappe.db.get_table_columns(child_doctype))
-                            child_fields = [cf.fieldname for cf in child_meta.fields if cf.fieldname in child_db_cols]
-                            
-                            # Fetch child rows
-                            children = frappe.get_all(
-                                child_doctype,
-                                filters={'parent': parent_name},
-                                fields=child_fields,
-                                order_by='idx asc'
-                            )
-                            
-                            # For 'items' table, add supplier info to each item
-                            if child_fieldname == 'items' and children:
-                                for child_row in children:
-                                    item_code = child_row.get('item_code') or child_row.get('item') or ''
-                                    supplier = child_row.get('supplier') or child_row.get('supplier_name') or ''
-                                    
-                                    # If no supplier in child row, lookup from Item Supplier
-                                    if not supplier and item_code:
-                                        try:
-                                            sup = frappe.get_all('Item Supplier', 
-                                                filters={'parent': item_code}, 
-                                                fields=['supplier','supplier_name'], 
-                                                limit_page_length=1)
-                                            if sup:
-                                                supplier = sup[0].get('supplier') or sup[0].get('supplier_name') or ''
-                                        except Exception:
-                                            supplier = ''
-                                    
-                                    child_row['supplier'] = supplier or ''
-                            
-                            # Add child table as JSON string
-                            import json
-                            parent_row[f'{child_fieldname}_json'] = json.dumps(children, default=str, ensure_ascii=False) if children else '[]'
-                                
-                        except Exception as e:
-                            frappe.logger().error(f"Failed to fetch {child_fieldname} for {parent_name}: {str(e)}")
-                            parent_row[f'{child_fieldname}_json'] = '[]'
-                    
-                    rows.append(parent_row)
-
-                return rows
-
-            # No child table expansion: return parent list of dicts
-            return parents
+    def _track_rows(self, pages, tracker):
+        """Pass pages through, recording sheet row numbers (header = row 1) and max modified"""
+        row_number = 1
+        for page in pages:
+            for row in page:
+                row_number += 1
+                if row.get('name'):
+                    tracker['row_index'][row['name']] = row_number
+                if row.get('modified'):
+                    modified = get_datetime(row['modified'])
+                    if not tracker['last_modified'] or modified > tracker['last_modified']:
+                        tracker['last_modified'] = modified
+            yield page
 
+    def _get_sync_state(self, sheet_name):
+        if not frappe.db.exists(self.SYNC_STATE_DOCTYPE, sheet_name):
+            return None
+        return frappe.get_doc(self.SYNC_STATE_DOCTYPE, sheet_name)
+
+    def _save_sync_state(self, sheet_name, doctype_name, spreadsheet_id, headers,
+                         row_index, last_modified, row_count, full_sync=False):
+        """Persist watermark and row index of a sheet (committed with the export)"""
+        if not self.persist_sync_state:
+            return
+
+        if frappe.db.exists(self.SYNC_STATE_DOCTYPE, sheet_name):
+            state = frappe.get_doc(self.SYNC_STATE_DOCTYPE, sheet_name)
+        else:
+            state = frappe.new_doc(self.SYNC_STATE_DOCTYPE)
+            state.sheet_name = sheet_name
+
+        state.update({
+            'export_doctype': doctype_name,
+            'spreadsheet_id': spreadsheet_id,
+            'headers': json.dumps(headers, ensure_ascii=False),
+            'row_index': json.dumps(row_index, ensure_ascii=False),
+            'last_modified': last_modified,
+            'row_count': row_count
+        })
+        if full_sync:
+            state.last_full_sync = now_datetime()
+
+        state.flags.ignore_permissions = True
+        state.save()
+        frappe.db.commit()
+
+    def _get_export_fields(self, doctype_name, fields=None):
+        """Parent fields that exist as database columns (all data fields by default)"""
+        meta = frappe.get_meta(doctype_name)
+        db_columns = set(frappe.db.get_table_columns(doctype_name))
+
+        if not fields:
+            fields = []
+
+            # Add standard fields
+            for std_field in ['name', 'owner', 'creation', 'modified', 'modified_by', 'docstatus']:
+                if std_field in db_columns:
+                    fields.append(std_field)
+
+            # Add DocType fields
+            for field in meta.fields:
+                if (field.fieldtype not in self.EXCLUDED_FIELDTYPES and
+                    field.fieldname in db_columns and
+                    field.fieldname not in fields):
+                    fields.append(field.fieldname)
+
+        # Validate all fields exist in database
+        parent_fields = [f for f in fields if f in db_columns]
+
+        if not parent_fields:
+            frappe.throw(_("No valid parent fields found for export"))
+
+        return parent_fields
+
+    def _filter_list(self, filters, *conditions):
+        """Filters (dict or list) as a list of [field, operator, value] + extra conditions"""
+        if isinstance(filters, dict):
+            result = [
+                [key, *value] if isinstance(value, (list, tuple)) else [key, '=', value]
+                for key, value in filters.items()
+            ]
+        else:
+            result = list(filters or [])
+        return result + [list(condition) for condition in conditions]
+
+    def _iter_parent_pages(self, doctype_name, filters, fields, page_size):
+        """
+        Yield parent rows page by page in `modified desc, name desc` order
+
+        Keyset cursor (modified, name): the rest of the cursor's timestamp
+        is read first, then older rows - no OFFSET scans.
+        """
+        cursor = None
+        while True:
+            page = []
+            if cursor:
+                page = frappe.get_all(
+                    doctype_name,
+                    filters=self._filter_list(
+                        filters, ['modified', '=', cursor[0]], ['name', '<', cursor[1]]
+                    ),
+                    fields=fields,
+                    order_by='name desc',
+                    limit_page_length=page_size
+                )
+
+            remaining = page_size - len(page)
+            if remaining:
+                page += frappe.get_all(
+                    doctype_name,
+                    filters=self._filter_list(
+                        filters, *([['modified', '<', cursor[0]]] if cursor else [])
+                    ),
+                    fields=fields,
+                    order_by='modified desc, name desc',
+                    limit_page_length=remaining
+                )
+
+            if not page:
+                return
+
+            yield page
+
+            if len(page) < page_size:
+                return
+            cursor = (page[-1]['modified'], page[-1]['name'])
+
+    def _get_child_tables(self, doctype_name):
+        """[{fieldname, doctype, fields}] of the DocType's child tables"""
+        child_tables = []
+        for f in frappe.get_meta(doctype_name).fields:
+            if f.fieldtype != 'Table':
+                continue
+            child_db_cols = set(frappe.db.get_table_columns(f.options))
+            child_tables.append({
+                'fieldname': f.fieldname,
+                'doctype': f.options,
+                'fields': [
+                    cf.fieldname for cf in frappe.get_meta(f.options).fields
+                    if cf.fieldname in child_db_cols
+                ]
+            })
+        return child_tables
+
+    def _get_item_suppliers(self, item_codes):
+        """{item_code: supplier} - first Item Supplier row of each item, one query"""
+        if not item_codes:
+            return {}
+
+        suppliers = {}
+        for row in frappe.get_all(
+            'Item Supplier',
+            filters={'parent': ['in', list(item_codes)]},
+            fields=['parent', 'supplier', 'supplier_name'],
+            order_by='parent asc, idx asc'
+        ):
+            if row.parent not in suppliers:
+                suppliers[row.parent] = row.get('supplier') or row.get('supplier_name') or ''
+        return suppliers
+
+    def _attach_child_tables(self, doctype_name, parents, child_tables):
+        """Add every child table as a JSON column - one IN query per child table per page"""
+        names = [p['name'] for p in parents]
+
+        for ct in child_tables:
+            child_fieldname = ct['fieldname']
+            by_parent = {}
+
+            try:
+                children = frappe.get_all(
+                    ct['doctype'],
+                    filters={
+                        'parent': ['in', names],
+                        'parenttype': doctype_name,
+                        'parentfield': child_fieldname
+                    },
+                    fields=['parent', *[f for f in ct['fields'] if f != 'parent']],
+                    order_by='parent asc, idx asc',
+                    limit_page_length=0
+                )
+            except Exception as e:
+                frappe.logger().error(f"Failed to fetch {child_fieldname} for {doctype_name}: {str(e)}")
+                children = []
+
+            # For 'items' table, add supplier info to each item
+            if child_fieldname == 'items' and children:
+                missing = {
+                    row.get('item_code') or row.get('item')
+                    for row in children
+                    if not (row.get('supplier') or row.get('supplier_name'))
+                    and (row.get('item_code') or row.get('item'))
+                }
+                item_suppliers = self._get_item_suppliers(missing)
+                for row in children:
+                    item_code = row.get('item_code') or row.get('item') or ''
+                    row['supplier'] = (
+                        row.get('supplier') or row.get('supplier_name')
+                        or item_suppliers.get(item_code) or ''
+                    )
+
+            for row in children:
+                by_parent.setdefault(row.pop('parent'), []).append(row)
+
+            # Add child table as JSON string
+            for p in parents:
+                rows = by_parent.get(p['name'])
+                p[f'{child_fieldname}_json'] = json.dumps(rows, default=str, ensure_ascii=False) if rows else '[]'
+
+    def _iter_doctype_pages(self, doctype_name, filters=None, fields=None, page_size=None):
+        """
+        Yield export rows (dicts) page by page
+
+        Parents are paged by a (modified, name) cursor; child tables are
+        included as `<fieldname>_json` columns.
+        """
+        try:
+            parent_fields = self._get_export_fields(doctype_name, fields)
+            # Cursor fields are always read, but only exported if requested
+            cursor_fields = [f for f in ('name', 'modified') if f not in parent_fields]
+            child_tables = self._get_child_tables(doctype_name)
+
+            frappe.logger().info(
+                f"Fetching {len(parent_fields)} parent fields, {len(child_tables)} child tables for {doctype_name}"
+            )
         except Exception as e:
             error_msg = f"Data fetch failed: {str(e)}"
             frappe.logger().error(error_msg)
             frappe.throw(_(error_msg))
+
+        for parents in self._iter_parent_pages(
+            doctype_name, filters, parent_fields + cursor_fields, page_size or self.PAGE_SIZE
+        ):
+            if child_tables:
+                self._attach_child_tables(doctype_name, parents, child_tables)
+
+            rows = []
+            for p in parents:
+                row = dict(p)
+                for f in cursor_fields:
+                    row.pop(f)
+                rows.append(row)
+            yield rows
     
     def _format_cell_value(self, value):
         """Format cell value for Google Sheets"""
@@ -261,7 +778,22 @@ class GoogleSheetsExporter:
         return str(value)
     
     def _write_to_google_sheets(self, data, spreadsheet_id=None, sheet_name='Sheet1'):
-        """Write data to Google Sheets with formatting"""
+        """Write a prepared matrix (header row + rows) to Google Sheets"""
+        return self._write_rows(data[0] if data else [], [data[1:]], spreadsheet_id, sheet_name)
+
+    def _write_rows(self, headers, row_chunks, spreadsheet_id=None, sheet_name='Sheet1'):
+        """
+        Write header + rows to Google Sheets in size-bounded requests
+
+        Args:
+            headers (list): Header row
+            row_chunks (iterable): Lists of formatted rows (consumed lazily)
+            spreadsheet_id (str): Existing spreadsheet ID or None (creates new)
+            sheet_name (str): Sheet tab name
+
+        Returns:
+            dict: spreadsheet_id, spreadsheet_url, sheet_name, rows_written
+        """
         try:
             # Create or use existing spreadsheet
             if not spreadsheet_id:
@@ -277,43 +809,40 @@ class GoogleSheetsExporter:
                 }).execute()
                 
                 spreadsheet_id = spreadsheet['spreadsheetId']
+                self._remember_sheets(spreadsheet_id, spreadsheet)
                 frappe.logger().info(f"Created spreadsheet: {spreadsheet_id}")
             else:
                 # Ensure sheet exists
                 self._ensure_sheet_exists(spreadsheet_id, sheet_name)
             
-            # Get number of columns in data to clear only data range, not the whole sheet
-            num_cols = len(data[0]) if data else 26
-            num_rows = len(data) if data else 1000
-            
-            # Calculate column letter for the last data column
-            def num_to_col_letter(n):
-                """Convert column number to letter (1->A, 27->AA)"""
-                result = ""
-                while n > 0:
-                    n -= 1
-                    result = chr(n % 26 + ord('A')) + result
-                    n //= 26
-                return result
-            
-            last_col = num_to_col_letter(num_cols)
-            
-            # Clear only the data range (not the whole sheet)
+            # Clear only the data columns (not the whole sheet)
+            num_cols = max(len(headers), 1)
+            last_col = self._column_letter(num_cols)
             try:
                 self.service.spreadsheets().values().clear(
                     spreadsheetId=spreadsheet_id,
-                    range=f"'{sheet_name}'!A1:{last_col}{num_rows}"
+                    range=f"'{sheet_name}'!A:{last_col}"
                 ).execute()
             except HttpError:
                 pass  # Sheet might not exist yet
             
-            # Write data with USER_ENTERED to preserve formulas
-            self.service.spreadsheets().values().update(
-                spreadsheetId=spreadsheet_id,
-                range=f"'{sheet_name}'!A1",
-                valueInputOption='USER_ENTERED',  # Changed from RAW to preserve formulas
-                body={'values': data}
-            ).execute()
+            # Rows per request, bounded by cell count
+            batch_rows = max(self.WRITE_BATCH_CELLS // num_cols, 1)
+            buffer = [headers]
+            rows_written = 0
+            first_write = True
+
+            for chunk in row_chunks:
+                for row in chunk:
+                    buffer.append(row)
+                    rows_written += 1
+                    if len(buffer) >= batch_rows:
+                        self._flush_rows(spreadsheet_id, sheet_name, buffer, first_write)
+                        buffer = []
+                        first_write = False
+
+            if buffer:
+                self._flush_rows(spreadsheet_id, sheet_name, buffer, first_write)
             
             # Format header row
             self._format_header(spreadsheet_id, sheet_name)
@@ -326,7 +855,8 @@ class GoogleSheetsExporter:
             return {
                 'spreadsheet_id': spreadsheet_id,
                 'spreadsheet_url': spreadsheet_url,
-                'sheet_name': sheet_name
+                'sheet_name': sheet_name,
+                'rows_written': rows_written
             }
             
         except HttpError as e:
@@ -337,21 +867,57 @@ class GoogleSheetsExporter:
             error_msg = f"Write failed: {str(e)}"
             frappe.logger().error(error_msg)
             frappe.throw(_(error_msg))
+
+    def _flush_rows(self, spreadsheet_id, sheet_name, rows, first_write):
+        """First chunk is written at A1, later chunks are appended below it"""
+        values = self.service.spreadsheets().values()
+        if first_write:
+            # USER_ENTERED to preserve formulas
+            values.update(
+                spreadsheetId=spreadsheet_id,
+                range=f"'{sheet_name}'!A1",
+                valueInputOption='USER_ENTERED',
+                body={'values': rows}
+            ).execute()
+        else:
+            # Append grows the grid when the sheet runs out of rows
+            values.append(
+                spreadsheetId=spreadsheet_id,
+                range=f"'{sheet_name}'!A1",
+                valueInputOption='USER_ENTERED',
+                insertDataOption='OVERWRITE',
+                body={'values': rows}
+            ).execute()
+
+    @staticmethod
+    def _column_letter(n):
+        """Convert column number to letter (1->A, 27->AA)"""
+        result = ""
+        while n > 0:
+            n -= 1
+            result = chr(n % 26 + ord('A')) + result
+            n //= 26
+        return result
     
+    def _remember_sheets(self, spreadsheet_id, spreadsheet):
+        """Cache sheetId of every tab in a spreadsheets().get / create response"""
+        sheet_ids = self._sheet_ids.setdefault(spreadsheet_id, {})
+        for sheet in spreadsheet.get('sheets', []):
+            sheet_ids[sheet['properties']['title']] = sheet['properties']['sheetId']
+
+    def _get_sheet_id(self, spreadsheet_id, sheet_name):
+        """sheetId of a tab - one spreadsheets().get per spreadsheet per exporter"""
+        if spreadsheet_id not in self._sheet_ids:
+            self._remember_sheets(spreadsheet_id, self.service.spreadsheets().get(
+                spreadsheetId=spreadsheet_id
+            ).execute())
+        return self._sheet_ids[spreadsheet_id].get(sheet_name)
+
     def _ensure_sheet_exists(self, spreadsheet_id, sheet_name):
         """Ensure sheet tab exists in spreadsheet"""
         try:
-            spreadsheet = self.service.spreadsheets().get(
-                spreadsheetId=spreadsheet_id
-            ).execute()
-            
-            sheet_exists = any(
-                sheet['properties']['title'] == sheet_name
-                for sheet in spreadsheet.get('sheets', [])
-            )
-            
-            if not sheet_exists:
-                self.service.spreadsheets().batchUpdate(
+            if self._get_sheet_id(spreadsheet_id, sheet_name) is None:
+                response = self.service.spreadsheets().batchUpdate(
                     spreadsheetId=spreadsheet_id,
                     body={
                         'requests': [{
@@ -363,6 +929,9 @@ class GoogleSheetsExporter:
                         }]
                     }
                 ).execute()
+                self._sheet_ids[spreadsheet_id][sheet_name] = (
+                    response['replies'][0]['addSheet']['properties']['sheetId']
+                )
                 frappe.logger().info(f"Created sheet: {sheet_name}")
                 
         except Exception as e:
@@ -371,16 +940,7 @@ class GoogleSheetsExporter:
     def _format_header(self, spreadsheet_id, sheet_name):
         """Format header row (bold, colored background)"""
         try:
-            spreadsheet = self.service.spreadsheets().get(
-                spreadsheetId=spreadsheet_id
-            ).execute()
-            
-            sheet_id = None
-            for sheet in spreadsheet.get('sheets', []):
-                if sheet['properties']['title'] == sheet_name:
-                    sheet_id = sheet['properties']['sheetId']
-                    break
-            
+            sheet_id = self._get_sheet_id(spreadsheet_id, sheet_name)
             if sheet_id is None:
                 return
             
@@ -423,16 +983,7 @@ class GoogleSheetsExporter:
     def _auto_resize_columns(self, spreadsheet_id, sheet_name):
         """Auto-resize columns to fit content"""
         try:
-            spreadsheet = self.service.spreadsheets().get(
-                spreadsheetId=spreadsheet_id
-            ).execute()
-            
-            sheet_id = None
-            for sheet in spreadsheet.get('sheets', []):
-                if sheet['properties']['title'] == sheet_name:
-                    sheet_id = sheet['properties']['sheetId']
-                    break
-            
+            sheet_id = self._get_sheet_id(spreadsheet_id, sheet_name)
             if sheet_id is None:
                 return
             
@@ -590,18 +1141,156 @@ def export_report_to_google_sheets(report_name, filters=None,
         }
 
 
+# Shartnoma sheet columns (one row per item)
+SHARTNOMA_COLUMNS = [
+    'shartnoma_raqami', 'mijoz', 'sana', 'status',
+    # Item info
+    'mahsulot_kodi', 'mahsulot_nomi', 'imei', 'soni', 'tan_narxi_usd',
+    'item_jami_usd', 'item_foizi_usd', 'item_foiz_bilan_usd', 'pastavshik',
+    # Payment info
+    'jami_summa_usd', 'boshlangich_tolov_usd', 'qolgan_summa_usd',
+    'oylik_tolov_usd', 'oylar_soni', 'birinchi_tolov_sanasi',
+    # Profit info
+    'foyda_summasi_usd', 'marja_foiz', 'ustama_foiz', 'jami_tolov_usd',
+]
+
+# Applications per item / supplier IN query
+SHARTNOMA_CHUNK_SIZE = 500
+
+_DOCSTATUS_LABELS = {0: 'Draft', 1: 'Submitted', 2: 'Cancelled'}
+
+
 @frappe.whitelist()
-def export_installment_application(spreadsheet_id=None, sheet_name='Shartnoma', filters=None):
+def export_installment_application(spreadsheet_id=None, sheet_name='Shartnoma', filters=None, columns=None):
     """
     Export Installment Application with child items in readable format
     Each item creates a separate row with parent info
+
+    Args:
+        columns: Optional list (or JSON list) of SHARTNOMA_COLUMNS to export
+    """
+    return _export_installment_application(None, spreadsheet_id, sheet_name, filters, columns)
+
+
+def _installment_rows(app, items, supplier_names):
+    """Sheet rows (dicts) of one application - one per item, or one empty-item row"""
+    # Convert docstatus to readable status
+    readable_status = _DOCSTATUS_LABELS.get(app.get('docstatus', 0), 'Unknown')
+
+    total_amount = app.get('total_amount') or 0
+    total_interest = app.get('custom_total_interest') or 0
+
+    # If no items, still show parent with empty item info
+    for item in items or [{}]:
+        # Calculate item's proportional interest
+        item_amount = item.get('amount') or 0
+
+        # Proporsional foiz: (item_amount / total_amount) × total_interest
+        if total_amount > 0:
+            item_interest = (item_amount / total_amount) * total_interest
+        else:
+            item_interest = 0
+
+        supplier = item.get('custom_supplier')
+
+        yield {
+            'shartnoma_raqami': app.get('name'),
+            'mijoz': app.get('customer'),
+            'sana': str(app.get('transaction_date') or ''),
+            'status': readable_status,
+
+            # Item info
+            'mahsulot_kodi': item.get('item_code') or '',
+            'mahsulot_nomi': item.get('item_name') or '',
+            'imei': item.get('imei') or '',
+            'soni': item.get('qty') or 0,
+            'tan_narxi_usd': item.get('rate') or 0,
+            'item_jami_usd': item_amount,
+            'item_foizi_usd': item_interest,
+            # Item foiz bilan: item_amount + item_interest
+            'item_foiz_bilan_usd': item_amount + item_interest,
+            'pastavshik': (supplier_names.get(supplier) or supplier) if supplier else '',
+
+            # Payment info
+            'jami_summa_usd': total_amount,
+            'boshlangich_tolov_usd': app.get('downpayment_amount') or 0,
+            'qolgan_summa_usd': app.get('finance_amount') or 0,
+            'oylik_tolov_usd': app.get('monthly_payment') or 0,
+            'oylar_soni': app.get('installment_months') or 0,
+            'birinchi_tolov_sanasi': str(app.get('custom_start_date') or ''),
+
+            # Profit info
+            'foyda_summasi_usd': total_interest,
+            'marja_foiz': app.get('custom_profit_percentage') or 0,
+            'ustama_foiz': app.get('custom_finance_profit_percentage') or 0,
+            'jami_tolov_usd': app.get('custom_grand_total_with_interest') or 0,
+        }
+
+
+def _iter_installment_row_chunks(applications, headers, format_value, counter):
+    """
+    Formatted rows per chunk of applications: items and supplier names
+    are loaded with one IN query each per chunk and grouped in memory
     """
+    need_items = any(h in SHARTNOMA_COLUMNS[4:13] for h in headers)
+    need_suppliers = 'pastavshik' in headers
+
+    for start in range(0, len(applications), SHARTNOMA_CHUNK_SIZE):
+        chunk = applications[start:start + SHARTNOMA_CHUNK_SIZE]
+
+        items_by_app = {}
+        if need_items:
+            for item in frappe.get_all(
+                'Installment Application Item',
+                filters={'parent': ['in', [app.name for app in chunk]], 'parenttype': 'Installment Application'},
+                fields=['parent', 'item_code', 'item_name', 'imei', 'qty', 'rate', 'amount', 'custom_supplier'],
+                order_by='parent asc, idx asc',
+                limit_page_length=0
+            ):
+                items_by_app.setdefault(item.parent, []).append(item)
+
+        supplier_names = {}
+        if need_suppliers:
+            suppliers = {
+                item.custom_supplier
+                for items in items_by_app.values() for item in items
+                if item.custom_supplier
+            }
+            if suppliers:
+                supplier_names = dict(frappe.get_all(
+                    'Supplier',
+                    filters={'name': ['in', list(suppliers)]},
+                    fields=['name', 'supplier_name'],
+                    as_list=True
+                ))
+
+        rows = []
+        for app in chunk:
+            for row in _installment_rows(app, items_by_app.get(app.name), supplier_names):
+                rows.append([format_value(row.get(h, '')) for h in headers])
+        counter['rows'] += len(rows)
+        yield rows
+
+
+def _export_installment_application(exporter, spreadsheet_id=None, sheet_name='Shartnoma',
+                                    filters=None, columns=None):
+    """export_installment_application with a shared exporter (None = new one)"""
     try:
-        exporter = GoogleSheetsExporter()
+        exporter = exporter or GoogleSheetsExporter()
 
         # Parse filters
         if isinstance(filters, str):
             filters = json.loads(filters) if filters else {}
+        if isinstance(columns, str):
+            columns = json.loads(columns) if columns else None
+
+        # Column projection (order as given, unknown names ignored)
+        headers = [c for c in columns if c in SHARTNOMA_COLUMNS] if columns else list(SHARTNOMA_COLUMNS)
+        if not headers:
+            return {
+                'success': False,
+                'message': 'Ustunlar noto\'g\'ri tanlangan'
+            }
 
         # Get all Installment Applications (including cancelled ones)
         # By default frappe.get_all excludes cancelled documents (docstatus=2)
@@ -635,98 +1324,6 @@ def export_installment_application(spreadsheet_id=None, sheet_name='Shartnoma',
                 'message': 'Shartnoma topilmadi'
             }
 
-        report_data = []
-
-        for app in applications:
-            app_name = app.get('name')
-
-            # Get child items
-            items = frappe.get_all(
-                'Installment Application Item',
-                filters={'parent': app_name},
-                fields=['item_code', 'item_name', 'imei', 'qty', 'rate', 'amount', 'custom_supplier'],
-                order_by='idx asc'
-            )
-
-            # If no items, still show parent with empty item info
-            if not items:
-                items = [{}]
-
-            # Create one row for each item
-            for item in items:
-                # Get supplier name if supplier exists
-                supplier_name = ''
-                if item.get('custom_supplier'):
-                    supplier_name = frappe.db.get_value('Supplier', item.get('custom_supplier'), 'supplier_name') or item.get('custom_supplier')
-
-                # Convert docstatus to readable status
-                docstatus = app.get('docstatus', 0)
-                if docstatus == 0:
-                    readable_status = 'Draft'
-                elif docstatus == 1:
-                    readable_status = 'Submitted'
-                elif docstatus == 2:
-                    readable_status = 'Cancelled'
-                else:
-                    readable_status = 'Unknown'
-
-                # Calculate item's proportional interest
-                item_amount = item.get('amount') or 0
-                total_amount = app.get('total_amount') or 0
-                total_interest = app.get('custom_total_interest') or 0
-
-                # Proporsional foiz: (item_amount / total_amount) × total_interest
-                if total_amount > 0:
-                    item_interest = (item_amount / total_amount) * total_interest
-                else:
-                    item_interest = 0
-
-                # Item foiz bilan: item_amount + item_interest
-                item_with_interest = item_amount + item_interest
-
-                row = {
-                    'shartnoma_raqami': app.get('name'),
-                    'mijoz': app.get('customer'),
-                    'sana': str(app.get('transaction_date') or ''),
-                    'status': readable_status,
-
-                    # Item info
-                    'mahsulot_kodi': item.get('item_code') or '',
-                    'mahsulot_nomi': item.get('item_name') or '',
-                    'imei': item.get('imei') or '',
-                    'soni': item.get('qty') or 0,
-                    'tan_narxi_usd': item.get('rate') or 0,
-                    'item_jami_usd': item_amount,
-                    'item_foizi_usd': item_interest,
-                    'item_foiz_bilan_usd': item_with_interest,
-                    'pastavshik': supplier_name,
-
-                    # Payment info
-                    'jami_summa_usd': total_amount,
-                    'boshlangich_tolov_usd': app.get('downpayment_amount') or 0,
-                    'qolgan_summa_usd': app.get('finance_amount') or 0,
-                    'oylik_tolov_usd': app.get('monthly_payment') or 0,
-                    'oylar_soni': app.get('installment_months') or 0,
-                    'birinchi_tolov_sanasi': str(app.get('custom_start_date') or ''),
-
-                    # Profit info
-                    'foyda_summasi_usd': total_interest,
-                    'marja_foiz': app.get('custom_profit_percentage') or 0,
-                    'ustama_foiz': app.get('custom_finance_profit_percentage') or 0,
-                    'jami_tolov_usd': app.get('custom_grand_total_with_interest') or 0,
-                }
-
-                report_data.append(row)
-
-        # Prepare for sheets
-        if not report_data:
-            return {
-                'success': False,
-                'message': 'Ma\'lumot topilmadi'
-            }
-
-        headers = list(report_data[0].keys())
-
         def format_value(val):
             """Raqamlarni son sifatida qoldiramiz"""
             if val is None:
@@ -735,12 +1332,11 @@ def export_installment_application(spreadsheet_id=None, sheet_name='Shartnoma',
                 return val
             return str(val)
 
-        rows = [[format_value(row.get(h, '')) for h in headers] for row in report_data]
-        sheet_data = [headers] + rows
-
-        # Write to sheet
-        result = exporter._write_to_google_sheets(
-            sheet_data,
+        # Write to sheet (rows are built and sent chunk by chunk)
+        counter = {'rows': 0}
+        result = exporter._write_rows(
+            headers,
+            _iter_installment_row_chunks(applications, headers, format_value, counter),
             spreadsheet_id,
             sheet_name
         )
@@ -750,9 +1346,9 @@ def export_installment_application(spreadsheet_id=None, sheet_name='Shartnoma',
             'spreadsheet_id': result['spreadsheet_id'],
             'spreadsheet_url': result['spreadsheet_url'],
             'sheet_name': result['sheet_name'],
-            'rows_exported': len(report_data),
-            'records_exported': len(report_data),
-            'message': f'Shartnoma: {len(applications)} ta shartnoma, {len(report_data)} ta qator'
+            'rows_exported': counter['rows'],
+            'records_exported': counter['rows'],
+            'message': f'Shartnoma: {len(applications)} ta shartnoma, {counter["rows"]} ta qator'
         }
 
     except Exception as e:
@@ -764,38 +1360,72 @@ def export_installment_application(spreadsheet_id=None, sheet_name='Shartnoma',
         }
 
 
+# Define doctypes to export with their display names
+EXPORT_DOCTYPES = [
+    {'doctype': 'Customer', 'sheet_name': 'Mijozlar'},
+    {'doctype': 'Supplier', 'sheet_name': 'Pastavshiklar'},
+    {'doctype': 'Payment Entry', 'sheet_name': 'Kassa Kirim-chiqim'},
+    {'doctype': 'Item', 'sheet_name': 'Mahsulotlar'},
+    {'doctype': 'Shareholder', 'sheet_name': 'Shareholder'},
+    {'doctype': 'Employee', 'sheet_name': 'Employee'},
+]
+
+
 @frappe.whitelist()
-def export_all_doctypes_to_sheet(spreadsheet_id=None):
+def export_all_doctypes_to_sheet(spreadsheet_id=None, incremental=False):
     """
     Export all main doctypes to Google Sheet automatically
 
+    Data of every sheet is read in parallel prefetch threads while sheets
+    are written one after another through the shared, quota-governed client.
+
     Args:
         spreadsheet_id: Optional spreadsheet ID (if None, creates new)
+        incremental: Only export documents changed since the last run
+            (see GoogleSheetsExporter.export_doctype_incremental);
+            Shartnoma is always rewritten (one row per item)
 
     Returns:
         dict: Export results for all doctypes
     """
     try:
-        # Define doctypes to export with their display names
-        doctypes_to_export = [
-            {'doctype': 'Customer', 'sheet_name': 'Mijozlar'},
-            {'doctype': 'Supplier', 'sheet_name': 'Pastavshiklar'},
-            {'doctype': 'Payment Entry', 'sheet_name': 'Kassa Kirim-chiqim'},
-            {'doctype': 'Item', 'sheet_name': 'Mahsulotlar'},
-            {'doctype': 'Shareholder', 'sheet_name': 'Shareholder'},
-            {'doctype': 'Employee', 'sheet_name': 'Employee'},
-        ]
-
-        results = []
-        exporter = GoogleSheetsExporter()
+        return _export_all_doctypes(GoogleSheetsExporter(), spreadsheet_id, incremental)
+    except Exception as e:
+        error_msg = f"Bulk export failed: {str(e)}"
+        frappe.log_error(error_msg, "Bulk Export Error")
+        return {
+            'success': False,
+            'message': error_msg
+        }
+
+
+def _export_all_doctypes(exporter, spreadsheet_id=None, incremental=False):
+    """Export pipeline of export_all_doctypes_to_sheet with a given exporter"""
+    doctypes_to_export = EXPORT_DOCTYPES
+    results = []
 
-        # Use single spreadsheet for all exports
-        current_spreadsheet_id = spreadsheet_id
+    # Use single spreadsheet for all exports
+    current_spreadsheet_id = spreadsheet_id
 
+    # Start reading every sheet's data in the background
+    jobs = []
+    for doc_config in doctypes_to_export:
+        plan = None
+        if cint(incremental) and current_spreadsheet_id:
+            plan = exporter.plan_incremental(
+                doc_config['doctype'], current_spreadsheet_id, doc_config['sheet_name']
+            )
+        fetch_filters = exporter.delta_filters(doc_config.get('filters'), plan) if plan else doc_config.get('filters')
+        prefetcher = _PagePrefetcher(exporter, doc_config['doctype'], fetch_filters, doc_config.get('fields'))
+        prefetcher.start()
+        jobs.append((doc_config, plan, prefetcher))
+
+    try:
         # First, export Installment Application using specialized function
         try:
             frappe.logger().info("Exporting Shartnoma (Installment Application)")
-            installment_result = export_installment_application(
+            installment_result = _export_installment_application(
+                exporter,
                 spreadsheet_id=current_spreadsheet_id,
                 sheet_name='Shartnoma'
             )
@@ -828,27 +1458,28 @@ def export_all_doctypes_to_sheet(spreadsheet_id=None):
                 'message': str(e)
             })
 
-        for doc_config in doctypes_to_export:
+        for doc_config, plan, prefetcher in jobs:
+            doctype = doc_config['doctype']
+            sheet_name = doc_config['sheet_name']
             try:
-                doctype = doc_config['doctype']
-                sheet_name = doc_config['sheet_name']
-                
                 frappe.logger().info(f"Exporting {doctype} to {sheet_name}")
-                
+
                 # Export doctype (allow passing filters from config)
-                result = exporter.export_doctype(
+                result = exporter.export_doctype_incremental(
                     doctype_name=doctype,
+                    spreadsheet_id=current_spreadsheet_id,
+                    sheet_name=sheet_name,
                     filters=doc_config.get('filters'),
                     fields=doc_config.get('fields'),  # Pass fields from config
-                    spreadsheet_id=current_spreadsheet_id,
-                    sheet_name=sheet_name
+                    plan=plan,
+                    pages=prefetcher.pages()
                 )
-                
+
                 if result.get('success'):
                     # Use the same spreadsheet for subsequent exports
                     if not current_spreadsheet_id:
                         current_spreadsheet_id = result.get('spreadsheet_id')
-                    
+
                     results.append({
                         'doctype': doctype,
                         'sheet_name': sheet_name,
@@ -863,7 +1494,7 @@ def export_all_doctypes_to_sheet(spreadsheet_id=None):
                         'success': False,
                         'message': result.get('message', 'Export failed')
                     })
-                    
+
             except Exception as e:
                 frappe.log_error(f"Failed to export {doctype}: {str(e)}", "Doctype Export Error")
                 results.append({
@@ -872,29 +1503,27 @@ def export_all_doctypes_to_sheet(spreadsheet_id=None):
                     'success': False,
                     'message': str(e)
                 })
-        
-        # Count successful exports
-        successful = sum(1 for r in results if r['success'])
-        total = len(doctypes_to_export)
-        
-        # Get spreadsheet URL
-        spreadsheet_url = f"https://docs.google.com/spreadsheets/d/{current_spreadsheet_id}"
-        
-        return {
-            'success': successful > 0,
-            'spreadsheet_id': current_spreadsheet_id,
-            'spreadsheet_url': spreadsheet_url,
-            'total_exports': total,
-            'successful_exports': successful,
-            'failed_exports': total - successful,
-            'results': results,
-            'message': f"Exported {successful}/{total} doctypes successfully"
-        }
-        
-    except Exception as e:
-        error_msg = f"Bulk export failed: {str(e)}"
-        frappe.log_error(error_msg, "Bulk Export Error")
-        return {
-            'success': False,
-            'message': error_msg
-        }
+            finally:
+                prefetcher.cancel()
+    finally:
+        for _doc_config, _plan, prefetcher in jobs:
+            prefetcher.cancel()
+            prefetcher.join(timeout=5)
+
+    # Count successful exports
+    successful = sum(1 for r in results if r['success'])
+    total = len(doctypes_to_export)
+
+    # Get spreadsheet URL
+    spreadsheet_url = f"https://docs.google.com/spreadsheets/d/{current_spreadsheet_id}"
+
+    return {
+        'success': successful > 0,
+        'spreadsheet_id': current_spreadsheet_id,
+        'spreadsheet_url': spreadsheet_url,
+        'total_exports': total,
+        'successful_exports': successful,
+        'failed_exports': total - successful,
+        'results': results,
+        'message': f"Exported {successful}/{total} doctypes successfully"
+    }
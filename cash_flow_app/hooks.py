@@ -31,23 +31,37 @@ doc_events = {
     },
     "Customer": {
         "after_insert": "cash_flow_app.cash_flow_management.api.telegram_bot_api.send_customer_notification",
-        "onload": "cash_flow_app.utils.customer_debt.update_customer_debt_on_load"
+        "onload": "cash_flow_app.utils.customer_debt.update_customer_debt_on_load",
+        "on_update": "cash_flow_app.utils.bot_cache.invalidate_on_customer_change",
+        "on_trash": "cash_flow_app.utils.bot_cache.invalidate_on_customer_change"
     },
     "Installment Application": {
         # 🟢 Shartnoma saqlanganda (Save) xabar boradi
-        "on_update": "cash_flow_app.cash_flow_management.api.telegram_bot_api.send_installment_notification",
+        "on_update": [
+            "cash_flow_app.cash_flow_management.api.telegram_bot_api.send_installment_notification",
+            "cash_flow_app.utils.imei_index.update_imei_index"
+        ],
+        "on_update_after_submit": "cash_flow_app.utils.imei_index.update_imei_index",
+        "on_trash": "cash_flow_app.utils.imei_index.update_imei_index",
         "on_submit": [
             "cash_flow_app.cash_flow_management.custom.supplier_debt_tracking.update_supplier_debt_on_submit",
             "cash_flow_app.cash_flow_management.overrides.payment_entry_linkage.on_submit_installment_application",
             # 🔵 Shartnoma tasdiqlanganda (Submit) xabar boradi
 			"cash_flow_app.cash_flow_management.api.financial_control_tower_api.on_document_change",
             "cash_flow_app.cash_flow_management.api.telegram_bot_api.send_installment_notification",
-            "cash_flow_app.utils.customer_debt.update_customer_debt_on_installment_submit"
+            "cash_flow_app.utils.customer_debt.update_customer_debt_on_installment_submit",
+            "cash_flow_app.utils.contract_balance.update_contract_balance_on_installment_submit",
+            "cash_flow_app.utils.balance_snapshot.update_snapshots_on_submit",
+            "cash_flow_app.utils.bot_cache.invalidate_on_document_change"
         ],
         "on_cancel": [
             "cash_flow_app.cash_flow_management.custom.supplier_debt_tracking.update_supplier_debt_on_cancel_installment",
 			"cash_flow_app.cash_flow_management.api.financial_control_tower_api.on_document_change",
-            "cash_flow_app.utils.customer_debt.update_customer_debt_on_installment_cancel"
+            "cash_flow_app.utils.customer_debt.update_customer_debt_on_installment_cancel",
+            "cash_flow_app.utils.contract_balance.update_contract_balance_on_installment_cancel",
+            "cash_flow_app.utils.imei_index.update_imei_index",
+            "cash_flow_app.utils.balance_snapshot.update_snapshots_on_cancel",
+            "cash_flow_app.utils.bot_cache.invalidate_on_document_change"
         ]
     },
     "Payment Entry": {
@@ -59,29 +73,44 @@ doc_events = {
             "cash_flow_app.cash_flow_management.custom.payment_validations.validate_negative_balance",
             "cash_flow_app.cash_flow_management.custom.payment_validations.warn_on_overdue_payments"
         ],
+        # Faqat ledger uchun muhim ishlar inline; qolganlari commitdan keyin fonda
+        # (notification, classification, supplier qarzi, FCT cache) - payment_entry_events
         "on_submit": [
             "cash_flow_app.cash_flow_management.overrides.payment_entry_linkage.on_submit_payment_entry",
-            "cash_flow_app.cash_flow_management.api.payment_entry.on_payment_submit",
-            "cash_flow_app.cash_flow_management.overrides.payment_entry_linkage.publish_customer_dashboard_refresh",
-            "cash_flow_app.cash_flow_management.custom.supplier_debt_tracking.update_supplier_debt_on_payment",
-            "cash_flow_app.cash_flow_management.api.telegram_bot_api.send_payment_notification",
-            "cash_flow_app.cash_flow_management.api.telegram_bot_api.send_payment_notification_v2",
-			"cash_flow_app.cash_flow_management.api.financial_control_tower_api.on_document_change",
-            "cash_flow_app.utils.customer_debt.update_customer_debt_on_payment_submit"
+            "cash_flow_app.utils.customer_debt.update_customer_debt_on_payment_submit",
+            "cash_flow_app.utils.contract_balance.update_contract_balance_on_payment_submit",
+            "cash_flow_app.utils.balance_snapshot.update_snapshots_on_submit",
+            "cash_flow_app.utils.bot_cache.invalidate_on_document_change",
+            "cash_flow_app.cash_flow_management.overrides.payment_entry_events.dispatch_on_submit"
         ],
         "on_cancel": [
             "cash_flow_app.cash_flow_management.overrides.payment_entry_linkage.on_cancel_payment_entry",
-            "cash_flow_app.cash_flow_management.custom.supplier_debt_tracking.update_supplier_debt_on_cancel_payment",
+            "cash_flow_app.cash_flow_management.overrides.payment_entry_linkage.publish_customer_dashboard_refresh",
+            "cash_flow_app.cash_flow_management.custom.supplier_debt_tracking.update_supplier_debt_on_payment",
             "cash_flow_app.cash_flow_management.api.telegram_bot_api.send_payment_cancel_notification",
 			"cash_flow_app.cash_flow_management.api.financial_control_tower_api.on_document_change",
-            "cash_flow_app.utils.customer_debt.update_customer_debt_on_payment_cancel"
+            "cash_flow_app.utils.customer_debt.update_customer_debt_on_payment_cancel",
+            "cash_flow_app.utils.contract_balance.update_contract_balance_on_payment_cancel",
+            "cash_flow_app.utils.balance_snapshot.update_snapshots_on_cancel",
+            "cash_flow_app.utils.bot_cache.invalidate_on_document_change"
         ]
     },
     "Sales Order": {
         "validate": "cash_flow_app.cash_flow_management.custom.payment_validations.validate_payment_schedule_paid_amount",
         "before_cancel": "cash_flow_app.cash_flow_management.overrides.payment_entry_linkage.on_cancel_sales_order",
-        "on_submit": "cash_flow_app.cash_flow_management.api.financial_control_tower_api.on_document_change",
-        "on_cancel": "cash_flow_app.cash_flow_management.api.financial_control_tower_api.on_document_change"
+        "on_submit": [
+            "cash_flow_app.cash_flow_management.api.financial_control_tower_api.on_document_change",
+            "cash_flow_app.utils.bot_cache.invalidate_on_document_change"
+        ],
+        "on_update_after_submit": [
+            "cash_flow_app.utils.contract_balance.update_contract_balance_on_sales_order_change",
+            "cash_flow_app.utils.bot_cache.invalidate_on_document_change"
+        ],
+        "on_cancel": [
+            "cash_flow_app.cash_flow_management.api.financial_control_tower_api.on_document_change",
+            "cash_flow_app.utils.contract_balance.update_contract_balance_on_sales_order_change",
+            "cash_flow_app.utils.bot_cache.invalidate_on_document_change"
+        ]
     }
 }
 
@@ -91,10 +120,22 @@ reports = {
 
 # Scheduled jobs
 scheduler_events = {
+    "all": [
+        "cash_flow_app.utils.telegram_outbox.schedule_drain"
+    ],
     "daily": [
         "cash_flow_app.cash_flow_management.api.payment_entry.update_all_customers_classification",
         "cash_flow_app.cash_flow_management.api.telegram_bot_api.send_payment_reminders",
-        "cash_flow_app.scheduled_tasks.daily_export_to_google_sheets"
+        "cash_flow_app.scheduled_tasks.daily_export_to_google_sheets",
+        "cash_flow_app.utils.customer_debt.reconcile_customer_debt_ledger",
+        "cash_flow_app.utils.telegram_outbox.cleanup_outbox",
+        "cash_flow_app.utils.contract_balance.refresh_overdue_days",
+        "cash_flow_app.utils.balance_snapshot.build_balance_snapshots"
+    ],
+    "weekly": [
+        "cash_flow_app.utils.contract_balance.reconcile_contract_balances",
+        "cash_flow_app.utils.balance_snapshot.rebuild_balance_snapshots",
+        "cash_flow_app.utils.imei_index.rebuild_imei_index"
     ],
     "cron": {
         "59 23 * * *": [
@@ -0,0 +1,15 @@
+import frappe
+
+
+def execute():
+	"""
+	Balance Snapshot jadvalini barcha yopilgan oylar uchun to'ldirish.
+
+	Kassa, mijoz va yetkazib beruvchi hisobotlari boshlang'ich qoldiqni
+	oxirgi oy snapshotidan + undan keyingi hujjatlardan hisoblaydi.
+	"""
+	from cash_flow_app.utils.balance_snapshot import rebuild_balance_snapshots
+
+	frappe.reload_doc("cash_flow_management", "doctype", "balance_snapshot")
+	written = rebuild_balance_snapshots()
+	print(f"✅ {written} ta balans snapshoti yaratildi")
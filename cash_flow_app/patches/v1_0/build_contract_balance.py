@@ -0,0 +1,15 @@
+import frappe
+
+
+def execute():
+	"""
+	Contract Balance jadvalini barcha tasdiqlangan shartnomalar uchun to'ldirish.
+
+	Hooklar to'lovlarni delta bilan yangilaydi, bot va eslatmalar esa
+	navbatdagi to'lovni (next_due_installment_amount bilan) shu jadvaldan o'qiydi.
+	"""
+	from cash_flow_app.utils.contract_balance import reconcile_contract_balances
+
+	frappe.reload_doc("cash_flow_management", "doctype", "contract_balance")
+	written = reconcile_contract_balances()
+	print(f"✅ {written} ta shartnoma balansi yaratildi")
@@ -0,0 +1,15 @@
+import frappe
+
+
+def execute():
+	"""
+	Customer Debt Ledger jadvalini boshlang'ich qiymatlar bilan to'ldirish.
+
+	Hooklar qarzni delta bilan yangilaydi, shuning uchun har bir mijoz
+	uchun ledger qatori mavjud bo'lishi kerak.
+	"""
+	from cash_flow_app.utils.customer_debt import reconcile_customer_debt_ledger
+
+	frappe.reload_doc("cash_flow_management", "doctype", "customer_debt_ledger")
+	result = reconcile_customer_debt_ledger()
+	print(f"✅ {result['repaired']} ta mijoz ledger qatori yaratildi/yangilandi")
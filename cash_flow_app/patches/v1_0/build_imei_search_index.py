@@ -0,0 +1,14 @@
+import frappe
+
+
+def execute():
+	"""
+	IMEI Search Index ni barcha (bekor qilinmagan) shartnomalar uchun to'ldirish.
+
+	IMEI Qidiruv hisoboti va typeahead IMEI ni shu suffiks indeksdan qidiradi.
+	"""
+	from cash_flow_app.utils.imei_index import rebuild_imei_index
+
+	frappe.reload_doc("cash_flow_management", "doctype", "imei_search_index")
+	written = rebuild_imei_index()
+	print(f"✅ {written} ta IMEI indeks qatori yaratildi")
@@ -0,0 +1,14 @@
+import frappe
+
+
+def execute():
+	"""
+	ITEM-#### hisoblagichini (tabSeries "ITEM-") mavjud itemlar bo'yicha to'g'rilash.
+
+	autoname_item endi Item jadvalini skanerlamaydi, keyingi raqamni shu
+	hisoblagichdan atomik oladi.
+	"""
+	from cash_flow_app.cash_flow_management.overrides.item_autoname import sync_item_series
+
+	current = sync_item_series()
+	print(f"✅ ITEM- hisoblagichi: {current}")
@@ -61,104 +61,96 @@
         console.log('   User:', frappe.session.user);
         console.log('   Session:', frappe.session);
 
+        // ✅ Only sessions viewing this customer get its events (doc room)
+        frappe.realtime.doc_subscribe('Customer', frm.doc.name);
+
         // ✅ IMPORTANT: Remove old listener first to prevent duplicates
         frappe.realtime.off('payment_entry_submitted');
 
-        // Listen for payment_entry_submitted event (socket.io)
+        // Listen for payment_entry_submitted event (socket.io) - delta of changed contracts
         frappe.realtime.on('payment_entry_submitted', function (data) {
-            // 🔍 DEBUG: Log event reception
-            console.log('\n🟣 RECEIVED REALTIME EVENT:');
-            console.log('   Event: payment_entry_submitted');
-            console.log('   Data:', data);
-            console.log('   Current customer:', frm.doc.name);
-            console.log('   Event customer:', data.customer);
-            console.log('   Match:', data.customer === frm.doc.name);
+            console.log('\n🟣 RECEIVED REALTIME EVENT:', data.customer, data.changed_contracts);
 
-            // Only refresh if this customer is affected
-            if (data.customer === frm.doc.name) {
-                console.log('✅ Customer match! Refreshing dashboard...');
+            // Form may have moved on to another customer
+            if (data.customer !== frm.doc.name) {
+                console.log('❌ Customer does NOT match. Skipping.');
+                return;
+            }
 
-                // Show notification
-                frappe.show_alert({
-                    message: __('Payment Entry {0} submitted! Refreshing dashboard...', [data.payment_entry]),
-                    indicator: 'green'
-                }, 5);
+            frappe.show_alert({
+                message: __('Payment Entry {0} - dashboard updated', [(data.payment_entries || []).join(', ')]),
+                indicator: 'green'
+            }, 5);
 
-                // Refresh dashboard
-                refresh_customer_dashboard(frm);
-            } else {
-                console.log('❌ Customer does NOT match. Skipping refresh.');
-            }
+            apply_dashboard_delta(frm, data);
         });
 
         console.log('✅ Realtime listener setup complete!\n');
     }
 
     function refresh_customer_dashboard(frm) {
-        console.log('🔄 FORCE REFRESH - clearing cache and reloading...');
+        console.log('🔄 REFRESH - reloading if dashboard data changed...');
 
-        // Clear existing dashboard sections
-        $('.customer-contracts-section').remove();
-        $('.customer-payment-schedule-section').remove();
+        // ✅ Send the current version: server answers "unchanged" if nothing changed
+        load_customer_dashboard(frm, { version: frm.__dashboard_version });
+    }
 
-        // ✅ FORCE RELOAD - Use Promise.all to fetch BOTH API calls in parallel
-        Promise.all([
-            frappe.call({
-                method: 'cash_flow_app.cash_flow_management.api.customer_history.get_customer_contracts',
-                args: { customer: frm.doc.name },
-                freeze: true,
-                freeze_message: __('Yangilanmoqda...'),
-                no_cache: true,  // ✅ Bypass cache
-                async: false  // ✅ Force synchronous to ensure fresh data
-            }),
-            frappe.call({
-                method: 'cash_flow_app.cash_flow_management.api.customer_history.get_payment_schedule_with_history',
-                args: { customer: frm.doc.name },
-                no_cache: true,  // ✅ Bypass cache
-                async: false  // ✅ Force synchronous to ensure fresh data
-            })
-        ]).then(([contracts_response, schedules_response]) => {
-            console.log('📥 Received fresh data from both APIs:');
-            console.log('   Contracts:', contracts_response.message?.length || 0);
-            console.log('   Schedules:', schedules_response.message?.length || 0);
-
-            const contracts = contracts_response.message || [];
-            const schedules = schedules_response.message || [];
-
-            if (contracts.length > 0) {
-                render_contracts_with_inline_schedules(frm, contracts, schedules);
-                console.log('✅ Dashboard refreshed with latest data!');
-            } else {
-                render_empty_state(frm);
+    function load_customer_dashboard(frm, opts = {}) {
+        // 🚀 One call: contracts + payment schedules (grouped queries on the server)
+        frappe.call({
+            method: 'cash_flow_app.cash_flow_management.api.customer_history.get_customer_dashboard',
+            args: { customer: frm.doc.name, version: opts.version || null }
+        }).then(r => {
+            const data = r.message || {};
+
+            if (data.unchanged) {
+                console.log('✅ Dashboard data unchanged - skip re-render');
+                return;
             }
+
+            set_dashboard_data(frm, data.version, data.contracts || [], data.schedules || []);
         }).catch(error => {
-            console.error('❌ Error refreshing dashboard:', error);
+            console.error('❌ Error loading dashboard:', error);
             frappe.msgprint(__('Ma\'lumotlarni yangilashda xatolik'));
         });
     }
 
-    function load_customer_dashboard(frm) {
-        // 🚀 Fetch BOTH contracts AND payment schedules TOGETHER
-        Promise.all([
-            frappe.call({
-                method: 'cash_flow_app.cash_flow_management.api.customer_history.get_customer_contracts',
-                args: { customer: frm.doc.name }
-            }),
-            frappe.call({
-                method: 'cash_flow_app.cash_flow_management.api.customer_history.get_payment_schedule_with_history',
-                args: { customer: frm.doc.name }
-            })
-        ]).then(([contracts_response, schedules_response]) => {
-            const contracts = contracts_response.message || [];
-            const all_schedules = schedules_response.message || [];
-
-            if (contracts.length > 0) {
-                // ✅ Render contracts WITH inline payment schedules
-                render_contracts_with_inline_schedules(frm, contracts, all_schedules);
-            } else {
-                render_empty_state(frm);
-            }
-        });
+    function set_dashboard_data(frm, version, contracts, schedules) {
+        frm.__dashboard_version = version;
+        frm.__dashboard_data = { contracts, schedules };
+
+        if (contracts.length > 0) {
+            // ✅ Render contracts WITH inline payment schedules
+            render_contracts_with_inline_schedules(frm, contracts, schedules);
+        } else {
+            render_empty_state(frm);
+        }
+    }
+
+    // ✅ Merge pushed contracts into the loaded data - no refetch
+    function apply_dashboard_delta(frm, delta) {
+        const data = frm.__dashboard_data;
+        if (!data) {
+            load_customer_dashboard(frm);
+            return;
+        }
+
+        // Changed contracts are replaced (cancelled ones come back without rows and drop out)
+        const changed = new Set(delta.changed_contracts || []);
+        const contracts = data.contracts
+            .filter(c => !changed.has(c.name))
+            .concat(delta.contracts || []);
+        const schedules = data.schedules
+            .filter(row => !changed.has(row.contract))
+            .concat(delta.schedules || []);
+
+        // Same order as the server: Completed last, newest first
+        contracts.sort((a, b) =>
+            (a.custom_status === 'Completed') - (b.custom_status === 'Completed')
+            || String(b.transaction_date).localeCompare(String(a.transaction_date))
+        );
+
+        set_dashboard_data(frm, delta.version, contracts, schedules);
     }
 
     // ❌ OLD FUNCTIONS REMOVED - using render_contracts_with_inline_schedules instead
@@ -452,6 +444,9 @@
     // Payment schedules are now rendered INLINE with each contract card
 
     function render_empty_state(frm) {
+        $('.customer-contracts-section').remove();
+        $('.customer-payment-schedule-section').remove();
+
         const html = `
                 < div class="customer-contracts-section" style = "background: #f9fafb; padding: 40px; border-radius: 8px; margin-top: 20px; text-align: center; border: 2px dashed #d1d5db;" >
             <div style="font-size: 48px; margin-bottom: 15px;">📋</div>
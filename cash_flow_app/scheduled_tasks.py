@@ -25,7 +25,8 @@ def daily_export_to_google_sheets():
         # Export all doctypes function ni chaqiramiz
         from cash_flow_app.google_sheets_integration import export_all_doctypes_to_sheet
 
-        result = export_all_doctypes_to_sheet(spreadsheet_id=SHEET_ID)
+        # Delta rejim: faqat o'zgargan hujjatlar (har FULL_RESYNC_DAYS kunda to'liq qayta yoziladi)
+        result = export_all_doctypes_to_sheet(spreadsheet_id=SHEET_ID, incremental=True)
 
         if result.get('success'):
             frappe.logger().info(
@@ -0,0 +1,409 @@
+"""
+Balance Snapshot
+Closed-month cumulative balances per cash account, customer and supplier
+
+Opening balances used to be summed from the first ever document on every
+report run. `Balance Snapshot` keeps cumulative debit / credit as of each
+closed month-end (one row per party and month with movements), so
+
+	balance(d) = latest snapshot <= d  +  movements after the snapshot up to d
+
+and report time depends on the selected window instead of the history.
+
+- Daily: closed months after the watermark are added (cumulative, set-based)
+- Backdated submit / cancel (document month <= watermark): the party's
+  snapshots from that month on are moved by the document's delta
+- Weekly: full rebuild repairs any drift
+
+Snapshot types (debit / credit):
+- Cash Account: money in (Receive, Internal Transfer → paid_to) /
+  money out (Pay, Internal Transfer → paid_from)
+- Customer: Installment Application (with interest) + Pay / Receive
+- Supplier: Pay / Installment Application items (qty * rate) + Receive
+"""
+from collections import defaultdict
+
+import frappe
+from frappe.utils import add_days, flt, get_first_day, get_last_day, getdate, now_datetime, nowdate
+
+SNAPSHOT_DOCTYPE = "Balance Snapshot"
+SNAPSHOT_TYPES = ("Cash Account", "Customer", "Supplier")
+
+# Last closed month-end included in the snapshots (global default)
+WATERMARK_KEY = "balance_snapshot_month_end"
+
+# Rows per bulk insert
+INSERT_CHUNK_SIZE = 1000
+
+# Lower bound for "movements after" when there is no snapshot
+_NO_SNAPSHOT = "1900-01-01"
+
+# Movement sources per snapshot type; every leg yields party, date, debit, credit
+_SOURCES = {
+	"Cash Account": (
+		{
+			"doctype": "Payment Entry", "table": "`tabPayment Entry` doc",
+			"party": "doc.paid_to", "date": "doc.posting_date",
+			"debit": "doc.received_amount", "credit": "0",
+			"where": "doc.payment_type IN ('Receive', 'Internal Transfer')"
+		},
+		{
+			"doctype": "Payment Entry", "table": "`tabPayment Entry` doc",
+			"party": "doc.paid_from", "date": "doc.posting_date",
+			"debit": "0", "credit": "doc.paid_amount",
+			"where": "doc.payment_type IN ('Pay', 'Internal Transfer')"
+		},
+	),
+	"Customer": (
+		{
+			"doctype": "Installment Application", "table": "`tabInstallment Application` doc",
+			"party": "doc.customer", "date": "doc.transaction_date",
+			"debit": "doc.custom_grand_total_with_interest", "credit": "0",
+			"where": "1 = 1"
+		},
+		{
+			"doctype": "Payment Entry", "table": "`tabPayment Entry` doc",
+			"party": "doc.party", "date": "doc.posting_date",
+			"debit": "CASE WHEN doc.payment_type = 'Pay' THEN doc.paid_amount ELSE 0 END",
+			"credit": "CASE WHEN doc.payment_type = 'Receive' THEN doc.paid_amount ELSE 0 END",
+			"where": "doc.party_type = 'Customer' AND doc.payment_type IN ('Pay', 'Receive')"
+		},
+	),
+	"Supplier": (
+		{
+			"doctype": "Installment Application",
+			"table": "`tabInstallment Application` doc "
+				"INNER JOIN `tabInstallment Application Item` item ON item.parent = doc.name",
+			"party": "item.custom_supplier", "date": "doc.transaction_date",
+			"debit": "0", "credit": "item.qty * item.rate",
+			"where": "1 = 1"
+		},
+		{
+			"doctype": "Payment Entry", "table": "`tabPayment Entry` doc",
+			"party": "doc.party", "date": "doc.posting_date",
+			"debit": "CASE WHEN doc.payment_type = 'Pay' THEN doc.paid_amount ELSE 0 END",
+			"credit": "CASE WHEN doc.payment_type = 'Receive' THEN doc.received_amount ELSE 0 END",
+			"where": "doc.party_type = 'Supplier' AND doc.payment_type IN ('Pay', 'Receive')"
+		},
+	),
+}
+
+
+# ============================================================
+# MOVEMENTS
+# ============================================================
+
+def _movements_sql(snapshot_type, parties=False, upto=True, doctype=None):
+	"""
+	UNION ALL of the movement legs of a snapshot type
+
+	Params used: %(after)s, %(upto)s (if upto), %(parties)s (if parties),
+	%(docname)s (if doctype - one document of that doctype regardless of docstatus)
+	"""
+	legs = []
+	for source in _SOURCES[snapshot_type]:
+		if doctype and source["doctype"] != doctype:
+			continue
+
+		conditions = [source["where"], f"IFNULL({source['party']}, '') != ''"]
+		if doctype:
+			conditions.append("doc.name = %(docname)s")
+		else:
+			conditions.append("doc.docstatus = 1")
+			conditions.append(f"{source['date']} > %(after)s")
+			if upto:
+				conditions.append(f"{source['date']} <= %(upto)s")
+		if parties:
+			conditions.append(f"{source['party']} IN %(parties)s")
+
+		legs.append(f"""
+			SELECT
+				{source['party']} AS party,
+				{source['date']} AS posting_date,
+				{source['debit']} AS debit,
+				{source['credit']} AS credit
+			FROM {source['table']}
+			WHERE {' AND '.join(conditions)}
+		""")
+
+	return "\nUNION ALL\n".join(legs)
+
+
+def get_movements(snapshot_type, after=None, upto=None, parties=None):
+	"""
+	Debit / credit per party for documents dated in (after, upto]
+
+	Args:
+		after: Exclusive lower date bound (None = from the beginning)
+		upto: Inclusive upper date bound (None = no bound)
+		parties: Optional list of parties
+
+	Returns:
+		dict: {party: [debit, credit]}
+	"""
+	if parties is not None and not parties:
+		return {}
+
+	rows = frappe.db.sql(f"""
+		SELECT t.party, COALESCE(SUM(t.debit), 0), COALESCE(SUM(t.credit), 0)
+		FROM ({_movements_sql(snapshot_type, parties=parties is not None, upto=upto is not None)}) t
+		GROUP BY t.party
+	""", {
+		"after": after or _NO_SNAPSHOT,
+		"upto": upto,
+		"parties": tuple(parties or ())
+	})
+	return {party: [flt(debit), flt(credit)] for party, debit, credit in rows}
+
+
+# ============================================================
+# SNAPSHOT LOOKUP
+# ============================================================
+
+def get_watermark():
+	"""Last month-end included in the snapshots, or None"""
+	value = frappe.db.get_global(WATERMARK_KEY)
+	return getdate(value) if value else None
+
+
+def get_snapshot_base(date):
+	"""
+	Latest snapshotted month-end on or before date
+
+	Returns:
+		date | None: None when no snapshot can be used
+	"""
+	watermark = get_watermark()
+	if not watermark or not date:
+		return None
+
+	date = getdate(date)
+	month_end = date if date == getdate(get_last_day(date)) else getdate(add_days(get_first_day(date), -1))
+	return min(month_end, watermark)
+
+
+def snapshot_sql(snapshot_type, party_condition=""):
+	"""
+	SQL selecting party, month_end, debit, credit of the latest snapshot
+	row of every party on or before %(snapshot_date)s
+
+	Args:
+		snapshot_type: One of SNAPSHOT_TYPES (inlined, not user input)
+		party_condition: Optional extra condition on `party`, e.g. "AND party IN %(parties)s"
+	"""
+	if snapshot_type not in SNAPSHOT_TYPES:
+		frappe.throw(f"Noma'lum snapshot turi: {snapshot_type}")
+
+	return f"""
+		SELECT s.party, s.month_end, s.debit, s.credit
+		FROM `tabBalance Snapshot` s
+		INNER JOIN (
+			SELECT party, MAX(month_end) AS month_end
+			FROM `tabBalance Snapshot`
+			WHERE snapshot_type = '{snapshot_type}'
+			  AND month_end <= %(snapshot_date)s
+			  {party_condition}
+			GROUP BY party
+		) latest ON latest.party = s.party AND latest.month_end = s.month_end
+		WHERE s.snapshot_type = '{snapshot_type}'
+	"""
+
+
+def get_snapshot_totals(snapshot_type, snapshot_date, parties=None):
+	"""
+	Cumulative debit / credit per party as of a snapshotted month-end
+
+	Returns:
+		dict: {party: [debit, credit]}
+	"""
+	if not snapshot_date or (parties is not None and not parties):
+		return {}
+
+	party_condition = "AND party IN %(parties)s" if parties is not None else ""
+	rows = frappe.db.sql(snapshot_sql(snapshot_type, party_condition), {
+		"snapshot_date": snapshot_date,
+		"parties": tuple(parties or ())
+	}, as_dict=True)
+	return {row.party: [flt(row.debit), flt(row.credit)] for row in rows}
+
+
+def get_balances(snapshot_type, upto=None, parties=None):
+	"""
+	Cumulative debit / credit per party: latest snapshot + movements since
+
+	Args:
+		snapshot_type: "Cash Account" | "Customer" | "Supplier"
+		upto: Inclusive date (None = all submitted documents)
+		parties: Optional list of parties (None = all)
+
+	Returns:
+		dict: {party: [debit, credit]}
+	"""
+	base = get_snapshot_base(upto) if upto else get_watermark()
+	totals = defaultdict(lambda: [0.0, 0.0])
+
+	for source in (
+		get_snapshot_totals(snapshot_type, base, parties),
+		get_movements(snapshot_type, after=base, upto=upto, parties=parties)
+	):
+		for party, (debit, credit) in source.items():
+			totals[party][0] += debit
+			totals[party][1] += credit
+
+	return dict(totals)
+
+
+def get_net_balance(snapshot_type, upto=None, parties=None):
+	"""Sum of (debit - credit) over the selected parties"""
+	return sum(debit - credit for debit, credit in get_balances(snapshot_type, upto, parties).values())
+
+
+# ============================================================
+# BUILD
+# ============================================================
+
+def _insert_rows(rows):
+	"""Bulk insert (snapshot_type, party, month_end, debit, credit) tuples"""
+	now = now_datetime()
+	user = frappe.session.user
+	for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+		frappe.db.bulk_insert(
+			SNAPSHOT_DOCTYPE,
+			fields=["name", "snapshot_type", "party", "month_end", "debit", "credit",
+				"creation", "modified", "owner", "modified_by"],
+			values=[
+				(frappe.generate_hash(length=12), *row, now, now, user, user)
+				for row in rows[start:start + INSERT_CHUNK_SIZE]
+			]
+		)
+
+
+def _build_type(snapshot_type, watermark, target):
+	"""
+	Snapshot rows for months in (watermark, target], cumulative on top of
+	the snapshot at watermark
+
+	Returns:
+		int: Rows inserted
+	"""
+	monthly = frappe.db.sql(f"""
+		SELECT t.party, LAST_DAY(t.posting_date) AS month_end,
+			COALESCE(SUM(t.debit), 0) AS debit, COALESCE(SUM(t.credit), 0) AS credit
+		FROM ({_movements_sql(snapshot_type)}) t
+		GROUP BY t.party, month_end
+		ORDER BY t.party, month_end
+	""", {"after": watermark or _NO_SNAPSHOT, "upto": target}, as_dict=True)
+
+	running = get_snapshot_totals(snapshot_type, watermark, list({row.party for row in monthly}))
+	rows = []
+	for row in monthly:
+		totals = running.setdefault(row.party, [0.0, 0.0])
+		totals[0] += flt(row.debit)
+		totals[1] += flt(row.credit)
+		rows.append((snapshot_type, row.party, row.month_end, flt(totals[0], 2), flt(totals[1], 2)))
+
+	_insert_rows(rows)
+	return len(rows)
+
+
+def build_balance_snapshots():
+	"""
+	Scheduled (daily): add snapshots for closed months after the watermark
+
+	A month is closed once it has ended; documents posted into it later
+	are applied by the backdated hooks.
+
+	Returns:
+		int: Rows inserted
+	"""
+	target = getdate(add_days(get_first_day(nowdate()), -1))
+	watermark = get_watermark()
+	if watermark and watermark >= target:
+		return 0
+
+	# Leftovers of an interrupted build
+	if watermark:
+		frappe.db.delete(SNAPSHOT_DOCTYPE, {"month_end": (">", watermark)})
+	else:
+		frappe.db.delete(SNAPSHOT_DOCTYPE)
+
+	written = sum(_build_type(snapshot_type, watermark, target) for snapshot_type in SNAPSHOT_TYPES)
+	frappe.db.set_global(WATERMARK_KEY, str(target))
+	frappe.db.commit()
+
+	frappe.logger().info(f"✅ [BALANCE-SNAPSHOT] {target} gacha {written} ta snapshot qo'shildi")
+	return written
+
+
+def rebuild_balance_snapshots():
+	"""Scheduled (weekly): rebuild all snapshots from source documents"""
+	frappe.db.set_global(WATERMARK_KEY, "")
+	return build_balance_snapshots()
+
+
+# ============================================================
+# BACKDATED DOCUMENTS
+# ============================================================
+
+def _shift_party(snapshot_type, party, month_end, debit, credit):
+	"""Move the party's snapshots from month_end on by (debit, credit)"""
+	filters = {"snapshot_type": snapshot_type, "party": party, "month_end": month_end}
+	if not frappe.db.exists(SNAPSHOT_DOCTYPE, filters):
+		# No movements in that month yet: start from the previous cumulative
+		previous = get_snapshot_totals(
+			snapshot_type, add_days(month_end, -1), [party]
+		).get(party, [0.0, 0.0])
+		_insert_rows([(snapshot_type, party, month_end, previous[0], previous[1])])
+
+	frappe.db.sql("""
+		UPDATE `tabBalance Snapshot`
+		SET debit = debit + %(debit)s, credit = credit + %(credit)s
+		WHERE snapshot_type = %(snapshot_type)s
+		  AND party = %(party)s
+		  AND month_end >= %(month_end)s
+	""", {
+		"debit": flt(debit),
+		"credit": flt(credit),
+		"snapshot_type": snapshot_type,
+		"party": party,
+		"month_end": month_end
+	})
+
+
+def apply_document(doc, sign):
+	"""
+	Apply a submitted (+1) / cancelled (-1) document to snapshots of
+	already closed months; open months are covered by the delta query
+	"""
+	watermark = get_watermark()
+	posting_date = doc.get("posting_date") or doc.get("transaction_date")
+	if not watermark or not posting_date:
+		return
+
+	month_end = getdate(get_last_day(posting_date))
+	if month_end > watermark:
+		return
+
+	for snapshot_type in SNAPSHOT_TYPES:
+		if not any(source["doctype"] == doc.doctype for source in _SOURCES[snapshot_type]):
+			continue
+
+		rows = frappe.db.sql(f"""
+			SELECT t.party, COALESCE(SUM(t.debit), 0), COALESCE(SUM(t.credit), 0)
+			FROM ({_movements_sql(snapshot_type, doctype=doc.doctype)}) t
+			GROUP BY t.party
+		""", {"docname": doc.name})
+
+		for party, debit, credit in rows:
+			if flt(debit) or flt(credit):
+				_shift_party(snapshot_type, party, month_end, sign * flt(debit), sign * flt(credit))
+
+
+def update_snapshots_on_submit(doc, method=None):
+	"""Hook: Payment Entry / Installment Application on_submit"""
+	apply_document(doc, 1)
+
+
+def update_snapshots_on_cancel(doc, method=None):
+	"""Hook: Payment Entry / Installment Application on_cancel"""
+	apply_document(doc, -1)
@@ -0,0 +1,299 @@
+"""
+Bot Cache
+Per-customer Redis cache of guest Telegram bot payloads
+
+Bot users tap the same menu buttons over and over, and every tap used to
+re-run the contract / schedule / payment queries. Payloads are cached per
+customer under a versioned key
+
+	bot_cache:<customer>:<version>:<endpoint>:<args digest>
+
+and every document that can change a customer's payload (Payment Entry,
+Installment Application, Sales Order submit/cancel, Customer save)
+replaces that customer's version token after commit. Old payloads become
+unreachable at once (exact invalidation) and simply expire.
+
+- Telegram ID → customer and contract → customer lookups are cached too
+- The date is part of the key, since payloads carry "days left" values
+- Only successful payloads are cached; Redis errors fall back to the database
+- Hit/miss counters per endpoint: get_cache_stats
+"""
+import functools
+import hashlib
+import inspect
+import json
+
+import frappe
+from frappe.utils import cint, nowdate
+
+KEY_PREFIX = "bot_cache"
+
+# Cached payload lifetime (invalidation is by version, TTL only frees memory)
+CACHE_TTL = 6 * 60 * 60
+
+# Version tokens must outlive every payload stored under them
+VERSION_TTL = 7 * 24 * 60 * 60
+
+# Telegram ID / contract → customer lookups
+LOOKUP_TTL = 24 * 60 * 60
+
+
+# ============================================================
+# KEYS & VERSIONS
+# ============================================================
+
+def _version_key(customer):
+	return f"{KEY_PREFIX}:ver:{customer}"
+
+
+def _telegram_key(telegram_id):
+	return f"{KEY_PREFIX}:tg:{telegram_id}"
+
+
+def _contract_key(contract_id):
+	return f"{KEY_PREFIX}:so:{contract_id}"
+
+
+def _stats_key(endpoint, outcome):
+	return f"{KEY_PREFIX}:stats:{endpoint}:{outcome}"
+
+
+def _payload_key(customer, version, endpoint, arguments):
+	digest = hashlib.md5(
+		json.dumps([nowdate(), arguments], sort_keys=True, default=str).encode()
+	).hexdigest()
+	return f"{KEY_PREFIX}:{customer}:{version}:{endpoint}:{digest}"
+
+
+def get_version(customer):
+	"""
+	Current version token of a customer's payloads
+
+	Tokens are random rather than counters, so a token lost to eviction can
+	never come back and re-expose payloads stored under it.
+	"""
+	cache = frappe.cache()
+	version = cache.get_value(_version_key(customer))
+	if not version:
+		version = frappe.generate_hash(length=10)
+		cache.set_value(_version_key(customer), version, expires_in_sec=VERSION_TTL)
+	return version
+
+
+def bump_versions(customers):
+	"""Replace the version token of each customer (drops all their cached payloads)"""
+	cache = frappe.cache()
+	for customer in {c for c in customers if c}:
+		cache.set_value(
+			_version_key(customer), frappe.generate_hash(length=10), expires_in_sec=VERSION_TTL
+		)
+
+
+def invalidate_customers(customers):
+	"""
+	Drop cached payloads of customers once the current transaction commits
+
+	Bumping before commit would let a concurrent bot request cache the old
+	data under the new version.
+	"""
+	customers = {c for c in customers if c}
+	if customers:
+		frappe.db.after_commit.add(functools.partial(bump_versions, customers))
+
+
+# ============================================================
+# LOOKUPS
+# ============================================================
+
+def get_customer_by_telegram(telegram_id):
+	"""Customer linked to a Telegram ID (None if not linked)"""
+	if not telegram_id:
+		return None
+
+	cache = frappe.cache()
+	customer = cache.get_value(_telegram_key(telegram_id))
+	if customer:
+		return customer
+
+	customer = frappe.db.get_value("Customer", {"custom_telegram_id": str(telegram_id)}, "name")
+	if customer:
+		cache.set_value(_telegram_key(telegram_id), customer, expires_in_sec=LOOKUP_TTL)
+	return customer
+
+
+def get_customer_by_contract(contract_id):
+	"""Customer of a Sales Order contract (None if unknown)"""
+	if not contract_id:
+		return None
+
+	cache = frappe.cache()
+	customer = cache.get_value(_contract_key(contract_id))
+	if customer:
+		return customer
+
+	customer = frappe.db.get_value("Sales Order", contract_id, "customer")
+	if customer:
+		cache.set_value(_contract_key(contract_id), customer, expires_in_sec=LOOKUP_TTL)
+	return customer
+
+
+_RESOLVERS = {
+	"customer": lambda value: value,
+	"telegram": get_customer_by_telegram,
+	"contract": get_customer_by_contract,
+}
+
+
+# ============================================================
+# CACHE
+# ============================================================
+
+def _count(endpoint, outcome):
+	cache = frappe.cache()
+	cache.incr(cache.make_key(_stats_key(endpoint, outcome)))
+	cache.sadd(f"{KEY_PREFIX}:endpoints", endpoint)
+
+
+def get_or_build(customer, endpoint, arguments, build):
+	"""
+	Cached payload of an endpoint for a customer, built on miss
+
+	Args:
+		customer: Customer the payload belongs to
+		endpoint: Endpoint name (key + counters)
+		arguments: Call arguments (part of the key)
+		build: Callable returning the payload
+
+	Returns:
+		The payload
+	"""
+	try:
+		key = _payload_key(customer, get_version(customer), endpoint, arguments)
+		payload = frappe.cache().get_value(key)
+		_count(endpoint, "hit" if payload is not None else "miss")
+	except Exception:
+		# Redis ishlamasa - to'g'ridan-to'g'ri bazadan
+		return build()
+
+	if payload is not None:
+		return payload
+
+	payload = build()
+
+	# Xatoliklar keshlanmaydi
+	if isinstance(payload, dict) and payload.get("success"):
+		try:
+			frappe.cache().set_value(key, payload, expires_in_sec=CACHE_TTL)
+		except Exception:
+			pass
+
+	return payload
+
+
+def cached(endpoint, key_by="customer"):
+	"""
+	Decorator: serve a bot endpoint from the per-customer cache
+
+	The first argument of the endpoint identifies the customer.
+
+	Args:
+		endpoint: Endpoint name
+		key_by: 'customer' (customer ID), 'telegram' (Telegram ID) or 'contract' (Sales Order)
+	"""
+	resolve = _RESOLVERS[key_by]
+
+	def decorator(fn):
+		signature = inspect.signature(fn)
+
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			# frappe.call passes every form argument to **kwargs functions,
+			# keep only the endpoint's own parameters as before
+			kwargs = {k: v for k, v in kwargs.items() if k in signature.parameters}
+			arguments = signature.bind(*args, **kwargs).arguments
+			customer = resolve(next(iter(arguments.values()), None))
+
+			if not customer:
+				return fn(*args, **kwargs)
+
+			return get_or_build(customer, endpoint, arguments, lambda: fn(*args, **kwargs))
+
+		return wrapper
+
+	return decorator
+
+
+# ============================================================
+# HOOKS
+# ============================================================
+
+def invalidate_on_document_change(doc, method=None):
+	"""
+	Payment Entry / Installment Application / Sales Order submit, cancel, update:
+	drop the customer's cached bot payloads
+	"""
+	customers = set()
+
+	if doc.doctype == "Payment Entry":
+		if doc.get("party_type") == "Customer":
+			customers.add(doc.get("party"))
+		if doc.get("custom_contract_reference"):
+			customers.add(get_customer_by_contract(doc.custom_contract_reference))
+	else:
+		customers.add(doc.get("customer"))
+
+	invalidate_customers(customers)
+
+
+def invalidate_on_customer_change(doc, method=None):
+	"""Customer save / delete: drop payloads and the Telegram ID lookups"""
+	invalidate_customers([doc.name])
+
+	telegram_ids = {doc.get("custom_telegram_id")}
+	previous = doc.get_doc_before_save() if method != "on_trash" else None
+	if previous:
+		telegram_ids.add(previous.get("custom_telegram_id"))
+
+	cache = frappe.cache()
+	for telegram_id in telegram_ids:
+		if telegram_id:
+			cache.delete_value(_telegram_key(telegram_id))
+
+
+# ============================================================
+# STATS
+# ============================================================
+
+@frappe.whitelist()
+def get_cache_stats(reset=False):
+	"""
+	Hit/miss counters per endpoint
+
+	Args:
+		reset: Zero the counters after reading
+
+	Returns:
+		dict: {endpoint: {"hits", "misses", "hit_rate"}}
+	"""
+	frappe.only_for("System Manager")
+
+	cache = frappe.cache()
+	endpoints = sorted(
+		e.decode() if isinstance(e, bytes) else e
+		for e in cache.smembers(f"{KEY_PREFIX}:endpoints")
+	)
+
+	stats = {}
+	for endpoint in endpoints:
+		keys = [cache.make_key(_stats_key(endpoint, outcome)) for outcome in ("hit", "miss")]
+		hits, misses = (cint(value) for value in cache.mget(keys))
+		total = hits + misses
+		stats[endpoint] = {
+			"hits": hits,
+			"misses": misses,
+			"hit_rate": round(hits / total, 3) if total else 0
+		}
+		if cint(reset):
+			cache.delete(*keys)
+
+	return stats
@@ -0,0 +1,102 @@
+"""
+Coalesced Jobs
+At most one queued-or-running background job per key, without lost wakeups
+
+frappe.enqueue(..., deduplicate=True) also skips while the job is already
+running, and that run may have read the database before the triggering
+commit, so the change is never processed. Here a caller sets a pending
+flag, and the job is enqueued only by whoever takes the owner flag:
+
+	request(key, method, **kwargs)     # after commit
+	run(key, work)                     # inside the job
+
+The job clears the pending flag before each round of work and, before
+releasing ownership, checks it once more after releasing; whichever side
+sets the owner flag next is responsible for the next round.
+
+Both flags are read straight from Redis: get_value() memoizes in
+frappe.local.cache (None included), which would hide a request made
+between the job's two checks.
+"""
+import frappe
+
+KEY_PREFIX = "coalesced_job"
+
+# Owner flag lifetime: a crashed job blocks its key at most this long
+OWNER_TTL = 10 * 60
+
+# Pending flag lifetime: outlives any wait in the queue
+PENDING_TTL = 24 * 60 * 60
+
+
+def _pending_key(key):
+	return f"{KEY_PREFIX}:pending:{key}"
+
+
+def _owner_key(key):
+	return f"{KEY_PREFIX}:owner:{key}"
+
+
+def _is_pending(key):
+	cache = frappe.cache()
+	return bool(cache.get(cache.make_key(_pending_key(key))))
+
+
+def _set_pending(key):
+	cache = frappe.cache()
+	cache.set(cache.make_key(_pending_key(key)), 1, ex=PENDING_TTL)
+
+
+def _clear_pending(key):
+	cache = frappe.cache()
+	cache.delete(cache.make_key(_pending_key(key)))
+
+
+def _claim(key):
+	cache = frappe.cache()
+	return bool(cache.set(cache.make_key(_owner_key(key)), 1, nx=True, ex=OWNER_TTL))
+
+
+def _release(key):
+	cache = frappe.cache()
+	cache.delete(cache.make_key(_owner_key(key)))
+
+
+def request(key, method, queue="short", **kwargs):
+	"""
+	Ask for one more run of a coalesced job (call after commit)
+
+	Args:
+		key: Coalescing key (also the RQ job_id)
+		method: Job method path, must call run(key, ...)
+		queue: RQ queue
+		kwargs: Job arguments
+	"""
+	_set_pending(key)
+	if _claim(key):
+		frappe.enqueue(method, queue=queue, job_id=key, **kwargs)
+
+
+def run(key, work):
+	"""
+	Run work() until no request is pending
+
+	Args:
+		key: Coalescing key passed to request()
+		work: Callable doing one round (reads the database itself)
+	"""
+	try:
+		while True:
+			_clear_pending(key)
+			work()
+			if _is_pending(key):
+				continue
+
+			# Egalik bo'shatiladi, keyin yana tekshiriladi: shu orada kelgan
+			# so'rov yo yangi job qo'yadi, yo bu job davom etadi
+			_release(key)
+			if not _is_pending(key) or not _claim(key):
+				return
+	except Exception:
+		_release(key)
+		raise
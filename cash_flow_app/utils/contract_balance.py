@@ -0,0 +1,357 @@
+"""
+Contract Balance
+Materialized per-contract balance, keyed by Sales Order name
+
+One `Contract Balance` row per submitted contract keeps the payment totals
+and the derived next-installment pointer, so readers (bot, reminders,
+linkage, Eslatmalar report) do a primary-key lookup instead of re-aggregating the
+Payment Entry history and walking the Payment Schedule on every request.
+
+- Payment Entry submit: totals moved by delta (one indexed row update),
+  derived fields recomputed from the contract's own schedule
+- Payment Entry cancel / schedule change / Installment Application submit:
+  full refresh of that one contract
+- Sales Order cancel: row removed
+- Daily: overdue_days moved forward with one set-based UPDATE
+- Weekly: full set-based rebuild repairs any drift
+"""
+import frappe
+from frappe.utils import cint, date_diff, flt, getdate, now_datetime, nowdate
+
+from cash_flow_app.utils import fifo_allocation
+
+BALANCE_DOCTYPE = "Contract Balance"
+
+# Contracts per grouped query / batched write in rebuild
+REBUILD_CHUNK_SIZE = 500
+
+# Installments with less outstanding than this are not the "next" payment
+# (tiyinlar qoldig'i navbatdagi to'lov hisoblanmaydi)
+MIN_DUE_OUTSTANDING = 1
+
+_FIELDS = (
+	"installment_application", "customer", "status", "total_scheduled", "received_total",
+	"refunded_total", "net_paid", "outstanding", "next_due_idx", "next_due_date",
+	"next_due_amount", "next_due_installment_amount", "last_payment_date", "overdue_days",
+	"refreshed_on"
+)
+
+
+# ============================================================
+# COMPUTATION
+# ============================================================
+
+def _derived_values(schedule_rows, net_paid, today=None):
+	"""
+	Fields that depend on the schedule and the net paid amount
+
+	Args:
+		schedule_rows: Payment Schedule rows (idx, due_date, payment_amount) in idx order
+		net_paid: Received - Refunded
+
+	Returns:
+		dict: total_scheduled, outstanding, next_due_* (amount = unpaid part,
+			installment_amount = full scheduled amount), overdue_days, status
+	"""
+	allocation = fifo_allocation.ContractAllocation(None, schedule_rows or [], net_paid)
+	pos = allocation.first_unpaid(min_outstanding=MIN_DUE_OUTSTANDING)
+
+	values = {
+		"total_scheduled": flt(allocation.total_scheduled, 2),
+		"outstanding": flt(allocation.total_outstanding, 2),
+		"next_due_idx": None,
+		"next_due_date": None,
+		"next_due_amount": 0,
+		"next_due_installment_amount": 0,
+		"overdue_days": 0,
+		"status": "Paid" if pos is None else "Open"
+	}
+	if pos is not None:
+		due_date = allocation.due_date[pos]
+		values.update({
+			"next_due_idx": allocation.idx[pos],
+			"next_due_date": due_date,
+			"next_due_amount": flt(allocation.outstanding(pos), 2),
+			"next_due_installment_amount": flt(allocation.amount[pos], 2),
+			"overdue_days": max(date_diff(today or nowdate(), due_date), 0) if due_date else 0
+		})
+	return values
+
+
+def _get_payment_totals(contract_ids):
+	"""
+	Receive / Pay totals and last payment date per contract
+
+	Returns:
+		dict: {contract: {"received_total", "refunded_total", "last_payment_date"}}
+	"""
+	totals = {}
+	for chunk in fifo_allocation._chunks(contract_ids):
+		for contract_id, received, refunded, last_payment_date in frappe.db.sql("""
+			SELECT
+				custom_contract_reference,
+				COALESCE(SUM(CASE WHEN payment_type = 'Receive' THEN paid_amount ELSE 0 END), 0),
+				COALESCE(SUM(CASE WHEN payment_type = 'Pay' THEN paid_amount ELSE 0 END), 0),
+				MAX(posting_date)
+			FROM `tabPayment Entry`
+			WHERE custom_contract_reference IN %(contracts)s
+			  AND docstatus = 1
+			  AND payment_type IN ('Receive', 'Pay')
+			GROUP BY custom_contract_reference
+		""", {"contracts": tuple(chunk)}):
+			totals[contract_id] = {
+				"received_total": flt(received),
+				"refunded_total": flt(refunded),
+				"last_payment_date": last_payment_date
+			}
+	return totals
+
+
+def _get_contracts(contract_ids=None):
+	"""
+	Submitted Sales Orders with their customer and Installment Application
+
+	Args:
+		contract_ids: Optional list of Sales Order names (None = all submitted)
+
+	Returns:
+		list: [{"name", "customer", "installment_application"}]
+	"""
+	condition = ""
+	values = {}
+	if contract_ids is not None:
+		if not contract_ids:
+			return []
+		condition = "AND so.name IN %(contracts)s"
+		values["contracts"] = tuple(contract_ids)
+
+	return frappe.db.sql(f"""
+		SELECT
+			so.name,
+			so.customer,
+			(SELECT ia.name FROM `tabInstallment Application` ia
+			 WHERE ia.sales_order = so.name AND ia.docstatus = 1
+			 LIMIT 1) AS installment_application
+		FROM `tabSales Order` so
+		WHERE so.docstatus = 1
+		{condition}
+		ORDER BY so.name
+	""", values, as_dict=True)
+
+
+def _write_balances(rows, stamp):
+	"""Replace the balance rows of a chunk of contracts with one DELETE + one bulk INSERT"""
+	if not rows:
+		return
+
+	user = frappe.session.user
+	frappe.db.delete(BALANCE_DOCTYPE, {"name": ("in", [row["sales_order"] for row in rows])})
+	frappe.db.bulk_insert(
+		BALANCE_DOCTYPE,
+		fields=["name", "sales_order", *_FIELDS, "creation", "modified", "owner", "modified_by"],
+		values=[
+			(row["sales_order"], row["sales_order"], *[row.get(field) for field in _FIELDS],
+				stamp, stamp, user, user)
+			for row in rows
+		]
+	)
+
+
+def _build_rows(contracts, stamp):
+	"""Compute balance rows for a list of contracts with grouped queries"""
+	contract_ids = [c.name for c in contracts]
+	schedules = fifo_allocation.get_schedules(contract_ids, parenttype="Sales Order")
+	payment_totals = _get_payment_totals(contract_ids)
+	today = getdate(nowdate())
+
+	rows = []
+	for contract in contracts:
+		totals = payment_totals.get(contract.name, {})
+		received = flt(totals.get("received_total"))
+		refunded = flt(totals.get("refunded_total"))
+		row = {
+			"sales_order": contract.name,
+			"installment_application": contract.installment_application,
+			"customer": contract.customer,
+			"received_total": received,
+			"refunded_total": refunded,
+			"net_paid": received - refunded,
+			"last_payment_date": totals.get("last_payment_date"),
+			"refreshed_on": stamp
+		}
+		row.update(_derived_values(schedules.get(contract.name), received - refunded, today))
+		rows.append(row)
+	return rows
+
+
+# ============================================================
+# REFRESH / DELTA
+# ============================================================
+
+def refresh_contract_balances(contract_ids=None, chunk_size=REBUILD_CHUNK_SIZE):
+	"""
+	Recompute balance rows from source documents (set-based, chunked)
+
+	Args:
+		contract_ids: Optional list of Sales Order names (None = all submitted contracts)
+		chunk_size: Contracts per chunk
+
+	Returns:
+		int: Number of rows written
+	"""
+	contracts = _get_contracts(contract_ids)
+	chunk_size = cint(chunk_size) or REBUILD_CHUNK_SIZE
+	written = 0
+
+	for start in range(0, len(contracts), chunk_size):
+		chunk = contracts[start:start + chunk_size]
+		rows = _build_rows(chunk, now_datetime())
+		_write_balances(rows, now_datetime())
+		written += len(rows)
+
+	return written
+
+
+def refresh_contract_balance(sales_order):
+	"""Recompute the balance row of one contract (removed if the contract is not submitted)"""
+	if not sales_order:
+		return
+	if not refresh_contract_balances([sales_order]):
+		frappe.db.delete(BALANCE_DOCTYPE, {"name": sales_order})
+
+
+def apply_payment_delta(sales_order, received=0, refunded=0, posting_date=None):
+	"""
+	Move the contract's payment totals by delta and recompute the pointer
+
+	The row is seeded with a full refresh the first time a contract is
+	touched; the seed already includes the current document.
+
+	Args:
+		sales_order: Contract (Sales Order) name
+		received: Change of Receive payments total
+		refunded: Change of Pay payments total
+		posting_date: Posting date of the payment (moves last_payment_date forward)
+	"""
+	if not sales_order:
+		return
+
+	if not frappe.db.exists(BALANCE_DOCTYPE, sales_order):
+		refresh_contract_balance(sales_order)
+		return
+
+	# MariaDB evaluates single-table SET assignments left to right
+	frappe.db.sql("""
+		UPDATE `tabContract Balance`
+		SET
+			received_total = received_total + %(received)s,
+			refunded_total = refunded_total + %(refunded)s,
+			net_paid = received_total - refunded_total,
+			last_payment_date = GREATEST(IFNULL(last_payment_date, %(posting_date)s), %(posting_date)s)
+		WHERE name = %(sales_order)s
+	""", {
+		"received": flt(received),
+		"refunded": flt(refunded),
+		"posting_date": getdate(posting_date or nowdate()),
+		"sales_order": sales_order
+	})
+
+	net_paid = flt(frappe.db.get_value(BALANCE_DOCTYPE, sales_order, "net_paid"))
+	schedule = fifo_allocation.get_schedules([sales_order], parenttype="Sales Order").get(sales_order)
+	values = _derived_values(schedule, net_paid)
+	values["refreshed_on"] = now_datetime()
+	frappe.db.set_value(BALANCE_DOCTYPE, sales_order, values)
+
+
+def get_contract_balance(sales_order, fields=None):
+	"""
+	Materialized balance of one contract (primary-key lookup)
+
+	Returns:
+		frappe._dict | None
+	"""
+	return frappe.db.get_value(
+		BALANCE_DOCTYPE, sales_order, fields or ["name", *_FIELDS], as_dict=True
+	)
+
+
+# ============================================================
+# HOOKS
+# ============================================================
+
+def update_contract_balance_on_payment_submit(doc, method=None):
+	"""Hook: Payment Entry on_submit - delta update of the referenced contract"""
+	if not doc.custom_contract_reference or doc.payment_type not in ("Receive", "Pay"):
+		return
+
+	amount = flt(doc.paid_amount)
+	if doc.payment_type == "Receive":
+		apply_payment_delta(doc.custom_contract_reference, received=amount, posting_date=doc.posting_date)
+	else:
+		apply_payment_delta(doc.custom_contract_reference, refunded=amount, posting_date=doc.posting_date)
+
+
+def update_contract_balance_on_payment_cancel(doc, method=None):
+	"""Hook: Payment Entry on_cancel - last_payment_date can move back, so refresh fully"""
+	if doc.custom_contract_reference and doc.payment_type in ("Receive", "Pay"):
+		refresh_contract_balance(doc.custom_contract_reference)
+
+
+def update_contract_balance_on_installment_submit(doc, method=None):
+	"""Hook: Installment Application on_submit - row for the newly created Sales Order"""
+	if doc.get("sales_order"):
+		refresh_contract_balance(doc.sales_order)
+
+
+def update_contract_balance_on_installment_cancel(doc, method=None):
+	"""Hook: Installment Application on_cancel - row loses its application (drops out of Eslatmalar)"""
+	if doc.get("sales_order"):
+		refresh_contract_balance(doc.sales_order)
+
+
+def update_contract_balance_on_sales_order_change(doc, method=None):
+	"""Hook: Sales Order on_update_after_submit / on_cancel"""
+	refresh_contract_balance(doc.name)
+
+
+# ============================================================
+# SCHEDULED
+# ============================================================
+
+def refresh_overdue_days():
+	"""
+	Scheduled (daily): move overdue_days forward
+
+	The next-due pointer only changes with payments or schedule edits,
+	so the date roll-over is a single set-based UPDATE.
+	"""
+	frappe.db.sql("""
+		UPDATE `tabContract Balance`
+		SET overdue_days = GREATEST(DATEDIFF(%(today)s, next_due_date), 0)
+		WHERE status = 'Open'
+		  AND next_due_date IS NOT NULL
+	""", {"today": getdate(nowdate())})
+	frappe.db.commit()
+
+
+def reconcile_contract_balances():
+	"""
+	Scheduled (weekly): rebuild all balance rows from source documents and
+	remove rows of contracts that are no longer submitted
+	"""
+	written = 0
+	for chunk in fifo_allocation._chunks(
+		[c.name for c in _get_contracts()], REBUILD_CHUNK_SIZE
+	):
+		written += refresh_contract_balances(chunk)
+		frappe.db.commit()
+
+	frappe.db.sql("""
+		DELETE cb FROM `tabContract Balance` cb
+		LEFT JOIN `tabSales Order` so ON so.name = cb.sales_order AND so.docstatus = 1
+		WHERE so.name IS NULL
+	""")
+	frappe.db.commit()
+
+	frappe.logger().info(f"✅ [CONTRACT-BALANCE] {written} ta shartnoma qayta hisoblandi")
+	return written
@@ -0,0 +1,103 @@
+"""
+Cumulative Balance Engine
+Period-end balances from pre-aggregated (party, bucket) sums
+
+Balance-sheet style reports need "balance as of period end" for every
+party and period. Instead of re-scanning raw transactions per period,
+SQL groups each party's transactions into date buckets and every party
+keeps sorted bucket dates with prefix sums, so
+
+	as_of(d)        = prefix[bisect_right(dates, d) - 1]
+	between(a, b)   = as_of(b) - as_of(a - 1)
+
+Buckets are month-ends, except for months that contain a period boundary
+which is not a month-end (e.g. a report ending mid-month, Daily
+periodicity); those months are bucketed by exact date so every boundary
+stays exact.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+from itertools import accumulate
+
+from frappe.utils import add_days, flt, get_last_day, getdate
+
+
+class CumulativeSeries:
+	"""Sorted bucket dates with prefix sums of their amounts"""
+
+	__slots__ = ("dates", "prefix")
+
+	def __init__(self, buckets=()):
+		totals = defaultdict(float)
+		for bucket_date, amount in buckets:
+			if bucket_date:
+				totals[getdate(bucket_date)] += flt(amount)
+		self.dates = sorted(totals)
+		self.prefix = list(accumulate(totals[d] for d in self.dates))
+
+	def as_of(self, date):
+		"""Sum of all amounts dated on or before date"""
+		pos = bisect_right(self.dates, date)
+		return self.prefix[pos - 1] if pos else 0.0
+
+	def between(self, from_date, to_date):
+		"""Sum of amounts dated within [from_date, to_date]"""
+		return self.as_of(to_date) - self.as_of(add_days(from_date, -1))
+
+
+def get_cut_dates(periods):
+	"""Dates balances are asked for: every period end and the day before every period start"""
+	cut_dates = set()
+	for period in periods:
+		cut_dates.add(getdate(period["to_date"]))
+		cut_dates.add(getdate(add_days(period["from_date"], -1)))
+	return cut_dates
+
+
+def get_split_months(cut_dates):
+	"""
+	Months that must be bucketed by exact date (contain a non month-end cut)
+
+	Returns:
+		tuple: ('YYYY-MM', ...) - never empty, safe for IN %(split_months)s
+	"""
+	months = {d.strftime("%Y-%m") for d in cut_dates if d != getdate(get_last_day(d))}
+	return tuple(sorted(months)) or ("",)
+
+
+def bucket_sql(column):
+	"""
+	SQL expression mapping a date column to its bucket date
+	(expects the query parameter %(split_months)s from get_split_months)
+	"""
+	return (
+		f"IF(DATE_FORMAT({column}, '%%Y-%%m') IN %(split_months)s, "
+		f"DATE({column}), LAST_DAY({column}))"
+	)
+
+
+def group_series(rows, *keys):
+	"""
+	Build nested {key1: {key2: CumulativeSeries}} from rows with
+	the given key fields plus bucket and amount
+
+	Args:
+		rows: dict rows with keys..., "bucket", "amount"
+		keys: one or more grouping field names
+
+	Returns:
+		dict: nested by keys, leaves are CumulativeSeries
+	"""
+	buckets = {}
+	for row in rows:
+		node = buckets
+		for key in keys[:-1]:
+			node = node.setdefault(row[key], {})
+		node.setdefault(row[keys[-1]], []).append((row["bucket"], row["amount"]))
+
+	def build(node, depth):
+		if depth == len(keys):
+			return CumulativeSeries(node)
+		return {key: build(child, depth + 1) for key, child in node.items()}
+
+	return build(buckets, 0)
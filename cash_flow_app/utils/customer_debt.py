@@ -1,134 +1,446 @@
 """
 Customer Debt Tracking Utilities
 Automatically update customer total debt (custom_umumiy_qarz)
+
+Running balances are kept in the Customer Debt Ledger doctype (one row per
+customer) and moved by delta in the submit/cancel hooks, so posting a payment
+costs one indexed row update instead of re-aggregating the payment history.
+A daily reconciliation job recomputes the totals and repairs any drift.
 """
 import frappe
-from frappe.utils import flt
+from frappe.utils import cint, flt, get_datetime, now_datetime
 
+LEDGER_DOCTYPE = "Customer Debt Ledger"
 
-def update_customer_debt(customer_name):
+# Customer onload schedules a background recalculation after this age
+DEBT_STALE_AFTER_HOURS = 36
+
+# Customers per grouped query / batched write in bulk recalculation
+BULK_CHUNK_SIZE = 500
+
+
+def _get_debt_totals(customers=None):
 	"""
-	Update custom_umumiy_qarz field - total debt from all contracts
-	Formula: (Installment Applications) + (Pay Payments) - (Receive Payments)
+	Aggregate billed / refunded / received totals grouped by customer
 
 	Args:
-		customer_name: Customer name to update debt for
+		customers: Optional list of customer names (None = all customers)
+
+	Returns:
+		dict: {customer: {"billed_total", "refunded_total", "received_total"}}
 	"""
-	if not customer_name:
-		return
+	ia_condition = ""
+	pe_condition = ""
+	values = {}
+	if customers is not None:
+		if not customers:
+			return {}
+		ia_condition = "AND customer IN %(customers)s"
+		pe_condition = "AND party IN %(customers)s"
+		values["customers"] = tuple(customers)
 
-	# 1. Get total from all submitted Installment Applications
-	installment_total = frappe.db.sql("""
-		SELECT IFNULL(SUM(custom_grand_total_with_interest), 0) as total
+	totals = {}
+
+	def _row(customer):
+		return totals.setdefault(customer, {
+			"billed_total": 0.0,
+			"refunded_total": 0.0,
+			"received_total": 0.0
+		})
+
+	# 1. Submitted Installment Applications
+	for customer, total in frappe.db.sql(f"""
+		SELECT customer, IFNULL(SUM(custom_grand_total_with_interest), 0)
 		FROM `tabInstallment Application`
-		WHERE customer = %s
-		AND docstatus = 1
-	""", (customer_name,))[0][0] or 0
+		WHERE docstatus = 1
+		AND customer IS NOT NULL
+		{ia_condition}
+		GROUP BY customer
+	""", values):
+		_row(customer)["billed_total"] = flt(total)
 
-	# 2. Get total from Payment Entries where we paid TO customer (Pay type)
-	# This INCREASES customer debt (customer owes us more)
-	payment_pay_total = frappe.db.sql("""
-		SELECT IFNULL(SUM(paid_amount), 0) as total
+	# 2-3. Payment Entries: Pay (biz mijozga to'ladik) / Receive (mijoz to'ladi)
+	for customer, pay_total, receive_total in frappe.db.sql(f"""
+		SELECT
+			party,
+			IFNULL(SUM(CASE WHEN payment_type = 'Pay' THEN paid_amount ELSE 0 END), 0),
+			IFNULL(SUM(CASE WHEN payment_type = 'Receive' THEN paid_amount ELSE 0 END), 0)
 		FROM `tabPayment Entry`
 		WHERE party_type = 'Customer'
-		AND party = %s
-		AND payment_type = 'Pay'
+		AND payment_type IN ('Pay', 'Receive')
 		AND docstatus = 1
-	""", (customer_name,))[0][0] or 0
+		{pe_condition}
+		GROUP BY party
+	""", values):
+		row = _row(customer)
+		row["refunded_total"] = flt(pay_total)
+		row["received_total"] = flt(receive_total)
 
-	# 3. Get total from Payment Entries received FROM customer (Receive type)
-	# This DECREASES customer debt (customer paid us)
-	payment_receive_total = frappe.db.sql("""
-		SELECT IFNULL(SUM(paid_amount), 0) as total
-		FROM `tabPayment Entry`
-		WHERE party_type = 'Customer'
-		AND party = %s
-		AND payment_type = 'Receive'
-		AND docstatus = 1
-	""", (customer_name,))[0][0] or 0
+	return totals
+
+
+def _calculate_debt(totals):
+	"""Debt = What they owe from contracts + What we paid them - What they paid us"""
+	return flt(totals.get("billed_total")) + flt(totals.get("refunded_total")) - flt(totals.get("received_total"))
+
+
+def _write_ledger(customer_name, totals):
+	"""Insert or overwrite the ledger row of a customer with absolute totals"""
+	debt = _calculate_debt(totals)
+	values = {
+		"billed_total": flt(totals.get("billed_total")),
+		"refunded_total": flt(totals.get("refunded_total")),
+		"received_total": flt(totals.get("received_total")),
+		"debt": debt,
+		"last_reconciled_on": now_datetime()
+	}
+
+	if frappe.db.exists(LEDGER_DOCTYPE, customer_name):
+		frappe.db.set_value(LEDGER_DOCTYPE, customer_name, values, update_modified=False)
+	else:
+		ledger = frappe.new_doc(LEDGER_DOCTYPE)
+		ledger.customer = customer_name
+		ledger.update(values)
+		ledger.insert(ignore_permissions=True)
+
+	frappe.db.set_value("Customer", customer_name, "custom_umumiy_qarz", debt, update_modified=False)
+	return debt
+
+
+def update_customer_debt(customer_name):
+	"""
+	Update custom_umumiy_qarz field - total debt from all contracts
+	Formula: (Installment Applications) + (Pay Payments) - (Receive Payments)
+
+	Full recalculation: rebuilds the Customer Debt Ledger row from scratch.
+	Hooks use apply_customer_debt_delta instead.
 
-	# 4. Calculate debt
-	# Debt = What they owe from contracts + What we paid them - What they paid us
-	total_debt = flt(installment_total) + flt(payment_pay_total) - flt(payment_receive_total)
+	Args:
+		customer_name: Customer name to update debt for
+	"""
+	if not customer_name:
+		return
 
-	# 5. Update the field
-	frappe.db.set_value("Customer", customer_name, "custom_umumiy_qarz", total_debt, update_modified=False)
+	totals = _get_debt_totals([customer_name]).get(customer_name, {})
+	total_debt = _write_ledger(customer_name, totals)
 	frappe.db.commit()
 
 	frappe.logger().info(
 		f"Customer {customer_name} debt updated: "
-		f"IA={installment_total}, Pay={payment_pay_total}, Receive={payment_receive_total}, Debt={total_debt}"
+		f"IA={flt(totals.get('billed_total'))}, Pay={flt(totals.get('refunded_total'))}, "
+		f"Receive={flt(totals.get('received_total'))}, Debt={total_debt}"
 	)
 
 	return total_debt
 
 
+def apply_customer_debt_delta(customer_name, billed=0, refunded=0, received=0):
+	"""
+	Move the customer's running balance by delta (one indexed row update)
+
+	The ledger row is seeded with a full recalculation the first time a
+	customer is touched; the seed already includes the current document,
+	so the delta is not applied on top of it.
+
+	Args:
+		customer_name: Customer name
+		billed: Change of Installment Application total
+		refunded: Change of Pay payments total
+		received: Change of Receive payments total
+
+	Returns:
+		float: New debt of the customer
+	"""
+	if not customer_name:
+		return
+
+	if not frappe.db.exists(LEDGER_DOCTYPE, customer_name):
+		totals = _get_debt_totals([customer_name]).get(customer_name, {})
+		return _write_ledger(customer_name, totals)
+
+	# MariaDB evaluates single-table SET assignments left to right,
+	# so debt is computed from the already updated totals
+	frappe.db.sql("""
+		UPDATE `tabCustomer Debt Ledger`
+		SET
+			billed_total = billed_total + %(billed)s,
+			refunded_total = refunded_total + %(refunded)s,
+			received_total = received_total + %(received)s,
+			debt = billed_total + refunded_total - received_total,
+			modified = %(now)s
+		WHERE name = %(customer)s
+	""", {
+		"billed": flt(billed),
+		"refunded": flt(refunded),
+		"received": flt(received),
+		"now": now_datetime(),
+		"customer": customer_name
+	})
+
+	debt = flt(frappe.db.get_value(LEDGER_DOCTYPE, customer_name, "debt"))
+	frappe.db.set_value("Customer", customer_name, "custom_umumiy_qarz", debt, update_modified=False)
+	return debt
+
+
+def _payment_delta(doc, sign):
+	"""Build delta kwargs for a customer Payment Entry (None if not relevant)"""
+	if doc.party_type != "Customer" or not doc.party or doc.payment_type not in ["Receive", "Pay"]:
+		return None
+
+	amount = sign * flt(doc.paid_amount)
+	if doc.payment_type == "Pay":
+		return {"refunded": amount}
+	return {"received": amount}
+
+
 def update_customer_debt_on_installment_submit(doc, method):
 	"""Hook: Update customer debt when Installment Application is submitted"""
 	if doc.customer:
-		frappe.enqueue(
-			"cash_flow_app.utils.customer_debt.update_customer_debt",
-			customer_name=doc.customer,
-			queue="short"
-		)
+		apply_customer_debt_delta(doc.customer, billed=flt(doc.custom_grand_total_with_interest))
 
 
 def update_customer_debt_on_installment_cancel(doc, method):
 	"""Hook: Update customer debt when Installment Application is cancelled"""
 	if doc.customer:
-		frappe.enqueue(
-			"cash_flow_app.utils.customer_debt.update_customer_debt",
-			customer_name=doc.customer,
-			queue="short"
-		)
+		apply_customer_debt_delta(doc.customer, billed=-flt(doc.custom_grand_total_with_interest))
 
 
 def update_customer_debt_on_payment_submit(doc, method):
 	"""Hook: Update customer debt when Payment Entry is submitted"""
 	# Update for both Pay and Receive types
-	if doc.party_type == "Customer" and doc.party and doc.payment_type in ["Receive", "Pay"]:
-		frappe.enqueue(
-			"cash_flow_app.utils.customer_debt.update_customer_debt",
-			customer_name=doc.party,
-			queue="short"
-		)
+	delta = _payment_delta(doc, 1)
+	if delta:
+		apply_customer_debt_delta(doc.party, **delta)
 
 
 def update_customer_debt_on_payment_cancel(doc, method):
 	"""Hook: Update customer debt when Payment Entry is cancelled"""
 	# Update for both Pay and Receive types
-	if doc.party_type == "Customer" and doc.party and doc.payment_type in ["Receive", "Pay"]:
-		frappe.enqueue(
-			"cash_flow_app.utils.customer_debt.update_customer_debt",
-			customer_name=doc.party,
-			queue="short"
-		)
+	delta = _payment_delta(doc, -1)
+	if delta:
+		apply_customer_debt_delta(doc.party, **delta)
 
 
 def update_customer_debt_on_load(doc, method):
-	"""Hook: Update customer debt when Customer is loaded/opened"""
+	"""
+	Hook: Show customer debt from the ledger when Customer is loaded/opened
+
+	Read-only: serves the materialized ledger value with its freshness stamp
+	and only schedules a background recalculation when the row is missing or
+	older than DEBT_STALE_AFTER_HOURS. Nothing is written or committed here.
+	"""
 	try:
-		update_customer_debt(doc.name)
+		ledger = frappe.db.get_value(
+			LEDGER_DOCTYPE, doc.name, ["debt", "last_reconciled_on"], as_dict=True
+		)
+		if ledger:
+			doc.custom_umumiy_qarz = flt(ledger.debt)
+			doc.set_onload("debt_refreshed_on", ledger.last_reconciled_on)
+
+		if _is_debt_stale(ledger):
+			frappe.enqueue(
+				"cash_flow_app.utils.customer_debt.update_customer_debt",
+				customer_name=doc.name,
+				queue="short",
+				job_id=f"customer_debt::{doc.name}",
+				deduplicate=True
+			)
 	except Exception as e:
 		frappe.log_error(f"Error updating debt on load for {doc.name}: {str(e)}", "Customer Debt Update")
 
 
+def _is_debt_stale(ledger):
+	"""Ledger row is stale if missing or not recalculated within DEBT_STALE_AFTER_HOURS"""
+	if not ledger or not ledger.last_reconciled_on:
+		return True
+	age = now_datetime() - get_datetime(ledger.last_reconciled_on)
+	return age.total_seconds() > DEBT_STALE_AFTER_HOURS * 3600
+
+
+def _bulk_write_debts(changed, ledger_names, stamp):
+	"""
+	Write changed debts back with batched statements
+
+	Args:
+		changed: list of (customer, totals, debt)
+		ledger_names: set of customers that already have a ledger row
+		stamp: datetime used for modified / last_reconciled_on
+	"""
+	if not changed:
+		return
+
+	user = frappe.session.user
+	new_rows = [
+		(customer, customer, totals["billed_total"], totals["refunded_total"], totals["received_total"],
+			debt, stamp, stamp, stamp, user, user)
+		for customer, totals, debt in changed if customer not in ledger_names
+	]
+	if new_rows:
+		frappe.db.bulk_insert(
+			LEDGER_DOCTYPE,
+			fields=["name", "customer", "billed_total", "refunded_total", "received_total",
+				"debt", "last_reconciled_on", "creation", "modified", "owner", "modified_by"],
+			values=new_rows,
+			ignore_duplicates=True
+		)
+
+	existing = [row for row in changed if row[0] in ledger_names]
+	if existing:
+		case_sql = {}
+		values = []
+		for field in ("billed_total", "refunded_total", "received_total", "debt"):
+			case_sql[field] = "CASE name " + " ".join(["WHEN %s THEN %s"] * len(existing)) + " END"
+			for customer, totals, debt in existing:
+				values.extend([customer, debt if field == "debt" else totals[field]])
+		names = [row[0] for row in existing]
+		frappe.db.sql(f"""
+			UPDATE `tabCustomer Debt Ledger`
+			SET
+				billed_total = {case_sql["billed_total"]},
+				refunded_total = {case_sql["refunded_total"]},
+				received_total = {case_sql["received_total"]},
+				debt = {case_sql["debt"]}
+			WHERE name IN ({", ".join(["%s"] * len(names))})
+		""", (*values, *names))
+
+	customer_values = []
+	for customer, _totals, debt in changed:
+		customer_values.extend([customer, debt])
+	names = [row[0] for row in changed]
+	frappe.db.sql(f"""
+		UPDATE `tabCustomer`
+		SET custom_umumiy_qarz = CASE name {" ".join(["WHEN %s THEN %s"] * len(changed))} END
+		WHERE name IN ({", ".join(["%s"] * len(names))})
+	""", (*customer_values, *names))
+
+
+def bulk_recalculate_customer_debts(chunk_size=BULK_CHUNK_SIZE, publish_progress=False):
+	"""
+	Set-based recalculation of all customer debts
+
+	Works in chunks of customers: one grouped aggregation per source table,
+	diff against the ledger / custom_umumiy_qarz in memory, batched writes
+	for changed customers only and one commit per chunk.
+
+	Args:
+		chunk_size: Customers per chunk
+		publish_progress: Publish realtime progress (background job mode)
+
+	Returns:
+		dict: {"checked", "changed", "diff": [{"customer", "old_debt", "new_debt"}]}
+	"""
+	chunk_size = cint(chunk_size) or BULK_CHUNK_SIZE
+	customers = frappe.get_all("Customer", fields=["name", "custom_umumiy_qarz"], order_by="name", as_list=True)
+	ledger_rows = {
+		row.name: row for row in frappe.get_all(
+			LEDGER_DOCTYPE,
+			fields=["name", "billed_total", "refunded_total", "received_total", "debt"]
+		)
+	}
+
+	keys = ("billed_total", "refunded_total", "received_total")
+	diff = []
+	total = len(customers)
+
+	for start in range(0, total, chunk_size):
+		chunk = customers[start:start + chunk_size]
+		actual = _get_debt_totals([name for name, _debt in chunk])
+		stamp = now_datetime()
+		changed = []
+
+		for customer_name, current_debt in chunk:
+			totals = actual.get(customer_name) or dict.fromkeys(keys, 0.0)
+			ledger = ledger_rows.get(customer_name)
+			expected_debt = _calculate_debt(totals)
+
+			in_sync = ledger is not None and all(
+				abs(flt(ledger.get(key)) - flt(totals[key])) < 0.01 for key in keys
+			) and abs(flt(ledger.debt) - expected_debt) < 0.01 \
+				and abs(flt(current_debt) - expected_debt) < 0.01
+
+			if in_sync:
+				continue
+
+			changed.append((customer_name, totals, expected_debt))
+			diff.append({
+				"customer": customer_name,
+				"old_debt": flt(current_debt),
+				"new_debt": expected_debt
+			})
+
+		try:
+			_bulk_write_debts(changed, set(ledger_rows), stamp)
+			# Rows that were checked and found in sync are fresh as well
+			frappe.db.sql(f"""
+				UPDATE `tabCustomer Debt Ledger`
+				SET last_reconciled_on = %s
+				WHERE name IN ({", ".join(["%s"] * len(chunk))})
+			""", (stamp, *[name for name, _debt in chunk]))
+			frappe.db.commit()
+		except Exception as e:
+			frappe.db.rollback()
+			frappe.log_error(
+				f"Error recalculating debt chunk starting at {chunk[0][0]}: {str(e)}",
+				"Customer Debt Recalculation"
+			)
+
+		if publish_progress:
+			done = min(start + chunk_size, total)
+			frappe.publish_progress(
+				done * 100 / total,
+				title="Mijozlar qarzi qayta hisoblanmoqda",
+				description=f"{done} / {total}"
+			)
+
+	return {"checked": total, "changed": len(diff), "diff": diff}
+
+
+def reconcile_customer_debt_ledger():
+	"""
+	Scheduled: detect and repair drift between the ledger and the source documents
+
+	Recomputes all totals with grouped aggregations and rewrites only the
+	ledger rows (and custom_umumiy_qarz values) that differ.
+	"""
+	result = bulk_recalculate_customer_debts()
+
+	if result["changed"]:
+		frappe.log_error(
+			title="Customer Debt Ledger Drift",
+			message=f"Repaired {result['changed']} customers:\n{frappe.as_json(result['diff'][:200], indent=2)}"
+		)
+
+	return {"checked": result["checked"], "repaired": result["changed"]}
+
+
 @frappe.whitelist()
-def recalculate_all_customer_debts():
+def recalculate_all_customer_debts(background=False, chunk_size=BULK_CHUNK_SIZE):
 	"""
 	Utility function to recalculate debt for all customers
 	Useful for initial setup or data correction
+
+	Args:
+		background: Run as a long background job with realtime progress
+		chunk_size: Customers per grouped query / commit
 	"""
-	customers = frappe.get_all("Customer", pluck="name")
-	updated_count = 0
+	frappe.only_for("System Manager")
 
-	for customer_name in customers:
-		try:
-			update_customer_debt(customer_name)
-			updated_count += 1
-			frappe.db.commit()  # Commit after each customer
-		except Exception as e:
-			frappe.log_error(f"Error updating debt for {customer_name}: {str(e)}", "Customer Debt Recalculation")
+	if cint(background):
+		frappe.enqueue(
+			"cash_flow_app.utils.customer_debt.bulk_recalculate_customer_debts",
+			chunk_size=cint(chunk_size),
+			publish_progress=True,
+			queue="long",
+			timeout=3600,
+			job_id="bulk_recalculate_customer_debts",
+			deduplicate=True
+		)
+		frappe.msgprint("Qarzlarni qayta hisoblash fonda boshlandi", indicator="blue")
+		return {"queued": True}
 
-	frappe.msgprint(f"Updated debt for {updated_count} customers", indicator="green")
-	return f"Updated debt for {updated_count} customers"
+	result = bulk_recalculate_customer_debts(chunk_size=chunk_size)
+	frappe.msgprint(
+		f"Checked {result['checked']} customers, updated debt for {result['changed']}",
+		indicator="green"
+	)
+	return result
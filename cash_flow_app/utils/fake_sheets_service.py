@@ -0,0 +1,200 @@
+"""
+Fake Google Sheets service
+In-memory stand-in for the Sheets v4 client, for offline export benchmarks
+
+Implements the calls used by GoogleSheetsExporter (spreadsheets create /
+get / batchUpdate and values clear / update / append / batchUpdate / get)
+with an optional per-request latency, so the export pipeline (paging,
+prefetch threads, quota governor) can be measured without network access:
+
+	bench --site <site> execute cash_flow_app.utils.fake_sheets_service.benchmark_export \
+		--kwargs "{'latency': 0.2, 'requests_per_minute': 55}"
+"""
+import re
+import threading
+import time
+
+from frappe.utils import cint, flt
+
+_CELL_RE = re.compile(r"^([A-Z]+)(\d*)")
+
+
+def _parse_range(range_name):
+	"""
+	"'Sheet'!A5" → ("Sheet", 4, 0); "'Sheet'!A:Z" → ("Sheet", 0, 0)
+
+	Returns:
+		tuple: (sheet title, start row index, start column index)
+	"""
+	title, _, cells = range_name.rpartition("!")
+	if not title:
+		title, cells = cells, "A1"
+	title = title.strip("'")
+
+	match = _CELL_RE.match(cells.split(":")[0])
+	column = 0
+	for char in match.group(1) if match else "A":
+		column = column * 26 + ord(char) - ord("A") + 1
+	row = cint(match.group(2)) if match and match.group(2) else 1
+	return title, row - 1, column - 1
+
+
+class _Request:
+	"""Deferred call with execute(), like googleapiclient HttpRequest"""
+
+	def __init__(self, service, fn):
+		self.service = service
+		self.fn = fn
+
+	def execute(self):
+		with self.service.lock:
+			self.service.request_count += 1
+		if self.service.latency:
+			time.sleep(self.service.latency)
+		with self.service.lock:
+			return self.fn()
+
+
+class FakeSheetsService:
+	"""In-memory spreadsheets: {spreadsheet_id: {title: {"sheet_id", "rows"}}}"""
+
+	def __init__(self, latency=0.0):
+		self.latency = flt(latency)
+		self.lock = threading.Lock()
+		self.request_count = 0
+		self.cells_written = 0
+		self.spreadsheets_data = {}
+
+	def spreadsheets(self):
+		return _Spreadsheets(self)
+
+	def _sheet(self, spreadsheet_id, title):
+		sheets = self.spreadsheets_data[spreadsheet_id]
+		if title not in sheets:
+			sheets[title] = {"sheet_id": len(sheets), "rows": []}
+		return sheets[title]
+
+	def _describe(self, spreadsheet_id):
+		return {
+			"spreadsheetId": spreadsheet_id,
+			"sheets": [
+				{"properties": {"title": title, "sheetId": sheet["sheet_id"]}}
+				for title, sheet in self.spreadsheets_data[spreadsheet_id].items()
+			]
+		}
+
+	def _write(self, spreadsheet_id, range_name, values):
+		title, row, column = _parse_range(range_name)
+		rows = self._sheet(spreadsheet_id, title)["rows"]
+		for offset, values_row in enumerate(values):
+			while len(rows) <= row + offset:
+				rows.append([])
+			target = rows[row + offset]
+			while len(target) < column + len(values_row):
+				target.append("")
+			target[column:column + len(values_row)] = values_row
+			self.cells_written += len(values_row)
+		return {"updatedRows": len(values), "updatedRange": range_name}
+
+
+class _Spreadsheets:
+	def __init__(self, service):
+		self.service = service
+
+	def create(self, body):
+		def run():
+			spreadsheet_id = f"fake-{len(self.service.spreadsheets_data) + 1}"
+			self.service.spreadsheets_data[spreadsheet_id] = {}
+			for sheet in body.get("sheets", []):
+				self.service._sheet(spreadsheet_id, sheet["properties"]["title"])
+			return self.service._describe(spreadsheet_id)
+		return _Request(self.service, run)
+
+	def get(self, spreadsheetId):
+		return _Request(self.service, lambda: self.service._describe(spreadsheetId))
+
+	def batchUpdate(self, spreadsheetId, body):
+		def run():
+			replies = []
+			for request in body.get("requests", []):
+				if "addSheet" in request:
+					title = request["addSheet"]["properties"]["title"]
+					sheet = self.service._sheet(spreadsheetId, title)
+					replies.append({"addSheet": {"properties": {"title": title, "sheetId": sheet["sheet_id"]}}})
+				else:
+					# Formatting requests have no effect on the data
+					replies.append({})
+			return {"spreadsheetId": spreadsheetId, "replies": replies}
+		return _Request(self.service, run)
+
+	def values(self):
+		return _Values(self.service)
+
+
+class _Values:
+	def __init__(self, service):
+		self.service = service
+
+	def clear(self, spreadsheetId, range):
+		def run():
+			title, _row, _column = _parse_range(range)
+			self.service._sheet(spreadsheetId, title)["rows"] = []
+			return {"clearedRange": range}
+		return _Request(self.service, run)
+
+	def update(self, spreadsheetId, range, body, valueInputOption=None):
+		return _Request(self.service, lambda: self.service._write(spreadsheetId, range, body["values"]))
+
+	def append(self, spreadsheetId, range, body, valueInputOption=None, insertDataOption=None):
+		def run():
+			title, _row, _column = _parse_range(range)
+			start = len(self.service._sheet(spreadsheetId, title)["rows"]) + 1
+			return {"updates": self.service._write(spreadsheetId, f"'{title}'!A{start}", body["values"])}
+		return _Request(self.service, run)
+
+	def batchUpdate(self, spreadsheetId, body):
+		def run():
+			responses = [self.service._write(spreadsheetId, data["range"], data["values"]) for data in body["data"]]
+			return {"totalUpdatedRows": sum(r["updatedRows"] for r in responses), "responses": responses}
+		return _Request(self.service, run)
+
+	def get(self, spreadsheetId, range):
+		def run():
+			title, row, _column = _parse_range(range)
+			return {"range": range, "values": self.service._sheet(spreadsheetId, title)["rows"][row:]}
+		return _Request(self.service, run)
+
+
+def benchmark_export(latency=0.05, requests_per_minute=None):
+	"""
+	Run the full multi-sheet export against FakeSheetsService
+
+	Args:
+		latency: Simulated seconds per API request
+		requests_per_minute: Quota for the governor (None = unlimited)
+
+	Returns:
+		dict: elapsed seconds, API requests, retries, cells written and per-sheet results
+	"""
+	from cash_flow_app.google_sheets_integration import (
+		GoogleSheetsExporter,
+		SheetsQuotaGovernor,
+		_export_all_doctypes,
+	)
+
+	service = FakeSheetsService(latency=latency)
+	governor = SheetsQuotaGovernor(requests_per_minute=cint(requests_per_minute) or 10 ** 9)
+	exporter = GoogleSheetsExporter(service=service, governor=governor)
+	exporter.persist_sync_state = False
+
+	started = time.monotonic()
+	result = _export_all_doctypes(exporter)
+	elapsed = time.monotonic() - started
+
+	return {
+		"elapsed_seconds": round(elapsed, 3),
+		"api_requests": service.request_count,
+		"retries": governor.retry_count,
+		"cells_written": service.cells_written,
+		"results": result.get("results")
+	}
@@ -0,0 +1,284 @@
+"""
+FIFO Allocation Engine
+Shared payment → installment allocation for dashboard, bot and reminders
+
+All payments of a contract are pooled and consumed by installments in
+schedule order. Instead of walking the schedule with a running balance,
+each contract keeps the cumulative sum of its installments, so
+
+	paid[i]        = clamp(total_paid - cumulative_before[i], 0, amount[i])
+	first unpaid   = bisect(cumulative_end, total_paid)
+
+Schedules and paid totals for any number of contracts are loaded with a
+handful of grouped queries (chunked IN lists) and allocated in one pass.
+"""
+import time
+from bisect import bisect_right
+from itertools import accumulate
+
+import frappe
+from frappe.utils import flt
+
+# Contracts per IN (...) list in grouped loaders
+LOAD_CHUNK_SIZE = 1000
+
+# Outstanding below this is treated as fully paid (float noise)
+PAID_TOLERANCE = 0.005
+
+
+class ContractAllocation:
+	"""
+	FIFO allocation of one contract, backed by parallel lists
+
+	Attributes:
+		contract: Contract name (Sales Order / Installment Application)
+		total_paid: Net amount paid against the contract
+		idx, due_date, amount: Schedule columns in allocation order
+		cumulative: Cumulative scheduled amount at the end of each installment
+	"""
+
+	__slots__ = ("_pos", "amount", "contract", "cumulative", "due_date", "idx", "total_paid")
+
+	def __init__(self, contract, rows, total_paid):
+		self.contract = contract
+		self.total_paid = max(flt(total_paid), 0.0)
+		self.idx = [row.idx for row in rows]
+		self.due_date = [row.due_date for row in rows]
+		self.amount = [flt(row.payment_amount) for row in rows]
+		self.cumulative = list(accumulate(self.amount))
+		self._pos = {idx: pos for pos, idx in enumerate(self.idx)}
+
+	def paid(self, pos):
+		"""Amount allocated to the installment at list position pos"""
+		before = self.cumulative[pos] - self.amount[pos]
+		return min(max(self.total_paid - before, 0.0), self.amount[pos])
+
+	def outstanding(self, pos):
+		"""Unpaid part of the installment at list position pos"""
+		remaining = self.amount[pos] - self.paid(pos)
+		return remaining if remaining > PAID_TOLERANCE else 0.0
+
+	def status(self, pos):
+		"""'paid' | 'partial' | 'unpaid'"""
+		if self.outstanding(pos) <= 0:
+			return "paid"
+		return "partial" if self.paid(pos) > 0 else "unpaid"
+
+	def position(self, idx):
+		"""List position of schedule row idx (None if unknown)"""
+		return self._pos.get(idx)
+
+	def outstanding_for_idx(self, idx):
+		"""Unpaid part of schedule row idx"""
+		pos = self._pos.get(idx)
+		return self.outstanding(pos) if pos is not None else 0.0
+
+	def first_unpaid(self, min_outstanding=0.0):
+		"""
+		List position of the first installment that is not fully paid
+
+		Args:
+			min_outstanding: Skip installments whose outstanding is not above this
+
+		Returns:
+			int | None
+		"""
+		pos = bisect_right(self.cumulative, self.total_paid + PAID_TOLERANCE)
+		while pos < len(self.amount):
+			if self.outstanding(pos) > min_outstanding:
+				return pos
+			pos += 1
+		return None
+
+	@property
+	def total_scheduled(self):
+		return self.cumulative[-1] if self.cumulative else 0.0
+
+	@property
+	def total_outstanding(self):
+		return max(self.total_scheduled - self.total_paid, 0.0)
+
+	def installments(self):
+		"""
+		Per-installment allocation
+
+		Returns:
+			list: [{"idx", "due_date", "amount", "paid", "outstanding", "status"}]
+		"""
+		return [
+			{
+				"idx": self.idx[pos],
+				"due_date": self.due_date[pos],
+				"amount": self.amount[pos],
+				"paid": flt(self.paid(pos), 2),
+				"outstanding": flt(self.outstanding(pos), 2),
+				"status": self.status(pos)
+			}
+			for pos in range(len(self.amount))
+		]
+
+
+def _chunks(values, size=LOAD_CHUNK_SIZE):
+	values = list(values)
+	for start in range(0, len(values), size):
+		yield values[start:start + size]
+
+
+def get_schedules(contract_ids, parenttype=None, order_by_due_date=False):
+	"""
+	Payment Schedule rows of many contracts, grouped by contract
+
+	Args:
+		contract_ids: Contract (parent) names
+		parenttype: Optional parenttype filter ('Sales Order', 'Installment Application')
+		order_by_due_date: Order by due_date, idx instead of idx
+
+	Returns:
+		dict: {contract: [row(idx, due_date, payment_amount)]}
+	"""
+	schedules = {}
+	contract_ids = {c for c in contract_ids if c}
+	if not contract_ids:
+		return schedules
+
+	parenttype_condition = "AND parenttype = %(parenttype)s" if parenttype else ""
+	order_by = "parent, due_date, idx" if order_by_due_date else "parent, idx"
+
+	for chunk in _chunks(contract_ids):
+		rows = frappe.db.sql(f"""
+			SELECT parent, idx, due_date, payment_amount
+			FROM `tabPayment Schedule`
+			WHERE parent IN %(contracts)s
+			{parenttype_condition}
+			ORDER BY {order_by}
+		""", {"contracts": tuple(chunk), "parenttype": parenttype}, as_dict=True)
+
+		for row in rows:
+			schedules.setdefault(row.parent, []).append(row)
+
+	return schedules
+
+
+def get_net_paid_by_contract(contract_ids):
+	"""
+	Net paid amount per contract
+	Receive qo'shiladi, Pay ayiriladi (customerga pul qaytarilsa)
+
+	Read from the materialized Contract Balance rows (primary-key lookup);
+	contracts without a row fall back to aggregating Payment Entry.
+
+	Args:
+		contract_ids: Sales Order names
+
+	Returns:
+		dict: {contract: net_paid}
+	"""
+	paid = {}
+	contract_ids = {c for c in contract_ids if c}
+	if not contract_ids:
+		return paid
+
+	for chunk in _chunks(contract_ids):
+		for contract_id, net_paid in frappe.db.sql("""
+			SELECT name, net_paid
+			FROM `tabContract Balance`
+			WHERE name IN %(contracts)s
+		""", {"contracts": tuple(chunk)}):
+			paid[contract_id] = flt(net_paid)
+
+	missing = contract_ids - set(paid)
+	if missing:
+		paid.update(aggregate_net_paid(missing))
+	return paid
+
+
+def aggregate_net_paid(contract_ids):
+	"""
+	Net paid amount per contract aggregated from Payment Entry (custom_contract_reference)
+
+	Args:
+		contract_ids: Sales Order names
+
+	Returns:
+		dict: {contract: net_paid}
+	"""
+	paid = {}
+	contract_ids = {c for c in contract_ids if c}
+	if not contract_ids:
+		return paid
+
+	for chunk in _chunks(contract_ids):
+		for contract_id, total_paid in frappe.db.sql("""
+			SELECT
+				custom_contract_reference,
+				COALESCE(SUM(CASE WHEN payment_type = 'Receive' THEN paid_amount ELSE -paid_amount END), 0)
+			FROM `tabPayment Entry`
+			WHERE custom_contract_reference IN %(contracts)s
+			  AND docstatus = 1
+			  AND payment_type IN ('Receive', 'Pay')
+			GROUP BY custom_contract_reference
+		""", {"contracts": tuple(chunk)}):
+			paid[contract_id] = flt(total_paid)
+
+	return paid
+
+
+def allocate(schedules, paid_totals):
+	"""
+	FIFO-allocate paid totals over schedules for many contracts at once
+
+	Args:
+		schedules: {contract: [row(idx, due_date, payment_amount)]}
+		paid_totals: {contract: net_paid}
+
+	Returns:
+		dict: {contract: ContractAllocation}
+	"""
+	return {
+		contract: ContractAllocation(contract, rows, paid_totals.get(contract, 0.0))
+		for contract, rows in schedules.items()
+		if rows
+	}
+
+
+def allocate_contracts(contract_ids, parenttype=None):
+	"""Load schedules + net paid for Sales Order contracts and allocate them"""
+	contract_ids = list(contract_ids)
+	return allocate(
+		get_schedules(contract_ids, parenttype=parenttype),
+		get_net_paid_by_contract(contract_ids)
+	)
+
+
+def benchmark_all_active_contracts():
+	"""
+	Allocate every active contract in one pass and report timings
+
+	Usage:
+		bench --site SITE execute cash_flow_app.utils.fifo_allocation.benchmark_all_active_contracts
+	"""
+	started = time.perf_counter()
+	contract_ids = frappe.get_all(
+		"Sales Order",
+		filters={"docstatus": 1, "status": ["not in", ["Cancelled", "Completed", "Closed"]]},
+		pluck="name"
+	)
+	schedules = get_schedules(contract_ids, parenttype="Sales Order")
+	paid_totals = get_net_paid_by_contract(contract_ids)
+	loaded = time.perf_counter()
+
+	allocations = allocate(schedules, paid_totals)
+	open_installments = sum(
+		1 for allocation in allocations.values() if allocation.first_unpaid() is not None
+	)
+	finished = time.perf_counter()
+
+	result = {
+		"contracts": len(allocations),
+		"installments": sum(len(a.amount) for a in allocations.values()),
+		"contracts_with_debt": open_installments,
+		"load_seconds": round(loaded - started, 3),
+		"allocate_seconds": round(finished - loaded, 3)
+	}
+	print(frappe.as_json(result, indent=2))
+	return result
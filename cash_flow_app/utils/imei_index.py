@@ -0,0 +1,203 @@
+"""
+IMEI Search Index
+Suffix index over Installment Application Item IMEI / serial numbers
+
+`imei LIKE '%term%'` cannot use an index, so every IMEI lookup scanned all
+Installment Application Items. Every suffix of a normalized IMEI (at least
+MIN_TERM_LENGTH characters) is stored as its own indexed row:
+
+	351234567890123 → 351234567890123, 51234567890123, ..., 123
+
+so "contains term" becomes a B-tree prefix range scan, joined into the
+caller's query so its filters, ORDER BY and LIMIT apply to all matches:
+
+	INNER JOIN `tabIMEI Search Index` isi
+		ON isi.item_row = iai.name AND isi.suffix LIKE 'term%'
+
+- Installment Application save / submit / cancel / delete: rows of that application rebuilt
+- Item IMEI change (synced into draft applications): those applications rebuilt
+- Weekly + patch: full rebuild, application by application (the index
+  stays usable meanwhile), then rows of removed applications are dropped
+"""
+import re
+
+import frappe
+from frappe.utils import cint, now_datetime
+
+from cash_flow_app.utils.fifo_allocation import _chunks
+
+INDEX_DOCTYPE = "IMEI Search Index"
+
+# Shorter suffixes are not indexed (and shorter terms are not searched by index)
+MIN_TERM_LENGTH = 3
+
+# Applications per grouped load in the full rebuild
+REBUILD_CHUNK_SIZE = 500
+
+# Result limits
+REPORT_LIMIT = 500
+TYPEAHEAD_LIMIT = 20
+
+# Join for queries over `tabInstallment Application Item` iai
+# (select DISTINCT iai.name: several suffixes of one IMEI can match)
+INDEX_JOIN = """
+	INNER JOIN `tabIMEI Search Index` isi
+		ON isi.item_row = iai.name AND isi.suffix LIKE %(imei_prefix)s
+"""
+
+_NON_ALNUM = re.compile(r"[^0-9A-Z]")
+
+
+def normalize_imei(value):
+	"""Uppercase, only letters and digits ("35-1234 56" → "35123456")"""
+	return _NON_ALNUM.sub("", (value or "").upper())
+
+
+def get_suffixes(imei):
+	"""Indexed suffixes of a normalized IMEI"""
+	return [imei[start:] for start in range(len(imei) - MIN_TERM_LENGTH + 1)]
+
+
+# ============================================================
+# MAINTENANCE
+# ============================================================
+
+def index_applications(application_names):
+	"""
+	Rebuild the index rows of Installment Applications
+	(cancelled / deleted applications are only removed)
+
+	Args:
+		application_names: Installment Application names
+
+	Returns:
+		int: Number of index rows written
+	"""
+	application_names = [name for name in set(application_names) if name]
+	if not application_names:
+		return 0
+
+	frappe.db.delete(INDEX_DOCTYPE, {"installment_application": ("in", application_names)})
+
+	items = frappe.db.sql("""
+		SELECT iai.name, iai.parent, iai.imei
+		FROM `tabInstallment Application Item` iai
+		INNER JOIN `tabInstallment Application` ia ON ia.name = iai.parent
+		WHERE iai.parent IN %(applications)s
+		  AND iai.parenttype = 'Installment Application'
+		  AND ia.docstatus < 2
+		  AND IFNULL(iai.imei, '') != ''
+	""", {"applications": tuple(application_names)}, as_dict=True)
+
+	stamp = now_datetime()
+	user = frappe.session.user
+	values = [
+		(frappe.generate_hash(length=12), suffix, item.imei, item.parent, item.name,
+			stamp, stamp, user, user)
+		for item in items
+		for suffix in get_suffixes(normalize_imei(item.imei))
+	]
+	if values:
+		frappe.db.bulk_insert(
+			INDEX_DOCTYPE,
+			fields=["name", "suffix", "imei", "installment_application", "item_row",
+				"creation", "modified", "owner", "modified_by"],
+			values=values
+		)
+	return len(values)
+
+
+def rebuild_imei_index():
+	"""
+	Scheduled (weekly): rebuild the whole index from Installment Application Items
+
+	Each chunk replaces only its own applications' rows and is committed on
+	its own, so searches keep working during the rebuild.
+	"""
+	applications = frappe.get_all(
+		"Installment Application", filters={"docstatus": ("<", 2)}, pluck="name"
+	)
+
+	written = 0
+	for chunk in _chunks(applications, REBUILD_CHUNK_SIZE):
+		written += index_applications(chunk)
+		frappe.db.commit()
+
+	# Bekor qilingan / o'chirilgan shartnomalar qatorlari
+	frappe.db.sql("""
+		DELETE isi
+		FROM `tabIMEI Search Index` isi
+		LEFT JOIN `tabInstallment Application` ia
+			ON ia.name = isi.installment_application AND ia.docstatus < 2
+		WHERE ia.name IS NULL
+	""")
+	frappe.db.commit()
+
+	frappe.logger().info(f"✅ [IMEI-INDEX] {len(applications)} ta shartnoma, {written} ta qator")
+	return written
+
+
+def update_imei_index(doc, method=None):
+	"""Hook: Installment Application on_update / on_update_after_submit / on_cancel / on_trash"""
+	if method == "on_trash":
+		frappe.db.delete(INDEX_DOCTYPE, {"installment_application": doc.name})
+		return
+
+	index_applications([doc.name])
+
+
+# ============================================================
+# SEARCH
+# ============================================================
+
+def get_search_prefix(term):
+	"""
+	Value for %(imei_prefix)s in INDEX_JOIN
+
+	Args:
+		term: Search text (normalized like the index)
+
+	Returns:
+		str | None: LIKE prefix pattern, None if the term is too short for the index
+	"""
+	term = normalize_imei(term)
+	if len(term) < MIN_TERM_LENGTH:
+		return None
+	return f"{term}%"
+
+
+@frappe.whitelist()
+def imei_typeahead(txt, limit=TYPEAHEAD_LIMIT):
+	"""
+	IMEI typeahead for the counter
+
+	Args:
+		txt: Part of an IMEI / serial number (at least MIN_TERM_LENGTH characters)
+		limit: Max results (capped at TYPEAHEAD_LIMIT * 5)
+
+	Returns:
+		list: [{"item_row", "imei", "item_name", "installment_application", "customer_name",
+			"docstatus", "transaction_date"}]
+	"""
+	frappe.has_permission("Installment Application", "read", throw=True)
+
+	limit = min(cint(limit) or TYPEAHEAD_LIMIT, TYPEAHEAD_LIMIT * 5)
+	prefix = get_search_prefix(txt)
+	if not prefix:
+		return []
+
+	return frappe.db.sql(f"""
+		SELECT DISTINCT
+			iai.name AS item_row,
+			iai.imei,
+			iai.item_name,
+			ia.name AS installment_application,
+			ia.customer_name,
+			ia.docstatus,
+			ia.transaction_date
+		FROM `tabInstallment Application Item` iai
+		{INDEX_JOIN}
+		INNER JOIN `tabInstallment Application` ia ON ia.name = iai.parent
+		ORDER BY ia.transaction_date DESC
+		LIMIT %(limit)s
+	""", {"imei_prefix": prefix, "limit": limit}, as_dict=True)
@@ -0,0 +1,355 @@
+"""
+Telegram Outbox
+Persistent outbound message queue for all Telegram sends
+
+Hooks and scheduled jobs only insert rows into `Telegram Outbox`; a
+background worker drains the queue after commit with a pooled HTTP
+session, bounded concurrency and Telegram rate limits:
+
+- global: GLOBAL_RATE_PER_SECOND messages per second
+- per chat: one message per PRIVATE_CHAT_INTERVAL (GROUP_CHAT_INTERVAL for groups)
+- 429 → retry after Telegram's retry_after, 5xx / network → exponential backoff
+- dedup_key (unique) makes repeated queueing of the same message a no-op
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import frappe
+from frappe.utils import add_to_date, cint, now_datetime
+from frappe.utils.password import get_decrypted_password
+
+OUTBOX_DOCTYPE = "Telegram Outbox"
+
+# Delivery tuning (Telegram Bot API limits)
+MAX_CONCURRENCY = 8
+GLOBAL_RATE_PER_SECOND = 25
+PRIVATE_CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 3.0
+REQUEST_TIMEOUT = 10
+
+# Retry policy
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 30
+
+# Worker limits
+DRAIN_BATCH_SIZE = 300
+DRAIN_TIME_BUDGET_SECONDS = 15 * 60
+STALE_CLAIM_MINUTES = 20
+KEEP_SENT_DAYS = 30
+
+_session = None
+_session_lock = threading.Lock()
+
+
+# ============================================================
+# QUEUEING
+# ============================================================
+
+def queue_message(chat_id, text, bot="Customer", dedup_key=None, reference_doctype=None,
+		reference_name=None, parse_mode="HTML"):
+	"""Queue a single Telegram message (see queue_messages)"""
+	return queue_messages([{
+		"chat_id": chat_id,
+		"text": text,
+		"bot": bot,
+		"dedup_key": dedup_key,
+		"reference_doctype": reference_doctype,
+		"reference_name": reference_name,
+		"parse_mode": parse_mode
+	}])
+
+
+def queue_messages(messages):
+	"""
+	Insert messages into the outbox and schedule a drain after commit
+
+	Args:
+		messages: list of dicts with chat_id, text and optional bot ("Customer" / "Admin"),
+			dedup_key, reference_doctype, reference_name, parse_mode
+
+	Returns:
+		int: Number of messages passed to the outbox (duplicates are ignored by the DB)
+	"""
+	now = now_datetime()
+	user = frappe.session.user
+	values = [
+		(
+			frappe.generate_hash(length=12), "Queued", m.get("bot") or "Customer", str(m["chat_id"]),
+			m.get("dedup_key"), m["text"], m.get("parse_mode") or "HTML",
+			m.get("reference_doctype"), m.get("reference_name"), 0, now, now, now, user, user
+		)
+		for m in messages
+		if m.get("chat_id") and m.get("text")
+	]
+	if not values:
+		return 0
+
+	frappe.db.bulk_insert(
+		OUTBOX_DOCTYPE,
+		fields=["name", "status", "bot", "chat_id", "dedup_key", "text", "parse_mode",
+			"reference_doctype", "reference_name", "attempts", "next_attempt_at",
+			"creation", "modified", "owner", "modified_by"],
+		values=values,
+		ignore_duplicates=True
+	)
+
+	_enqueue_drain(after_commit=True)
+	return len(values)
+
+
+def _enqueue_drain(after_commit=False):
+	frappe.enqueue(
+		"cash_flow_app.utils.telegram_outbox.drain_outbox",
+		queue="long",
+		timeout=DRAIN_TIME_BUDGET_SECONDS + 300,
+		job_id="telegram_outbox_drain",
+		deduplicate=True,
+		enqueue_after_commit=after_commit
+	)
+
+
+def schedule_drain():
+	"""Scheduled (every tick): start a drain job if due messages are waiting"""
+	if frappe.db.exists(OUTBOX_DOCTYPE, {
+		"status": ["in", ["Queued", "Sending"]],
+		"next_attempt_at": ["<=", now_datetime()]
+	}):
+		_enqueue_drain()
+
+
+# ============================================================
+# DELIVERY
+# ============================================================
+
+class _RateLimiter:
+	"""Thread-safe global token bucket + per-chat minimum interval"""
+
+	def __init__(self, rate_per_second):
+		self.interval = 1.0 / rate_per_second
+		self.lock = threading.Lock()
+		self.next_slot = time.monotonic()
+
+	def acquire(self):
+		with self.lock:
+			now = time.monotonic()
+			slot = max(self.next_slot, now)
+			self.next_slot = slot + self.interval
+		delay = slot - time.monotonic()
+		if delay > 0:
+			time.sleep(delay)
+
+
+def _get_session():
+	"""Process-wide pooled HTTP session"""
+	global _session
+	if _session is None:
+		with _session_lock:
+			if _session is None:
+				import requests
+				from requests.adapters import HTTPAdapter
+
+				session = requests.Session()
+				adapter = HTTPAdapter(pool_connections=2, pool_maxsize=MAX_CONCURRENCY)
+				session.mount("https://", adapter)
+				_session = session
+	return _session
+
+
+def _get_bot_tokens():
+	"""{"Customer": token, "Admin": token} from Cash Settings"""
+	tokens = {"Customer": frappe.db.get_single_value("Cash Settings", "telegram_bot_token")}
+	try:
+		tokens["Admin"] = get_decrypted_password(
+			"Cash Settings", "Cash Settings", "telegram_notification_bot_token"
+		)
+	except Exception:
+		tokens["Admin"] = None
+	return tokens
+
+
+def _chat_interval(chat_id):
+	# Group / channel IDs are negative
+	return GROUP_CHAT_INTERVAL if str(chat_id).startswith("-") else PRIVATE_CHAT_INTERVAL
+
+
+def _send_one(session, token, row):
+	"""
+	POST one message
+
+	Returns:
+		tuple: (outcome, error, retry_after) where outcome is "sent" | "retry" | "failed"
+	"""
+	import requests
+
+	try:
+		response = session.post(
+			f"https://api.telegram.org/bot{token}/sendMessage",
+			json={"chat_id": row.chat_id, "text": row.text, "parse_mode": row.parse_mode or "HTML"},
+			timeout=REQUEST_TIMEOUT
+		)
+	except requests.exceptions.RequestException as e:
+		return "retry", str(e)[:500], None
+
+	if response.status_code == 200:
+		return "sent", None, None
+
+	error = f"{response.status_code} - {response.text[:500]}"
+	if response.status_code == 429:
+		try:
+			retry_after = cint(response.json().get("parameters", {}).get("retry_after"))
+		except ValueError:
+			retry_after = 0
+		return "retry", error, retry_after or None
+	if response.status_code >= 500:
+		return "retry", error, None
+
+	# 400 / 403 (bot bloklangan, noto'g'ri chat) - qayta urinish foydasiz
+	return "failed", error, None
+
+
+def _deliver(rows, tokens):
+	"""
+	Send rows concurrently; messages of one chat are sent in order by one worker
+
+	Returns:
+		dict: {row.name: (outcome, error, retry_after)}
+	"""
+	session = _get_session()
+	limiter = _RateLimiter(GLOBAL_RATE_PER_SECOND)
+	results = {}
+
+	by_chat = {}
+	for row in rows:
+		by_chat.setdefault((row.bot, row.chat_id), []).append(row)
+
+	def send_chat(chat_rows):
+		chat_results = {}
+		blocked = None
+		last_sent = None
+		for row in chat_rows:
+			token = tokens.get(row.bot)
+			if not token:
+				chat_results[row.name] = ("failed", f"{row.bot} bot token topilmadi", None)
+				continue
+			if blocked:
+				# Chat rate-limited / unreachable in this batch: keep order, retry later
+				chat_results[row.name] = blocked
+				continue
+
+			if last_sent is not None:
+				wait = _chat_interval(row.chat_id) - (time.monotonic() - last_sent)
+				if wait > 0:
+					time.sleep(wait)
+			limiter.acquire()
+
+			outcome = _send_one(session, token, row)
+			last_sent = time.monotonic()
+			chat_results[row.name] = outcome
+			if outcome[0] == "retry":
+				blocked = outcome
+		return chat_results
+
+	with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+		for chat_results in executor.map(send_chat, by_chat.values()):
+			results.update(chat_results)
+
+	return results
+
+
+def _release_stale_claims():
+	"""Rows left in Sending by a crashed worker go back to the queue"""
+	frappe.db.sql("""
+		UPDATE `tabTelegram Outbox`
+		SET status = 'Queued'
+		WHERE status = 'Sending'
+		AND modified < %s
+	""", (add_to_date(now_datetime(), minutes=-STALE_CLAIM_MINUTES),))
+	frappe.db.commit()
+
+
+def _claim_batch():
+	"""Mark the next due batch as Sending and return it"""
+	now = now_datetime()
+	rows = frappe.db.sql("""
+		SELECT name, bot, chat_id, text, parse_mode, attempts
+		FROM `tabTelegram Outbox`
+		WHERE status = 'Queued'
+		AND (next_attempt_at IS NULL OR next_attempt_at <= %s)
+		ORDER BY creation
+		LIMIT %s
+	""", (now, DRAIN_BATCH_SIZE), as_dict=True)
+	if not rows:
+		return []
+
+	names = [row.name for row in rows]
+	frappe.db.sql(f"""
+		UPDATE `tabTelegram Outbox`
+		SET status = 'Sending', modified = %s
+		WHERE status = 'Queued'
+		AND name IN ({", ".join(["%s"] * len(names))})
+	""", (now, *names))
+	frappe.db.commit()
+	return rows
+
+
+def _record_results(rows, results):
+	"""Persist delivery outcomes; retries are rescheduled with backoff"""
+	now = now_datetime()
+	for row in rows:
+		outcome, error, retry_after = results.get(row.name, ("retry", "Natija yo'q", None))
+		attempts = cint(row.attempts) + 1
+
+		if outcome == "sent":
+			values = {"status": "Sent", "sent_on": now, "attempts": attempts, "last_error": None}
+		elif outcome == "retry" and attempts < MAX_ATTEMPTS:
+			delay = retry_after or BACKOFF_BASE_SECONDS * (2 ** (attempts - 1))
+			values = {
+				"status": "Queued",
+				"attempts": attempts,
+				"next_attempt_at": now + timedelta(seconds=delay),
+				"last_error": error
+			}
+		else:
+			values = {"status": "Failed", "attempts": attempts, "last_error": error}
+
+		frappe.db.set_value(OUTBOX_DOCTYPE, row.name, values)
+	frappe.db.commit()
+
+
+def drain_outbox():
+	"""
+	Background worker: send queued messages until the queue is empty or
+	DRAIN_TIME_BUDGET_SECONDS is used up (scheduler picks up the rest)
+	"""
+	started = time.monotonic()
+	_release_stale_claims()
+	tokens = _get_bot_tokens()
+	sent = failed = 0
+
+	while time.monotonic() - started < DRAIN_TIME_BUDGET_SECONDS:
+		rows = _claim_batch()
+		if not rows:
+			break
+
+		results = _deliver(rows, tokens)
+		_record_results(rows, results)
+
+		sent += sum(1 for outcome in results.values() if outcome[0] == "sent")
+		failed += sum(1 for outcome in results.values() if outcome[0] == "failed")
+
+	if sent or failed:
+		frappe.logger().info(f"✅ [TELEGRAM-OUTBOX] sent={sent} failed={failed}")
+
+	return {"sent": sent, "failed": failed}
+
+
+def cleanup_outbox():
+	"""Scheduled: delete delivered messages older than KEEP_SENT_DAYS"""
+	frappe.db.sql("""
+		DELETE FROM `tabTelegram Outbox`
+		WHERE status = 'Sent'
+		AND sent_on < %s
+	""", (add_to_date(now_datetime(), days=-KEEP_SENT_DAYS),))
+	frappe.db.commit()
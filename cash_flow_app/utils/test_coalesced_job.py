@@ -0,0 +1,54 @@
+# Copyright (c) 2025, AsadStack and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from cash_flow_app.utils import coalesced_job
+
+KEY = "test_coalesced_job::wakeup"
+METHOD = "cash_flow_app.utils.test_coalesced_job.noop"
+
+
+def noop():
+	pass
+
+
+class TestCoalescedJob(FrappeTestCase):
+	def setUp(self):
+		coalesced_job._clear_pending(KEY)
+		coalesced_job._release(KEY)
+
+	def tearDown(self):
+		coalesced_job._clear_pending(KEY)
+		coalesced_job._release(KEY)
+
+	def test_request_enqueues_once_while_owned(self):
+		with patch.object(frappe, "enqueue") as enqueue:
+			coalesced_job.request(KEY, METHOD)
+			coalesced_job.request(KEY, METHOD)
+
+		self.assertEqual(enqueue.call_count, 1)
+		self.assertTrue(coalesced_job._is_pending(KEY))
+
+	def test_request_between_checks_is_not_lost(self):
+		"""A request after the job's last check, before it releases, runs another round"""
+		rounds = []
+		release = coalesced_job._release
+
+		def release_after_request(key):
+			if len(rounds) == 1:
+				# Job hali egasi - claim muvaffaqiyatsiz, job qo'yilmaydi
+				coalesced_job.request(KEY, METHOD)
+			release(key)
+
+		with patch.object(frappe, "enqueue") as enqueue:
+			coalesced_job.request(KEY, METHOD)
+			with patch.object(coalesced_job, "_release", side_effect=release_after_request):
+				coalesced_job.run(KEY, lambda: rounds.append(1))
+
+		self.assertEqual(enqueue.call_count, 1)
+		self.assertEqual(len(rounds), 2)
+		self.assertFalse(coalesced_job._is_pending(KEY))